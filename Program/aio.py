@@ -0,0 +1,204 @@
+"""
+File: aio.py
+Runs a TuringMachine as an asyncio coroutine instead of a thread,
+so a single event loop can drive many simulations at once.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import asyncio
+import inspect
+
+from tm import TuringMachine, STEP_STATE
+
+
+"""
+A TuringMachine driven by an event loop. It accepts the same arguments as a TuringMachine
+(and supports the same features, like limits, traces, histories and profiles), but instead
+of calling start(), the simulation is run by awaiting run_async(), or by scheduling it
+as a task (see start_async).
+The listener and the batch listener can be normal functions or coroutine functions,
+in which case they're awaited before the simulation continues.
+
+[speed] = the number of steps per second, like for a TuringMachine. The machine waits
+          between steps with asyncio.sleep, so the loop can run other tasks meanwhile.
+[yield_every] = when the speed is -1 (realtime), the machine gives control back to the loop
+                after this many cycles (of 4 steps each), so other tasks aren't blocked
+The machine is controlled like a TuringMachine (with pause, resume, step, run_until, breakpoints,
+set_speed and cancel), but these methods must be called from the machine's event loop.
+Use wait_paused_async to wait until the machine pauses or stops.
+"""
+class AsyncMachine(TuringMachine):
+    def __init__(self, program=None, speed=4, listener=None, yield_every=1000, **options):
+        TuringMachine.__init__(self, program, speed, listener, **options)
+        self.yield_every = yield_every
+        self.wakeup = asyncio.Event()  #replaces the threading.Event of the TuringMachine
+        self.paused_event = asyncio.Event()  #set while the machine is paused or stopped
+        self.task = None
+
+
+    """
+    The coroutine that runs the whole simulation, like TuringMachine.run.
+    Returns the machine's RunResult.
+    """
+    async def run_async(self):
+        steps = self.prepare()
+        until_yield = self.yield_every
+        while self.running:
+            if self.steps >= self.check_at:
+                if self.check_control():
+                    await self.wait_resume_async()
+                    continue
+            step_type = self.phase
+            steps[step_type]()
+            self.phase = (step_type + 1) % len(steps)
+            await self.post_step_async(step_type)
+
+            if self.speed == -1 and step_type == STEP_STATE:
+                until_yield -= 1
+                if until_yield <= 0:
+                    await asyncio.sleep(0)
+                    until_yield = self.yield_every
+
+        self.finish()
+        return self.result
+
+
+    """
+    The asynchronous version of TuringMachine.wait_resume
+    """
+    async def wait_resume_async(self):
+        self.paused_event.set()
+        while self.paused and self.running:
+            self.wakeup.clear()
+            await self.wakeup.wait()
+
+
+    """
+    The asynchronous version of TuringMachine.post_step
+    """
+    async def post_step_async(self, step_type):
+        self.record_step(step_type)
+
+        if self.listener != None and self.should_notify(step_type):
+            notified = self.listener(self, step_type)
+            if inspect.isawaitable(notified):
+                await notified
+
+        if self.batch_listener != None and self.collect_batch(step_type):
+            notified = self.flush_batch()
+            if inspect.isawaitable(notified):
+                await notified
+
+        if hasattr(self, 'error'):
+            self.finish()
+            raise RuntimeError(self.error)
+
+        if self.speed != -1:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), 1/float(self.speed))
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+
+    """
+    Schedules the simulation as a task on the running event loop, and returns the task
+    """
+    def start_async(self):
+        self.task = asyncio.ensure_future(self.run_async())
+        return self.task
+
+
+    def notify_control(self):
+        TuringMachine.notify_control(self)
+        if not self.paused:
+            self.paused_event.clear()
+
+
+    """
+    Waits until the machine is paused or stopped
+    """
+    async def wait_paused_async(self):
+        await self.paused_event.wait()
+
+
+    def finish(self):
+        TuringMachine.finish(self)
+        self.paused_event.set()
+
+
+
+#Test Code
+if __name__ == "__main__":
+    import copy
+    import time
+    import programs
+    from tm import run_to_halt
+
+    program = programs.plist.get("Multiplication")
+    expected = run_to_halt(copy.deepcopy(program))
+
+    async def main():
+        notified = list()
+
+        async def listener(tm, step_type):
+            notified.append(tm.steps)
+
+        #many machines share the same thread, while one of them is paused for a while
+        machines = [AsyncMachine(copy.deepcopy(program), speed=-1, yield_every=10,
+                                 listener=listener, listen_steps=[STEP_STATE]) for i in range(200)]
+        tasks = [machine.start_async() for machine in machines]
+        await asyncio.sleep(0)  #let them start
+        machines[0].pause()
+        await asyncio.sleep(0.05)
+        paused_steps = machines[0].steps
+        machines[0].resume()
+        results = await asyncio.gather(*tasks)
+
+        same = all([list(tape) for tape in result.tapes] == [list(tape) for tape in expected.tapes]
+                   and result.steps == expected.steps for result in results)
+        print("200 machines on one loop: %s, %d notifications, the paused one stayed at step %d"
+              % ("OK" if same else "MISMATCH", len(notified), paused_steps))
+
+        #a machine running alone gives control back to the loop once every yield_every cycles
+        yields = [0]
+        longer = copy.deepcopy(program)
+        longer.set_tapes(list("11" + "1" * 60), list("11" + "01" * 30), [])
+        machine = AsyncMachine(longer, speed=-1, yield_every=100)
+
+        async def count_yields():
+            while machine.result == None:
+                yields[0] += 1
+                await asyncio.sleep(0)
+
+        counter = asyncio.ensure_future(count_yields())
+        await machine.start_async()
+        await counter
+        print("Yielded %d times in %d cycles: %s" % (yields[0], machine.steps,
+              "OK" if abs(yields[0] - machine.steps // 100) <= 2 else "MISMATCH"))
+
+        #step a machine, and run it until a state
+        machine = AsyncMachine(copy.deepcopy(program), speed=-1)
+        machine.pause()
+        task = machine.start_async()
+        await machine.wait_paused_async()
+        machine.step(10)
+        await machine.wait_paused_async()
+        stepped = machine.steps
+        state = program.actions[-1]['state']
+        machine.run_until(state=state)
+        await machine.wait_paused_async()
+        print("Stepped to %d, then ran until state '%s': %s" % (stepped, machine.current_state,
+              "OK" if machine.current_state == state else "MISMATCH"))
+        machine.resume()
+        result = await task
+        print("Resumed: %d steps, %s" % (result.steps, "OK" if result.steps == expected.steps else "MISMATCH"))
+
+    start = time.time()
+    asyncio.run(main())
+    print("%.2fs" % (time.time() - start))
@@ -0,0 +1,340 @@
+"""
+File: analysis.py
+Checks a program's rules before running it (unreachable states, duplicate, conflicting or unused
+rules, missing transitions), and builds a smaller program with the same behaviour.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import collections
+import itertools
+
+from tm import TuringProgram
+
+
+#stands for every value that isn't part of the program's alphabet, which only wildcard rules can match
+OTHER_VALUE = None
+
+
+"""
+The results of analyzing a program (see analyze).
+[states] = every state used by the program, in the order they first appear
+[reachable_states] = the states that can be reached from the initial state (including it)
+[unreachable_states] = the other states. Their rules can never run.
+[duplicate_actions] = (action id, id of the earlier action) pairs, for the rules that repeat the
+                      state and read values of an earlier rule, with the same effect
+[conflicting_actions] = the same, for the rules with a different effect, which are silently ignored,
+                        since the earlier rule always wins
+[unused_actions] = the ids of the rules that no combination of values would ever select
+                   (the duplicates above, and wildcard rules covered by earlier rules)
+[missing_transitions] = the (state, read values) pairs, for every reachable state and combination
+                        of the alphabet's values, without a matching rule (the machine stops with
+                        an error if it reaches one of them)
+[equivalent_states] = the groups of reachable states that behave the same way, so they can be merged.
+                      Each group is a list, and its first state is the one kept by minimize.
+"""
+class Analysis:
+    def __init__(self, program):
+        self.program = program
+        self.states = list()
+        self.reachable_states = list()
+        self.unreachable_states = list()
+        self.duplicate_actions = list()
+        self.conflicting_actions = list()
+        self.unused_actions = list()
+        self.missing_transitions = list()
+        self.equivalent_states = list()
+
+
+    """
+    Returns a readable summary of the problems found. Only the first [top] missing transitions are listed.
+    """
+    def report(self, top=10):
+        lines = ["%d states (%d reachable), %d rules" % (len(self.states), len(self.reachable_states),
+                                                         len(self.program.actions))]
+        if self.unreachable_states:
+            lines.append("Unreachable states: " + ', '.join(self.unreachable_states))
+        for action_id, first_id in self.duplicate_actions:
+            lines.append("Rule %d repeats rule %d" % (action_id, first_id))
+        for action_id, first_id in self.conflicting_actions:
+            lines.append("Rule %d conflicts with rule %d, which is used instead" % (action_id, first_id))
+        shadowed = [action_id for action_id in self.unused_actions
+                    if action_id not in set(pair[0] for pair in self.duplicate_actions + self.conflicting_actions)]
+        if shadowed:
+            lines.append("Rules covered by earlier ones: " + ', '.join(str(action_id) for action_id in shadowed))
+        if self.missing_transitions:
+            lines.append("%d missing transitions:" % len(self.missing_transitions))
+            for state, read_values in self.missing_transitions[:top]:
+                lines.append("  %s %s" % (state, ','.join(read_values)))
+            if len(self.missing_transitions) > top:
+                lines.append("  ...")
+        for group in self.equivalent_states:
+            if len(group) > 1:
+                lines.append("Equivalent states: " + ', '.join(group))
+        return '\n'.join(lines)
+
+
+
+"""
+Returns the number of tapes used by [program]
+"""
+def get_tape_count(program):
+    if program.tapes:
+        return len(program.tapes)
+    if program.actions:
+        return len(program.actions[0]['read_values'])
+    return 0
+
+
+"""
+Returns every combination of values the heads of [program] can read, as tuples.
+When the program uses wildcards, OTHER_VALUE is included too, for the values outside the alphabet.
+"""
+def get_combinations(program):
+    values = program.get_symbols()
+    if program.symbol_any != None:
+        values.append(OTHER_VALUE)
+    return list(itertools.product(values, repeat=get_tape_count(program)))
+
+
+"""
+Returns the action [program] runs in [state] for [read_values], like TuringProgram.get_action,
+but without adding it to the program's wildcard cache
+"""
+def find_action(program, state, read_values):
+    action = program.action_index.get((state, read_values))
+    if action == None and state in program.wildcard_actions:
+        action = program.resolve_wildcard(state, read_values)
+    return action
+
+
+"""
+Analyzes [program] and returns an Analysis.
+Every state is checked with every combination of the alphabet's values (see get_combinations),
+so the work grows with the number of values to the power of the number of tapes.
+"""
+def analyze(program):
+    analysis = Analysis(program)
+    final = program.state_final
+
+    #the states, in the order they first appear
+    states = [program.state_initial]
+    for action in program.actions:
+        states.append(action['state'])
+        states.append(action['next_state'])
+    states.append(final)
+    seen = set()
+    for state in states:
+        if state not in seen:
+            seen.add(state)
+            analysis.states.append(state)
+
+    #the rules with the same state and read values as an earlier one
+    first_actions = dict()
+    for action in program.actions:
+        key = (action['state'], tuple(action['read_values']))
+        if key not in first_actions:
+            first_actions[key] = action
+            continue
+        first = first_actions[key]
+        if (first['write_values'], first['directions'], first['next_state']) == \
+           (action['write_values'], action['directions'], action['next_state']):
+            analysis.duplicate_actions.append((action['id'], first['id']))
+        else:
+            analysis.conflicting_actions.append((action['id'], first['id']))
+
+    #the action selected for each combination of values, in each state
+    combinations = get_combinations(program)
+    transitions = dict()
+    used = set()
+    for state in analysis.states:
+        if state == final:
+            continue
+        transitions[state] = [find_action(program, state, values) for values in combinations]
+        used.update(action['id'] for action in transitions[state] if action != None)
+    analysis.unused_actions = [action['id'] for action in program.actions if action['id'] not in used]
+
+    #the reachable states, following only the rules that can be selected
+    reachable = set([program.state_initial])
+    pending = [program.state_initial]
+    while pending:
+        state = pending.pop()
+        for action in transitions.get(state, ()):
+            if action != None and action['next_state'] not in reachable:
+                reachable.add(action['next_state'])
+                pending.append(action['next_state'])
+    analysis.reachable_states = [state for state in analysis.states if state in reachable]
+    analysis.unreachable_states = [state for state in analysis.states if state not in reachable]
+
+    for state in analysis.reachable_states:
+        if state == final:
+            continue
+        for values, action in zip(combinations, transitions[state]):
+            if action == None and OTHER_VALUE not in values:
+                analysis.missing_transitions.append((state, values))
+
+    analysis.equivalent_states = find_equivalent_states(program, analysis.reachable_states, transitions)
+    return analysis
+
+
+"""
+Groups the [states] that behave the same way, by partition refinement: the states start grouped
+by what their rules write and how they move, for every combination of values (see get_combinations).
+Then, the groups are split by the groups of the rules' next states, until no group changes.
+The groups are numbered again after each round, so their keys stay small.
+The final state is always kept alone, since the machine stops there.
+[transitions] = maps each state to the actions it selects for each combination
+Returns the groups as lists of states. Each group starts with its initial state, if it's
+in the group, otherwise with its first state in the order of [states].
+"""
+def find_equivalent_states(program, states, transitions):
+    final = program.state_final
+
+    def effect(action):
+        if action == None:
+            return None
+        return (tuple(action['write_values']), tuple(action['directions']))
+
+    #replaces the keys of [keys] (which maps states to keys) with the numbers of their groups
+    def number(keys):
+        ids = dict((key, nr) for nr, key in enumerate(collections.OrderedDict.fromkeys(keys.values())))
+        return dict((state, ids[key]) for state, key in keys.items()), len(ids)
+
+    keys = dict()
+    for state in states:
+        if state == final:
+            keys[state] = ('final',)
+        else:
+            keys[state] = ('effects', tuple(effect(action) for action in transitions[state]))
+    groups, count = number(keys)
+
+    while True:
+        keys = dict()
+        for state in states:
+            if state == final:
+                keys[state] = (groups[state],)
+                continue
+            next_groups = tuple(groups.get(action['next_state']) if action != None else None
+                                for action in transitions[state])
+            keys[state] = (groups[state], next_groups)
+        groups, refined_count = number(keys)
+        if refined_count == count:
+            break
+        count = refined_count
+
+    members = collections.OrderedDict()
+    for state in states:
+        members.setdefault(groups[state], list()).append(state)
+    result = list()
+    for group in members.values():
+        if program.state_initial in group:
+            group.remove(program.state_initial)
+            group.insert(0, program.state_initial)
+        result.append(group)
+    return result
+
+
+"""
+Returns a new program that behaves like [program], but with fewer rules: the rules of unreachable
+states and the unused rules are dropped, and each group of equivalent states is merged into its
+first state (see Analysis.equivalent_states).
+Any input runs the same cycles on both programs, with the same tapes, head positions, step count
+and outcome (halting or the missing rule error). Only the names of the merged states (reported
+while the machine hasn't halted) and the ids of the rules differ.
+"""
+def minimize(program, analysis=None):
+    if analysis == None:
+        analysis = analyze(program)
+    names = dict()  #maps each state to the one that replaces it
+    for group in analysis.equivalent_states:
+        for state in group:
+            names[state] = group[0]
+    unused = set(analysis.unused_actions)
+
+    result = TuringProgram(program.name)
+    result.set_alphabet(program.input_values, program.symbol_blank)
+    result.set_directions(program.dir_left, program.dir_right, program.dir_none)
+    result.set_limit_states(program.state_initial, program.state_final)
+    result.set_wildcard(program.symbol_any)
+    result.set_tapes(*[list(tape) for tape in program.tapes])
+    for action in program.actions:
+        state = action['state']
+        if action['id'] in unused or state not in names or names[state] != state:
+            continue
+        result.add_action(state, list(action['read_values']), list(action['write_values']),
+                          list(action['directions']), names.get(action['next_state'], action['next_state']))
+    return result
+
+
+
+#Test Code
+if __name__ == "__main__":
+    import copy
+    import random
+    import time
+    import programs
+    from tm import run_to_halt
+    from compiler import compile_program
+
+    def summary(result):
+        return ([''.join(tape).strip(program.symbol_blank) for tape in result.tapes], result.tapes_pos,
+                result.steps, result.halted, result.error != None)
+
+    #an Addition with redundant rules: a copy of the "add" state used after a carry,
+    #an unreachable state, a repeated rule, a conflicting one and a wildcard rule that's never used
+    redundant = programs.plist.get("Addition")
+    lines = list()
+    for action in redundant.actions:
+        line = "%s %s %s %s %s" % (action['state'], ','.join(action['read_values']),
+                                   ','.join(action['write_values']), ','.join(action['directions']),
+                                   action['next_state'])
+        lines.append(line.replace("add", "add-copy") if action['state'] == 'carry' else line)
+        if action['state'] == 'add':
+            lines.append(line.replace("add", "add-copy"))
+    lines += ["move 0,0,_ 0,0,_ >,>,> move",
+              "move 0,1,_ 1,1,_ >,>,> move",
+              "lost _,_,_ 1,1,1 -,-,- move",
+              "move *,*,* *,*,* -,-,- halt",
+              "move *,*,_ *,*,* -,-,- move"]
+    redundant = TuringProgram("Redundant Addition")
+    redundant.set_tapes(list("101001"), list("101101"), [])
+    redundant.set_limit_states('move', 'halt')
+    redundant.set_wildcard('*')
+    redundant.set_actions('\n'.join(lines))
+
+    generator = random.Random(0)
+    for program in list(programs.plist) + [redundant]:
+        analysis = analyze(program)
+        print("%s: %s" % (program.name, analysis.report().replace('\n', '\n    ')))
+        minimized = minimize(program, analysis)
+
+        #run both programs on the same random inputs
+        values = program.input_values + program.symbol_blank
+        same = True
+        for i in range(300):
+            tapes = [[generator.choice(values) for j in range(generator.randint(0, 8))] if tape else []
+                     for tape in program.tapes]
+            original = copy.deepcopy(program)
+            original.set_tapes(*tapes)
+            smaller = copy.deepcopy(minimized)
+            smaller.set_tapes(*tapes)
+            if summary(run_to_halt(original, 5000)) != summary(run_to_halt(smaller, 5000)):
+                same = False
+        print("    minimized to %d rules, %d states in the compiled table (was %d): %s"
+              % (len(minimized.actions), len(compile_program(minimized).states),
+                 len(compile_program(program).states), "OK" if same else "MISMATCH"))
+
+    #a chain of states that only differ by their distance to the final state needs a round of
+    #refinement for each state, which stays fast since the groups are numbered again every round
+    chain = TuringProgram("Chain")
+    chain.set_tapes(list("1" * 60))
+    chain.set_limit_states('s0', 'halt')
+    chain.set_actions('\n'.join(["s%d 1 1 > s%d" % (nr, nr + 1) for nr in range(59)] + ["s59 1 1 - halt"]))
+    start = time.time()
+    analysis = analyze(chain)
+    print("Chain of 60 states: %d groups in %.2fs: %s" % (len(analysis.equivalent_states), time.time() - start,
+          "OK" if len(analysis.equivalent_states) == 61 else "MISMATCH"))
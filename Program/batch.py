@@ -0,0 +1,116 @@
+"""
+File: batch.py
+Runs many independent inputs through the same program, using a pool of worker processes.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from compiler import CompiledProgram, compile_program, run_compiled
+
+
+#the compiled program used by the current worker process, set by init_worker
+worker_program = None
+
+
+"""
+Run once in each worker process, so the compiled program is only sent once per worker,
+instead of once per job.
+"""
+def init_worker(compiled):
+    global worker_program
+    worker_program = compiled
+
+
+"""
+Runs a single job in a worker process, and returns its id along with the RunResult
+"""
+def run_job(job_id, tapes, max_steps, max_seconds, accelerate):
+    return job_id, run_compiled(worker_program, tapes, max_steps, accelerate, max_seconds)
+
+
+"""
+Runs [program] (a TuringProgram or a CompiledProgram) once for each item of [jobs],
+which is an iterable of tape lists (each tape being a Tape or a sequence of values).
+The program's own tapes aren't used or modified.
+
+The jobs are spread over [workers] processes (by default, one for each CPU), and the results
+are yielded as (job number, RunResult) pairs as soon as they are ready, so they aren't
+necessarily in the same order as the jobs.
+[max_steps] and [max_seconds] limit each job (see run_compiled). A job that reaches a limit
+isn't an error, its result just isn't halted.
+[accelerate] enables the accelerated mode of run_compiled.
+[pending] is the maximum number of jobs submitted at once (by default, 4 for each worker),
+so [jobs] can be a long generator.
+"""
+def run_batch(program, jobs, max_steps=None, max_seconds=None, accelerate=False,
+              workers=None, pending=None):
+    if isinstance(program, CompiledProgram):
+        compiled = program
+    else:
+        compiled = compile_program(program)
+
+    if workers == None:
+        workers = multiprocessing.cpu_count()
+    if pending == None:
+        pending = workers * 4
+
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(compiled,)) as executor:
+        jobs = enumerate(jobs)
+        running = set()
+        finished = False
+        while True:
+            #keep the pool busy, without submitting all the jobs at once
+            while not finished and len(running) < pending:
+                try:
+                    job_id, tapes = next(jobs)
+                except StopIteration:
+                    finished = True
+                    break
+                running.add(executor.submit(run_job, job_id, tapes, max_steps, max_seconds, accelerate))
+
+            if not running:
+                break
+
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+"""
+Generates [count] random inputs for [program], similar to the GUI's value generator:
+every tape that isn't empty in the program gets a random value made of its input values,
+with a length between [min_length] and [max_length], while the empty tapes stay empty.
+"""
+def random_inputs(program, count, min_length=4, max_length=10, seed=None):
+    generator = random.Random(seed)
+    for i in range(count):
+        tapes = list()
+        for tape in program.tapes:
+            value = list()
+            if len(tape) > 0:
+                for j in range(generator.randint(min_length, max_length)):
+                    value.append(generator.choice(program.input_values))
+            tapes.append(value)
+        yield tapes
+
+
+
+#Test Code
+if __name__ == "__main__":
+    import programs
+
+    for program in programs.plist:
+        if program.name in ("Palindrome Checker", "Addition"):
+            halted = 0
+            for job_id, result in run_batch(program, random_inputs(program, 2000, seed=0)):
+                if result.halted:
+                    halted += 1
+            print("%s: %d of 2000 inputs halted" % (program.name, halted))
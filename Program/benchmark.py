@@ -0,0 +1,342 @@
+#!/usr/bin/env python2
+
+"""
+File: benchmark.py
+Measures the speed of the simulator's engines and building blocks.
+Run it directly to benchmark every program in programs.plist (see --help for the options),
+optionally comparing the results with a baseline from a previous run.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import argparse
+import copy
+import json
+import platform
+import random
+import sys
+import time
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from tm import TuringProgram, TuringMachine, run_to_halt
+from compiler import compile_program, run_compiled, run_packed
+from jit import jit_program, run_jit
+import programs
+
+
+#the input lengths used by default: 10, 100, ... 10^6
+LENGTHS = [10 ** power for power in range(1, 7)]
+
+#the default maximum number of steps for each run, since some programs
+#(like Multiplication) need a number of steps quadratic in the input's length
+MAX_STEPS = 200000
+
+#short runs are repeated for at least this many seconds, and the fastest one is kept
+MIN_TIME = 0.2
+
+#how much slower (or larger) a result can be than the baseline before being flagged
+TOLERANCE = 0.1
+
+
+"""
+The action lookup used before the program had an index, a linear scan of all the actions.
+Kept here as a reference point for the lookup benchmark.
+"""
+def scan_action(program, state, read_values):
+    for action in program.actions:
+        if action['state'] == state and action['read_values'] == read_values:
+            return action
+    return None
+
+
+"""
+Builds a single tape program with [rule_count] rules over the given [symbols].
+The rules are shuffled, so the lookups are spread over the whole table.
+"""
+def synthetic_program(rule_count=10000, symbols="0123456789", seed=0):
+    rand = random.Random(seed)
+    program = TuringProgram("Synthetic (%d rules)" % rule_count)
+    program.set_alphabet(symbols, '_')
+
+    rules = list()
+    state_count = rule_count // len(symbols) + 1
+    for state_nr in range(state_count):
+        for symbol in symbols:
+            rules.append(("s%d" % state_nr, symbol))
+    rules = rules[:rule_count]
+    rand.shuffle(rules)
+
+    for state, symbol in rules:
+        program.add_action(state, [symbol], [rand.choice(symbols)], [rand.choice('<>')],
+                           "s%d" % rand.randrange(state_count))
+    return program
+
+
+"""
+Returns a list of (state, read_values) pairs, taken from the program's own rules,
+to be used as lookup keys.
+"""
+def lookup_keys(program, count=1000, seed=0):
+    rand = random.Random(seed)
+    keys = list()
+    for i in range(count):
+        action = rand.choice(program.actions)
+        keys.append((action['state'], list(action['read_values'])))
+    return keys
+
+
+"""
+Times the indexed get_action against the linear scan, for the given program.
+Returns a dict with the average time per lookup (in microseconds) for each method.
+"""
+def bench_lookup(program, count=1000, repeat=3):
+    keys = lookup_keys(program, count)
+
+    def indexed():
+        for state, read_values in keys:
+            program.get_action(state, read_values)
+
+    def scanned():
+        for state, read_values in keys:
+            scan_action(program, state, read_values)
+
+    results = dict(program=program.name, rules=len(program.actions))
+    for name, function in (('index', indexed), ('scan', scanned)):
+        best = min(timeit.repeat(function, number=1, repeat=repeat))
+        results[name] = best / count * 1e6
+    return results
+
+
+
+"""
+The engines that can be benchmarked. Each one runs [program] on its own tapes,
+for at most [max_steps] steps, and returns a RunResult.
+"""
+def run_machine(program, max_steps):
+    machine = TuringMachine(program, speed=-1, max_steps=max_steps)
+    machine.start()
+    machine.join()
+    return machine.result
+
+
+def run_reference(program, max_steps):
+    return run_to_halt(program, max_steps)
+
+
+def run_compiler(program, max_steps):
+    return run_compiled(compile_program(program), None, max_steps)
+
+
+def run_accelerated(program, max_steps):
+    return run_compiled(compile_program(program), None, max_steps, accelerate=True)
+
+
+def run_packer(program, max_steps):
+    return run_packed(compile_program(program), None, max_steps)
+
+
+def run_jitted(program, max_steps):
+    return run_jit(jit_program(program), None, max_steps)
+
+
+ENGINES = [("machine", run_machine),
+           ("run_to_halt", run_reference),
+           ("compiled", run_compiler),
+           ("accelerated", run_accelerated),
+           ("packed", run_packer),
+           ("jit", run_jitted)]
+
+
+"""
+Generates the tapes for running [program] with an input of the given [length]:
+each tape that isn't empty in the program gets [length] random input values,
+while the empty ones stay empty. Programs that only accept some inputs get a generator
+of their own in INPUT_GENERATORS.
+"""
+def generate_input(program, length, seed=0):
+    generator = INPUT_GENERATORS.get(program.name)
+    if generator != None:
+        return generator(program, length, random.Random(seed))
+
+    rand = random.Random(seed)
+    tapes = list()
+    for tape in program.tapes:
+        if len(tape) > 0:
+            tapes.append([rand.choice(program.input_values) for i in range(length)])
+        else:
+            tapes.append([])
+    return tapes
+
+
+def palindrome_input(program, length, rand):
+    half = [rand.choice(program.input_values) for i in range(length // 2)]
+    middle = [rand.choice(program.input_values)] if length % 2 else []
+    return [half + middle + half[::-1], []]
+
+
+#the example program only halts when both numbers start with 11
+def multiplication_input(program, length, rand):
+    return [list("11") + [rand.choice("01") for i in range(length - 2)] for tape in range(2)] + [[]]
+
+
+INPUT_GENERATORS = {"Palindrome Checker": palindrome_input,
+                    "Multiplication": multiplication_input}
+
+
+"""
+Returns a copy of [program] (sharing its actions) that uses the given [tapes]
+"""
+def with_tapes(program, tapes):
+    program = copy.copy(program)
+    program.tapes = [list(tape) for tape in tapes]
+    return program
+
+
+"""
+Benchmarks a single [engine] (a function from ENGINES) on [program], with the given [tapes].
+Three kinds of runs are made: a single step, to measure the time until the first step is done
+(including any setup, like compiling the program), timed runs (repeated for at least MIN_TIME
+seconds, keeping the fastest one), and a run with tracemalloc enabled, to measure the peak memory
+(in bytes, or None if tracemalloc isn't available).
+"""
+def bench_engine(engine, program, tapes, max_steps=MAX_STEPS):
+    start = time.time()
+    engine(with_tapes(program, tapes), 1)
+    first_step = time.time() - start
+
+    seconds = None
+    total = 0
+    while total < MIN_TIME:
+        run_program = with_tapes(program, tapes)
+        start = time.time()
+        result = engine(run_program, max_steps)
+        elapsed = time.time() - start
+        total += elapsed
+        if seconds == None or elapsed < seconds:
+            seconds = elapsed
+
+    peak_memory = None
+    if tracemalloc != None:
+        run_program = with_tapes(program, tapes)
+        tracemalloc.start()
+        try:
+            engine(run_program, max_steps)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return dict(steps=result.steps, status=result.status, seconds=seconds,
+                steps_per_sec=result.steps / seconds if seconds > 0 else None,
+                first_step=first_step, peak_memory=peak_memory)
+
+
+"""
+Runs every engine (or only the ones named in [engines]) on every program of [program_list],
+with inputs of each of the given [lengths]. Yields a dict for each combination, with the program
+name, the input length, the engine name and the measurements from bench_engine.
+"""
+def run_suite(program_list=None, lengths=LENGTHS, engines=None, max_steps=MAX_STEPS):
+    if program_list == None:
+        program_list = programs.plist
+    for program in program_list:
+        for length in lengths:
+            tapes = generate_input(program, length)
+            for name, engine in ENGINES:
+                if engines != None and name not in engines:
+                    continue
+                results = dict(program=program.name, length=length, engine=name)
+                results.update(bench_engine(engine, program, tapes, max_steps))
+                yield results
+
+
+"""
+Compares the [results] of run_suite with the ones from a [baseline] (in the same format),
+matching them by program, length and engine. Returns a list of (results, baseline results, reason)
+tuples, for each result that's slower or uses more memory than the baseline by more than [tolerance].
+"""
+def find_regressions(results, baseline, tolerance=TOLERANCE):
+    previous = dict()
+    for item in baseline:
+        previous[(item['program'], item['length'], item['engine'])] = item
+
+    regressions = list()
+    for item in results:
+        old = previous.get((item['program'], item['length'], item['engine']))
+        if old == None:
+            continue
+        if old['steps_per_sec'] and item['steps_per_sec'] \
+           and item['steps_per_sec'] < old['steps_per_sec'] * (1 - tolerance):
+            regressions.append((item, old, "speed"))
+        if old['peak_memory'] and item['peak_memory'] \
+           and item['peak_memory'] > old['peak_memory'] * (1 + tolerance):
+            regressions.append((item, old, "memory"))
+    return regressions
+
+
+def format_results(item):
+    memory = "-" if item['peak_memory'] == None else "%.1f KB" % (item['peak_memory'] / 1024.0)
+    return "%-20s %8d %-12s %9d steps %12.0f steps/s  first step %8.2f ms  peak %s" \
+           % (item['program'], item['length'], item['engine'], item['steps'],
+              item['steps_per_sec'] or 0, item['first_step'] * 1000, memory)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the simulator's engines on the example programs.")
+    parser.add_argument("--programs", nargs="+", help="the names of the programs to run (all by default)")
+    parser.add_argument("--engines", nargs="+", choices=[name for name, engine in ENGINES],
+                        help="the engines to run (all by default)")
+    parser.add_argument("--lengths", nargs="+", type=int, default=LENGTHS, help="the input lengths")
+    parser.add_argument("--max-steps", type=int, default=MAX_STEPS, help="the maximum number of steps per run")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this JSON file, from a previous run")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="the allowed slowdown or memory growth, compared to the baseline")
+    parser.add_argument("--lookup", action="store_true", help="only benchmark the action lookup")
+    arguments = parser.parse_args()
+
+    if arguments.lookup:
+        multiplication = programs.plist.get("Multiplication")
+        for program in (multiplication, synthetic_program(10000)):
+            results = bench_lookup(program)
+            print("%(program)s, %(rules)d rules: index %(index).2f us/lookup, scan %(scan).2f us/lookup"
+                  % results)
+        sys.exit(0)
+
+    program_list = programs.plist
+    if arguments.programs:
+        program_list = [programs.plist.get(name) for name in arguments.programs]
+
+    results = list()
+    for item in run_suite(program_list, arguments.lengths, arguments.engines, arguments.max_steps):
+        print(format_results(item))
+        results.append(item)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(dict(python=platform.python_version(), platform=platform.platform(),
+                           time=time.time(), max_steps=arguments.max_steps, results=results), file, indent=1)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)['results']
+        regressions = find_regressions(results, baseline, arguments.tolerance)
+        for item, old, reason in regressions:
+            if reason == "speed":
+                print("REGRESSION (speed): %s, length %d, %s: %.0f steps/s, was %.0f"
+                      % (item['program'], item['length'], item['engine'], item['steps_per_sec'], old['steps_per_sec']))
+            else:
+                print("REGRESSION (memory): %s, length %d, %s: %d bytes, was %d"
+                      % (item['program'], item['length'], item['engine'], item['peak_memory'], old['peak_memory']))
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
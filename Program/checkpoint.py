@@ -0,0 +1,224 @@
+"""
+File: checkpoint.py
+Snapshots of a running machine's configuration, which can be saved to a file
+and used to resume the simulation later, even in another process.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import json
+import os
+import struct
+
+from tapes import ByteTape, SparseTape, PAGE_SIZE
+
+
+MAGIC = b'TMSNAP01'
+
+#os.replace overwrites an existing file on every platform, but it's missing in Python 2,
+#where os.rename does the same outside of Windows
+replace = getattr(os, 'replace', os.rename)
+
+
+"""
+The full configuration of a TuringMachine at a given moment.
+[program_hash] = the hash of the program (see TuringProgram.get_hash), used to make sure
+                 a snapshot is resumed with the same program
+[program_name] = the program's name, for reference
+[state] = the machine's current state
+[phase] = the next step the machine will run (STEP_READ at the start of a cycle)
+[action_id] = the id of the current action, if the machine is in the middle of a cycle
+[tapes_pos] = the position of each head
+[steps] = the number of cycles run so far
+[tapes] = the tapes, as ByteTapes, or as SparseTapes for the tapes that are sparse,
+          so only their pages are copied
+"""
+class Snapshot:
+    def __init__(self, program_hash, program_name, state, phase, action_id, tapes_pos, steps, tapes):
+        self.program_hash = program_hash
+        self.program_name = program_name
+        self.state = state
+        self.phase = phase
+        self.action_id = action_id
+        self.tapes_pos = tapes_pos
+        self.steps = steps
+        self.tapes = tapes
+
+
+    """
+    Writes the snapshot to [path]. The file contains:
+        MAGIC, the header's length (4 bytes, little endian), the header (as JSON),
+        the cells of each tape (a byte per cell, see ByteTape)
+    For a SparseTape, only its pages are written (PAGE_SIZE cells each, in the order
+    of the page numbers listed in the header), so the file doesn't grow with its blank regions.
+    To avoid leaving a partial file behind if the process is stopped while saving,
+    the data is written to a temporary file first, which then replaces [path].
+    """
+    def save(self, path):
+        offset = 0
+        tapes = list()
+        for tape in self.tapes:
+            if tape.sparse:
+                pages = sorted(tape.pages)
+                tapes.append(dict(start=tape.start, length=len(tape), offset=offset,
+                                  symbols=get_page_symbols(tape), pages=pages))
+                offset += len(pages) * PAGE_SIZE
+            else:
+                tapes.append(dict(start=tape.start, length=len(tape), offset=offset, symbols=tape.symbols))
+                offset += len(tape)
+
+        header = dict(program_hash=self.program_hash, program_name=self.program_name,
+                      state=self.state, phase=self.phase, action_id=self.action_id,
+                      tapes_pos=self.tapes_pos, steps=self.steps, tapes=tapes)
+        header = json.dumps(header).encode('utf-8')
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(MAGIC + struct.pack('<I', len(header)) + header)
+            for tape, info in zip(self.tapes, tapes):
+                if tape.sparse:
+                    codes = dict((symbol, code) for code, symbol in enumerate(info['symbols']))
+                    for page_nr in info['pages']:
+                        file.write(bytearray(codes[value] for value in tape.pages[page_nr]))
+                else:
+                    file.write(tape.view())  #written directly from the tape's memory
+        replace(temp_path, path)
+
+
+
+"""
+Returns the values used in the pages of [tape], a SparseTape, starting with its blank value
+(like the symbols of a ByteTape)
+"""
+def get_page_symbols(tape):
+    symbols = [tape.blank]
+    known = set(symbols)
+    for page in tape.pages.values():
+        for value in set(page) - known:
+            known.add(value)
+            symbols.append(value)
+    if len(symbols) > 256:
+        raise ValueError("A snapshot can't hold more than 256 different values on a tape")
+    return symbols
+
+
+
+"""
+Captures the configuration of [machine], a TuringMachine that's paused or stopped
+(otherwise the configuration could change while it's being copied).
+"""
+def take_snapshot(machine):
+    program = machine.program
+    symbols = program.get_symbols()
+    tapes = list()
+    for tape in program.tapes:
+        if isinstance(tape, ByteTape) or tape.sparse:
+            tapes.append(tape.copy())
+        else:
+            tapes.append(ByteTape(tape, program.symbol_blank, tape.start, symbols))
+
+    action_id = None
+    if machine.current_action != None:
+        action_id = machine.current_action['id']
+    return Snapshot(program.get_hash(), program.name, machine.current_state, machine.phase, action_id,
+                    list(machine.tapes_pos), machine.steps, tapes)
+
+
+"""
+Shortcut for taking a snapshot of [machine] and saving it to [path]
+"""
+def save_snapshot(machine, path):
+    snapshot = take_snapshot(machine)
+    snapshot.save(path)
+    return snapshot
+
+
+"""
+Loads a snapshot saved to [path].
+The tapes are read one at a time, straight after the header, so only one of them is in memory twice
+(as the data read from the file and as its ByteTape).
+"""
+def load_snapshot(path):
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("'%s' is not a snapshot file" % path)
+        length = struct.unpack('<I', file.read(4))[0]
+        header = json.loads(file.read(length).decode('utf-8'))
+
+        tapes = list()
+        for tape in header['tapes']:  #the tapes are stored in order, one after the other
+            if 'pages' in tape:
+                tapes.append(read_sparse_tape(file, tape, path))
+                continue
+            codes = file.read(tape['length'])
+            if len(codes) != tape['length']:
+                raise ValueError("'%s' is truncated" % path)
+            tapes.append(ByteTape.from_codes(codes, tape['symbols'], tape['start']))
+
+    return Snapshot(header['program_hash'], header['program_name'], header['state'], header['phase'],
+                    header['action_id'], header['tapes_pos'], header['steps'], tapes)
+
+
+"""
+Reads the pages of a SparseTape from [file], as described by [info] (its entry in the header)
+"""
+def read_sparse_tape(file, info, path):
+    symbols = info['symbols']
+    tape = SparseTape(blank=symbols[0], start=info['start'])
+    tape.end = info['start'] + info['length']
+    for page_nr in info['pages']:
+        codes = file.read(PAGE_SIZE)
+        if len(codes) != PAGE_SIZE:
+            raise ValueError("'%s' is truncated" % path)
+        tape.pages[page_nr] = [symbols[code] for code in bytearray(codes)]
+    return tape
+
+
+
+#Test Code
+if __name__ == "__main__":
+    import tempfile
+    import programs
+    from tm import TuringMachine, STEP_READ, STEP_WRITE, run_to_halt
+
+    program = programs.plist.get("Multiplication")
+    expected = run_to_halt(program)
+    folder = tempfile.mkdtemp()
+
+    #take a snapshot in the middle of a cycle, after the read and after the write step...
+    def snapshot_listener(tm, step_type):
+        if tm.steps == 20 and step_type in (STEP_READ, STEP_WRITE):
+            save_snapshot(tm, os.path.join(folder, "step%d.snapshot" % step_type))
+    first = TuringMachine(program, speed=-1, listener=snapshot_listener)
+    first.run()
+
+    #...and resume from it, as if nothing happened
+    for step_type in (STEP_READ, STEP_WRITE):
+        second = TuringMachine(program, speed=-1,
+                               resume=load_snapshot(os.path.join(folder, "step%d.snapshot" % step_type)))
+        second.run()
+        same = [list(tape) for tape in second.result.tapes] == [list(tape) for tape in expected.tapes] \
+               and (second.result.tapes_pos, second.steps) == (expected.tapes_pos, expected.steps)
+        print("Resumed at step 20 (phase %d), halted after %d steps: %s"
+              % (step_type + 1, second.steps, "OK" if same else "MISMATCH"))
+
+    #a snapshot of a wide, mostly blank tape only stores its pages
+    sparse_program = programs.plist.get("Inversion")
+    sparse_program.set_tapes(list("10" * 100))
+    def far_listener(tm, step_type):
+        if tm.steps == 150 and step_type == STEP_READ:
+            tm.program.tapes[0].reach(tm.tapes_pos[0] + 10000000)  #as if the machine had gone far away
+            save_snapshot(tm, os.path.join(folder, "sparse.snapshot"))
+    first = TuringMachine(sparse_program, speed=-1, listener=far_listener, sparse_tapes=True)
+    first.run()
+    path = os.path.join(folder, "sparse.snapshot")
+    snapshot = load_snapshot(path)
+    second = TuringMachine(sparse_program, speed=-1, resume=snapshot)
+    second.run()
+    print("Sparse tape of %d cells saved in %d bytes, resumed: %s"
+          % (len(snapshot.tapes[0]), os.path.getsize(path),
+             "OK" if second.result.tapes[0].trimmed() == first.result.tapes[0].trimmed() else "MISMATCH"))
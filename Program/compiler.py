@@ -0,0 +1,691 @@
+#!/usr/bin/env python2
+
+"""
+File: compiler.py
+Turns a TuringProgram into a compact, integer coded transition table,
+and runs that table directly, without any string comparisons.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import itertools
+import time
+from array import array
+
+from tm import RunResult, STATUS_TIME_LIMIT
+from tapes import ByteTape, copy_tape
+
+
+#tables with more entries than this are stored in a dict, instead of a dense array
+DENSE_TABLE_LIMIT = 1 << 22
+
+#how many cells are added at once when a tape needs to grow
+TAPE_CHUNK = 1024
+
+#how many loop iterations are run between checks of the time limit
+TIME_CHECK_INTERVAL = 4096
+
+
+"""
+Used for transition tables that are too big to be stored densely.
+Missing entries return [default], like the empty slots (-1) of a dense table.
+"""
+class SparseTable(dict):
+    def __init__(self, default=-1):
+        dict.__init__(self)
+        self.default = default
+
+    def __missing__(self, key):
+        return self.default
+
+
+"""
+A TuringProgram, compiled into integer coded arrays.
+States and symbols are interned to small numbers (the blank symbol is always 0),
+and directions become -1, 0 or +1.
+
+Each (state, read values) combination has a key:
+    state * stride + symbol_0 + symbol_1 * symbol_count + symbol_2 * symbol_count**2 ...
+and table[key] is the slot of the matching action (or -1 if there is none).
+For each slot, the actions are stored as:
+    write[slot * tape_count + tape_nr] = the symbol to write on each tape
+    move[slot * tape_count + tape_nr] = the direction for each tape
+    next_state[slot] = the state to change to
+    actions[slot] = the original action (wildcards resolved), used for reporting
+"""
+class CompiledProgram:
+
+    """
+    The constructor method
+    [program] = the TuringProgram to compile. Its current tapes are only used to
+                determine the number of tapes and to include their values in the alphabet.
+    """
+    def __init__(self, program):
+        self.program = program
+        self.tape_count = len(program.tapes)
+
+        self.symbols = program.get_symbols()
+        if len(self.symbols) > 256:
+            raise ValueError("Programs with more than 256 symbols can't be compiled")
+        self.symbol_ids = dict((symbol, nr) for nr, symbol in enumerate(self.symbols))
+        self.symbol_count = len(self.symbols)
+
+        self.states = [program.state_initial, program.state_final]
+        self.state_ids = {program.state_initial: 0, program.state_final: 1}
+        for action in program.actions:
+            for state in (action['state'], action['next_state']):
+                if state not in self.state_ids:
+                    self.state_ids[state] = len(self.states)
+                    self.states.append(state)
+        self.state_initial = 0
+        self.state_final = 1
+
+        self.directions = {program.dir_left: -1, program.dir_right: 1, program.dir_none: 0}
+
+        #the weight of each tape's symbol in a transition key
+        self.weights = [self.symbol_count ** tape_nr for tape_nr in range(self.tape_count)]
+        self.stride = self.symbol_count ** self.tape_count
+
+        table_size = len(self.states) * self.stride
+        if table_size <= DENSE_TABLE_LIMIT:
+            self.table = array('l', [-1]) * table_size
+        else:
+            self.table = SparseTable()
+
+        self.actions = list()
+        self.write = array('B')
+        self.move = array('b')
+        self.next_state = array('l')
+        self.build_table()
+
+        self.drifts = None  #see find_drifts
+        self.packed_write = None  #see pack_table
+
+
+    """
+    Fills the transition table, with the same precedence as TuringProgram.get_action:
+    exact rules first, then wildcard rules, resolved for every combination of symbols.
+    """
+    def build_table(self):
+        slots = dict()  #maps (action id, write values) to slots, so each action is stored once
+
+        def add(action):
+            key = self.get_key(self.state_ids[action['state']], action['read_values'])
+            if self.table[key] != -1:
+                return
+            slot_key = (action['id'], tuple(action['write_values']))
+            if slot_key not in slots:
+                slots[slot_key] = self.add_slot(action)
+            self.table[key] = slots[slot_key]
+
+        for (state, read_values), action in self.program.action_index.items():
+            if len(read_values) == self.tape_count:
+                add(action)
+
+        for state in self.program.wildcard_actions:
+            for read_values in itertools.product(self.symbols, repeat=self.tape_count):
+                action = self.program.get_action(state, read_values)
+                if action != None:
+                    add(action)
+
+
+    """
+    Finds the "drifts" of each state, used by the accelerated mode of run_compiled:
+    groups of actions that don't change the state or the tape values, and move the heads
+    the same way, like "multi-shift 0,1,_ 0,1,_ >,-,> multi-shift".
+    Such actions just move the heads over runs of values, so they can be skipped in a single operation.
+
+    A group is only used if the values it accepts on each tape are independent of each other
+    (every combination is part of the group), so a run ends on the first cell of any moving tape
+    that isn't accepted.
+
+    Sets [drifts] to a list with an entry for each state, which is either None
+    or a (directions, stops) tuple, where stops[tape_nr] contains the codes that end the run
+    (as 1 byte strings, for searching), and [drift_keys] to a table that marks the transition keys
+    that belong to a drift.
+    """
+    def find_drifts(self):
+        groups = dict()  #maps (state, directions) to the read codes of the matching keys
+        if isinstance(self.table, SparseTable):
+            entries = self.table.items()
+            self.drift_keys = SparseTable(0)
+        else:
+            entries = enumerate(self.table)
+            self.drift_keys = bytearray(len(self.table))
+
+        for key, slot in entries:
+            if slot < 0:
+                continue
+            state = key // self.stride
+            if state == self.state_final or self.next_state[slot] != state:
+                continue
+            codes = tuple((key % self.stride) // weight % self.symbol_count for weight in self.weights)
+            base = slot * self.tape_count
+            if tuple(self.write[base:base + self.tape_count]) != codes:
+                continue
+            directions = tuple(self.move[base:base + self.tape_count])
+            if any(directions):
+                groups.setdefault((state, directions), list()).append((key, codes))
+
+        self.drifts = [None] * len(self.states)
+        best_sizes = [0] * len(self.states)
+        for (state, directions), keys in groups.items():
+            accepted = [set(codes[tape_nr] for key, codes in keys) for tape_nr in range(self.tape_count)]
+            combinations = 1
+            for values in accepted:
+                combinations *= len(values)
+            if combinations != len(keys) or len(keys) <= best_sizes[state]:
+                continue
+
+            if self.drifts[state] != None:  #replace a smaller group found earlier
+                for key in self.drift_keys_of(state):
+                    self.drift_keys[key] = 0
+            stops = list()
+            for tape_nr in range(self.tape_count):
+                stops.append([bytes(bytearray([code])) for code in range(self.symbol_count)
+                              if code not in accepted[tape_nr]])
+            self.drifts[state] = (directions, stops)
+            best_sizes[state] = len(keys)
+            for key, codes in keys:
+                self.drift_keys[key] = 1
+
+
+    def drift_keys_of(self, state_id):
+        first = state_id * self.stride
+        return [key for key in range(first, first + self.stride) if self.drift_keys[key]]
+
+
+    """
+    Builds the tables used by run_packed, where the values of all the tapes at the same position
+    are packed in a single number, computed like the symbol part of a transition key
+    (the sum of each tape's code multiplied by its weight):
+    [packed_write] = the values written by each slot, as a packed number
+    [uniform_moves] = the direction shared by all the heads for each slot, or None
+                      if the heads move differently
+    """
+    def pack_table(self):
+        tape_count = self.tape_count
+        self.packed_write = list()
+        self.uniform_moves = list()
+        for slot in range(len(self.actions)):
+            base = slot * tape_count
+            self.packed_write.append(sum(self.write[base + tape_nr] * self.weights[tape_nr]
+                                         for tape_nr in range(tape_count)))
+            moves = set(self.move[base:base + tape_count])
+            self.uniform_moves.append(moves.pop() if len(moves) == 1 else None)
+
+
+    """
+    Stores the write values, directions and next state of [action] in a new slot
+    """
+    def add_slot(self, action):
+        for tape_nr in range(self.tape_count):
+            self.write.append(self.get_symbol_id(action['write_values'][tape_nr]))
+            #unknown directions are treated as dir_none, like the TuringMachine does
+            self.move.append(self.directions.get(action['directions'][tape_nr], 0))
+        self.next_state.append(self.state_ids[action['next_state']])
+        self.actions.append(action)
+        return len(self.actions) - 1
+
+
+    def get_key(self, state_id, read_values):
+        key = state_id * self.stride
+        for tape_nr, value in enumerate(read_values):
+            key += self.get_symbol_id(value) * self.weights[tape_nr]
+        return key
+
+
+    def get_symbol_id(self, symbol):
+        if symbol not in self.symbol_ids:
+            raise ValueError("Value '%s' is not part of the program's alphabet" % symbol)
+        return self.symbol_ids[symbol]
+
+
+    """
+    Converts a tape (a sequence of symbols) into a bytearray of symbol ids
+    """
+    def encode_tape(self, tape):
+        if isinstance(tape, ByteTape) and tape.symbols == self.symbols[:len(tape.symbols)]:
+            return bytearray(tape.view())  #same codes, no need to convert each value
+        return bytearray(self.get_symbol_id(symbol) for symbol in tape)
+
+
+    """
+    Converts a sequence of symbol ids back into a list of symbols
+    """
+    def decode_tape(self, cells):
+        symbols = self.symbols
+        return [symbols[code] for code in cells]
+
+
+    """
+    Builds the error message for a missing action, in the same format as the TuringMachine
+    """
+    def error_message(self, state_id, codes):
+        return "No action defined for state '%(state)s' and values (%(read)s)" \
+               % dict(state=self.states[state_id], read=','.join(self.decode_tape(codes)))
+
+
+
+"""
+Shortcut function for compiling a program
+"""
+def compile_program(program):
+    return CompiledProgram(program)
+
+
+"""
+Runs a compiled program until it halts, encounters an error or runs [max_steps] cycles.
+[tapes] = the starting tapes, as Tapes or sequences of symbols. If not specified, the program's tapes are used
+          (they aren't modified).
+[accelerate] = if True, runs of steps that only move the heads over the same kind of values
+               (see CompiledProgram.find_drifts) are skipped in a single operation.
+               The results, including the step count, are the same as without it.
+               Only these single state runs that don't write anything are skipped (there are no
+               general k-cell macro steps), so the gain depends on the share of steps spent in them:
+               for Multiplication, where most steps are in the writing loops, it's about 1.4x.
+[max_seconds] = stops the run after this many seconds (checked every few thousand steps)
+Returns a RunResult with symbolic values, just like run_to_halt.
+"""
+def run_compiled(compiled, tapes=None, max_steps=None, accelerate=False, max_seconds=None):
+    if tapes == None:
+        tapes = compiled.program.tapes
+    if accelerate and compiled.drifts == None:
+        compiled.find_drifts()
+    drift_keys = compiled.drift_keys if accelerate else None
+
+    tape_range = range(compiled.tape_count)
+    cells = list()    #the contents of each tape. Position 0 is at cells[tape_nr][origins[tape_nr]]
+    origins = list()
+    lows = list()     #the leftmost and rightmost positions reached by each head, which
+    highs = list()    #delimit the part of the tape the TuringMachine would have created
+    for tape in tapes:
+        tape = copy_tape(tape, compiled.symbols[0])
+        cells.append(compiled.encode_tape(tape))
+        origins.append(-tape.start)
+        lows.append(tape.start)
+        highs.append(tape.end - 1)
+    heads = list(origins)  #the index of each head in [cells], starting at position 0
+
+    table = compiled.table
+    stride = compiled.stride
+    weights = compiled.weights
+    write = compiled.write
+    move = compiled.move
+    next_state = compiled.next_state
+    tape_count = compiled.tape_count
+    state_final = compiled.state_final
+
+    state = compiled.state_initial
+    slot = -1
+    error = None
+    status = None
+    steps = 0
+
+    deadline = None
+    if max_seconds != None:
+        deadline = time.time() + max_seconds
+        next_check = TIME_CHECK_INTERVAL
+
+    while max_steps == None or steps < max_steps:
+        if deadline != None:
+            next_check -= 1
+            if not next_check:
+                if time.time() >= deadline:
+                    status = STATUS_TIME_LIMIT
+                    break
+                next_check = TIME_CHECK_INTERVAL
+
+        key = state * stride
+        for tape_nr in tape_range:
+            key += cells[tape_nr][heads[tape_nr]] * weights[tape_nr]
+        slot = table[key]
+        if slot < 0:
+            codes = [cells[tape_nr][heads[tape_nr]] for tape_nr in tape_range]
+            error = compiled.error_message(state, codes)
+            break
+
+        if accelerate and drift_keys[key]:
+            count = drift(compiled, cells, origins, lows, highs, heads, state, steps, max_steps)
+            if count:
+                steps += count
+                if steps == max_steps:  #report the action of the last skipped step
+                    slot = table[last_drift_key(compiled, cells, heads, state)]
+                continue
+
+        base = slot * tape_count
+        for tape_nr in tape_range:
+            tape = cells[tape_nr]
+            head = heads[tape_nr]
+            tape[head] = write[base + tape_nr]
+
+            direction = move[base + tape_nr]
+            if direction:
+                head += direction
+                pos = head - origins[tape_nr]
+                if pos < lows[tape_nr]:
+                    lows[tape_nr] = pos
+                    if head < 0:
+                        #add a chunk of blanks (symbol 0) on the left side
+                        tape[0:0] = bytearray(TAPE_CHUNK)
+                        origins[tape_nr] += TAPE_CHUNK
+                        head += TAPE_CHUNK
+                elif pos > highs[tape_nr]:
+                    highs[tape_nr] = pos
+                    if head >= len(tape):
+                        tape.extend(bytearray(TAPE_CHUNK))
+                heads[tape_nr] = head
+
+        state = next_state[slot]
+        steps += 1
+        if state == state_final:
+            break
+
+    return make_result(compiled, cells, origins, lows, highs, heads, state, steps, slot, error, status)
+
+
+"""
+Runs a compiled program like run_compiled, but with all the tapes packed in a single list,
+where each item holds the values of every tape at the same position, as a single number
+(see CompiledProgram.pack_table).
+While all the heads are at the same position, which is common for programs whose heads move
+in lockstep, every step reads the values of all the tapes with a single index operation
+(the number is also the symbol part of the transition key), and writes them with another one.
+Once the heads move apart, the values are extracted from the numbers one tape at a time,
+until the heads meet again.
+[tapes], [max_steps] and [max_seconds] are the same as for run_compiled.
+"""
+def run_packed(compiled, tapes=None, max_steps=None, max_seconds=None):
+    if tapes == None:
+        tapes = compiled.program.tapes
+    if compiled.packed_write == None:
+        compiled.pack_table()
+
+    tape_count = compiled.tape_count
+    tape_range = range(tape_count)
+    weights = compiled.weights
+    tapes = [copy_tape(tape, compiled.symbols[0]) for tape in tapes]
+    origin = -min(tape.start for tape in tapes)  #the index of position 0
+    cells = [0] * (origin + max(tape.end for tape in tapes))
+    lows = list()   #the leftmost and rightmost indexes reached by each head,
+    highs = list()  #like the lows and highs of run_compiled
+    for tape_nr, tape in enumerate(tapes):
+        first = origin + tape.start
+        for index, code in enumerate(compiled.encode_tape(tape)):
+            cells[first + index] += code * weights[tape_nr]
+        lows.append(first)
+        highs.append(first + len(tape) - 1)
+    heads = [origin] * tape_count  #the index of each head in [cells]
+
+    table = compiled.table
+    stride = compiled.stride
+    symbol_count = compiled.symbol_count
+    write = compiled.write
+    move = compiled.move
+    next_state = compiled.next_state
+    state_final = compiled.state_final
+    packed_write = compiled.packed_write
+    uniform_moves = compiled.uniform_moves
+
+    state = compiled.state_initial
+    slot = -1
+    error = None
+    status = None
+    steps = 0
+
+    #all the heads start at position 0, so they're together
+    together = True
+    head = origin     #the index of the heads, while they're together
+    low = high = head #the leftmost and rightmost indexes reached while the heads are together
+
+    deadline = None
+    if max_seconds != None:
+        deadline = time.time() + max_seconds
+        next_check = TIME_CHECK_INTERVAL
+
+    while max_steps == None or steps < max_steps:
+        if deadline != None:
+            next_check -= 1
+            if not next_check:
+                if time.time() >= deadline:
+                    status = STATUS_TIME_LIMIT
+                    break
+                next_check = TIME_CHECK_INTERVAL
+
+        if together:
+            slot = table[state * stride + cells[head]]
+            if slot < 0:
+                error = compiled.error_message(state, unpack(cells[head], tape_count, symbol_count))
+                break
+            direction = uniform_moves[slot]
+            if direction == None:
+                #the heads are about to move apart, so the step is run one tape at a time
+                together = False
+                heads = [head] * tape_count
+                lows = [min(index, low) for index in lows]
+                highs = [max(index, high) for index in highs]
+                continue
+
+            cells[head] = packed_write[slot]
+            if direction:
+                head += direction
+                if head < low:
+                    low = head
+                    if head < 0:
+                        cells[0:0] = [0] * TAPE_CHUNK
+                        origin += TAPE_CHUNK
+                        head += TAPE_CHUNK
+                        low += TAPE_CHUNK
+                        high += TAPE_CHUNK
+                        lows = [index + TAPE_CHUNK for index in lows]
+                        highs = [index + TAPE_CHUNK for index in highs]
+                elif head > high:
+                    high = head
+                    if head >= len(cells):
+                        cells.extend([0] * TAPE_CHUNK)
+
+        else:
+            key = state * stride
+            for tape_nr in tape_range:
+                weight = weights[tape_nr]
+                key += cells[heads[tape_nr]] // weight % symbol_count * weight
+            slot = table[key]
+            if slot < 0:
+                codes = [cells[heads[tape_nr]] // weights[tape_nr] % symbol_count for tape_nr in tape_range]
+                error = compiled.error_message(state, codes)
+                break
+
+            base = slot * tape_count
+            for tape_nr in tape_range:
+                index = heads[tape_nr]
+                weight = weights[tape_nr]
+                cells[index] += (write[base + tape_nr] - cells[index] // weight % symbol_count) * weight
+
+                direction = move[base + tape_nr]
+                if direction:
+                    index += direction
+                    if index < lows[tape_nr]:
+                        lows[tape_nr] = index
+                        if index < 0:
+                            cells[0:0] = [0] * TAPE_CHUNK
+                            origin += TAPE_CHUNK
+                            index += TAPE_CHUNK
+                            heads = [other + TAPE_CHUNK for other in heads]
+                            lows = [other + TAPE_CHUNK for other in lows]
+                            highs = [other + TAPE_CHUNK for other in highs]
+                    elif index > highs[tape_nr]:
+                        highs[tape_nr] = index
+                        if index >= len(cells):
+                            cells.extend([0] * TAPE_CHUNK)
+                    heads[tape_nr] = index
+
+            #the heads can only meet again after moving differently
+            if uniform_moves[slot] == None and heads.count(heads[0]) == tape_count:
+                together = True
+                head = low = high = heads[0]
+
+        state = next_state[slot]
+        steps += 1
+        if state == state_final:
+            break
+
+    if together:
+        heads = [head] * tape_count
+        lows = [min(index, low) for index in lows]
+        highs = [max(index, high) for index in highs]
+
+    columns = list()
+    for tape_nr in tape_range:
+        weight = weights[tape_nr]
+        columns.append(bytearray(cell // weight % symbol_count for cell in cells))
+    return make_result(compiled, columns, [origin] * tape_count, [index - origin for index in lows],
+                       [index - origin for index in highs], heads, state, steps, slot, error, status)
+
+
+"""
+Splits a packed number (see CompiledProgram.pack_table) into the codes of each tape
+"""
+def unpack(value, tape_count, symbol_count):
+    codes = list()
+    for tape_nr in range(tape_count):
+        value, code = divmod(value, symbol_count)
+        codes.append(code)
+    return codes
+
+
+"""
+Skips a run of drift steps (see CompiledProgram.find_drifts) for the given [state],
+moving the heads directly to the first cell that ends the run.
+The run is also cut short at the end of the space allocated for each tape (the normal step
+that follows will extend it), and when the [max_steps] limit is reached.
+Returns the number of steps that were skipped.
+"""
+def drift(compiled, cells, origins, lows, highs, heads, state, steps, max_steps):
+    directions, stops = compiled.drifts[state]
+
+    count = None
+    for tape_nr, direction in enumerate(directions):
+        tape = cells[tape_nr]
+        head = heads[tape_nr]
+        if direction > 0:
+            limit = len(tape) - 1
+            for stop in stops[tape_nr]:
+                found = tape.find(stop, head, limit)
+                if found >= 0:
+                    limit = found
+            length = limit - head
+        elif direction < 0:
+            limit = 0
+            for stop in stops[tape_nr]:
+                found = tape.rfind(stop, limit, head + 1)
+                if found >= 0:
+                    limit = found
+            length = head - limit
+        else:
+            continue
+        if count == None or length < count:
+            count = length
+
+    if max_steps != None and count > max_steps - steps:
+        count = max_steps - steps
+
+    if count:
+        for tape_nr, direction in enumerate(directions):
+            if direction:
+                heads[tape_nr] += direction * count
+                pos = heads[tape_nr] - origins[tape_nr]
+                if pos < lows[tape_nr]:
+                    lows[tape_nr] = pos
+                elif pos > highs[tape_nr]:
+                    highs[tape_nr] = pos
+    return count
+
+
+"""
+Returns the transition key of the last step of a drift, which read the cells
+right before the current ones.
+"""
+def last_drift_key(compiled, cells, heads, state):
+    directions = compiled.drifts[state][0]
+    key = state * compiled.stride
+    for tape_nr, direction in enumerate(directions):
+        key += cells[tape_nr][heads[tape_nr] - direction] * compiled.weights[tape_nr]
+    return key
+
+
+"""
+Converts the internal state of a compiled run into a symbolic RunResult.
+The tapes are returned as ByteTapes, which use the same codes, so they don't need to be decoded.
+"""
+def make_result(compiled, cells, origins, lows, highs, heads, state, steps, slot, error, status=None):
+    tapes = list()
+    tapes_pos = list()
+    for tape_nr, tape in enumerate(cells):
+        start = origins[tape_nr] + lows[tape_nr]
+        end = origins[tape_nr] + highs[tape_nr] + 1
+        tapes.append(ByteTape.from_codes(tape[start:end], compiled.symbols, lows[tape_nr]))
+        tapes_pos.append(heads[tape_nr] - origins[tape_nr])
+
+    action = compiled.actions[slot] if slot >= 0 else None
+    return RunResult(tapes, tapes_pos, compiled.states[state], steps, action,
+                     state == compiled.state_final, error, status)
+
+
+
+#Test Code
+if __name__ == "__main__":
+    import copy
+    import random
+    import programs
+    import benchmark
+    from tm import run_to_halt, TuringMachine
+
+    def summary(result):
+        return ([list(tape) for tape in result.tapes], result.tapes_pos, result.state, result.steps)
+
+    for program in programs.plist:
+        expected = summary(run_to_halt(program))
+        compiled = compile_program(program)
+        for accelerate in (False, True):
+            result = summary(run_compiled(compiled, accelerate=accelerate))
+            print("%s%s: %d steps, %s" % (program.name, " (accelerated)" if accelerate else "",
+                                          result[3], "OK" if result == expected else "MISMATCH"))
+        result = summary(run_packed(compiled))
+        print("%s (packed): %d steps, %s" % (program.name, result[3], "OK" if result == expected else "MISMATCH"))
+
+    #compare the accelerated mode with the step by step TuringMachine, on long random inputs
+    #(and random step limits, which can cut a drift short), counting the steps skipped by drifts
+    skipped = [0]
+    step_drift = drift
+    def drift(*args):
+        count = step_drift(*args)
+        skipped[0] += count
+        return count
+
+    def machine_summary(result):
+        return summary(result) + (result.action['id'] if result.action else None, result.error)
+
+    generator = random.Random(0)
+    for program in programs.plist:
+        compiled = compile_program(program)
+        same = True
+        total = skipped[0] = 0
+        for i in range(20):
+            tapes = benchmark.generate_input(program, generator.randint(50, 400), seed=generator.random())
+            max_steps = generator.choice([None, generator.randint(1, 20000)])
+            machine = TuringMachine(copy.deepcopy(benchmark.with_tapes(program, tapes)), speed=-1,
+                                    max_steps=max_steps, sparse_tapes=False)
+            try:
+                machine.run()
+            except RuntimeError:
+                pass  #a missing action, reported in the result
+            result = run_compiled(compiled, tapes, max_steps, accelerate=True)
+            if machine_summary(machine.result) != machine_summary(result):
+                same = False
+            total += result.steps
+        print("%s (accelerated, 20 random inputs): %d steps, %d skipped by drifts, %s"
+              % (program.name, total, skipped[0], "OK" if same else "MISMATCH"))
@@ -12,15 +12,36 @@ License, v. 2.0. If a copy of the MPL was not distributed with this
 file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
+import collections
+import hashlib
+import json
 import threading
 import time
 
+from tapes import Tape, ByteTape, SparseTape, copy_tape, make_sparse, SPARSE_LENGTH
+import checkpoint
+
 
 #used for the TuringMachine's listener, in order to specify the current step in the simulation
 STEP_READ = 0
 STEP_WRITE = 1
 STEP_MOVE = 2
 STEP_STATE = 3
+ALL_STEPS = (STEP_READ, STEP_WRITE, STEP_MOVE, STEP_STATE)
+
+#used for the results of a simulation, in order to specify why the machine stopped
+STATUS_HALTED = 0      #it reached the program's final state
+STATUS_ERROR = 1       #it encountered an error (like a missing action)
+STATUS_STEP_LIMIT = 2  #it ran the maximum number of steps
+STATUS_TIME_LIMIT = 3  #it ran for the maximum number of seconds
+STATUS_LOOP = 4        #it reached the same configuration twice, so it would have run forever
+
+#the loop detection only remembers this many configurations (it starts over when it's full)
+LOOP_MEMORY = 100000
+
+#a machine without breakpoints or step targets only checks its controls every this many cycles
+#(a pause is still noticed before the next step, see TuringMachine.pause)
+CONTROL_INTERVAL = 1024
 
 
 """
@@ -46,12 +67,22 @@ class TuringProgram:
         self.dir_none = '-'          #symbol for not chaning the position
         self.state_initial = 'init'  #the state set when the machine starts
         self.state_final = 'halt'    #the state in which the machine stops running
+        self.symbol_any = None       #a single character that matches any value when used in an
+                                     #action's [read_values]. None disables wildcards.
 
         self.tapes = list()          #The list of tapes used by this program.
-                                     #Each tape is a list of characters (not a string)
+                                     #Each tape is a list of characters (not a string), or a Tape.
+                                     #The machine converts them to Tapes when it starts running.
         self.actions = list()        #The program itself, as a list of actions (see the
                                      #add_action method for the structure of an action)
 
+        self.action_index = dict()   #Maps (state, tuple(read_values)) to the matching action,
+                                     #so get_action doesn't need to scan the whole list
+        self.wildcard_actions = dict()  #Maps a state to its actions that contain wildcards, in order
+        self.wildcard_cache = dict()    #Remembers the actions resolved from wildcard rules
+        self.hash_cache = None          #The settings the hash was computed with, and the hash
+        self.action_values = None       #The values used by the actions (see get_symbols)
+
 
     """
     The alphabet of a turing machine, in other words the list of tape valeus it accepts.
@@ -71,6 +102,15 @@ class TuringProgram:
         self.dir_none = none
 
 
+    """
+    Set the symbol that matches any tape value in an action's [read_values].
+    When used in [write_values], it writes back the value that was read.
+    """
+    def set_wildcard(self, symbol):
+        self.symbol_any = symbol
+        self.index_actions()
+
+
     """
     Shortcut function to set both initial and final states
     """
@@ -86,20 +126,69 @@ class TuringProgram:
         self.tapes = list(arg)
 
 
+    """
+    Converts the program's tapes to ByteTapes, which use a single byte per cell,
+    with codes based on the program's alphabet (see get_symbols).
+    Should be called after the actions are set, so the codes match the ones of the compiler.
+    """
+    def compact_tapes(self):
+        symbols = self.get_symbols()
+        for tape_nr, tape in enumerate(self.tapes):
+            if not isinstance(tape, ByteTape):
+                start = tape.start if isinstance(tape, Tape) else 0
+                self.tapes[tape_nr] = ByteTape(tape, self.symbol_blank, start, symbols)
+
+
     """
     Add a single action to the program.
     If the machine's current state is the one specified by [state], and the value it read from 
     each tape its corresponding value from [read_values], it will replace those values with
     the ones from [write_values], then move the tapes according to the [directions]
     and finally change the machine's state to [next_state]
+    If more actions match the same state and values, the precedence is:
+    rules without wildcards first, then the rule that was added first.
     """
     def add_action(self, state, read_values, write_values, directions, next_state):
-        self.actions.append(dict(id=len(self.actions),
-                                 state=state,
-                                 read_values=read_values,
-                                 write_values=write_values,
-                                 directions=directions,
-                                 next_state=next_state))
+        action = dict(id=len(self.actions),
+                      state=state,
+                      read_values=read_values,
+                      write_values=write_values,
+                      directions=directions,
+                      next_state=next_state)
+        self.actions.append(action)
+        self.index_action(action)
+        self.hash_cache = None
+        self.action_values = None
+
+
+    """
+    Adds a single action to the lookup index.
+    Exact rules go in the action_index (the first one added wins),
+    while wildcard rules are kept per state and resolved on demand.
+    """
+    def index_action(self, action):
+        if self.symbol_any != None and self.symbol_any in action['read_values']:
+            self.wildcard_actions.setdefault(action['state'], list()).append(action)
+            self.wildcard_cache = dict()
+        else:
+            key = (action['state'], tuple(action['read_values']))
+            if self.symbol_any != None and self.symbol_any in action['write_values']:
+                action = self.resolve_writes(action, action['read_values'])
+            self.action_index.setdefault(key, action)
+
+
+    """
+    Rebuilds the lookup index from scratch.
+    Needed only if the actions list or the wildcard symbol was changed directly.
+    """
+    def index_actions(self):
+        self.action_index = dict()
+        self.wildcard_actions = dict()
+        self.wildcard_cache = dict()
+        self.hash_cache = None
+        self.action_values = None
+        for action in self.actions:
+            self.index_action(action)
 
 
     """
@@ -108,6 +197,7 @@ class TuringProgram:
     """
     def set_actions(self, table):
         self.actions = list()
+        self.index_actions()
         for line in table.split('\n'):
             columns = line.split()
             
@@ -123,17 +213,130 @@ class TuringProgram:
             self.add_action(state, read_values, write_values, directions, next_state)
 
 
+    """
+    Returns a list with every value used by the program, without duplicates, in a stable order:
+    the blank symbol first, then the input values, then the values used by the actions
+    and finally any other value found on the tapes.
+    """
+    def get_symbols(self):
+        if self.action_values == None:  #they're only collected again when the actions change
+            values = collections.OrderedDict()
+            for action in self.actions:
+                values.update((value, None) for value in action['read_values'])
+                values.update((value, None) for value in action['write_values'])
+            self.action_values = list(values)
+
+        symbols = [self.symbol_blank]
+        sources = [self.input_values, self.action_values]
+        sources.extend(self.tapes)
+
+        known = set(symbols)
+        known.add(self.symbol_any)
+        for values in sources:
+            for value in values:
+                if value not in known:
+                    known.add(value)
+                    symbols.append(value)
+        return symbols
+
+
     """
     Used by the TuringMachine, to search for an action in the list,
     based on its current [state] and [read_values]
     """
     def get_action(self, state, read_values):
-        for action_id, action in enumerate(self.actions):
-            if action['state'] == state and action['read_values'] == read_values:
-                return action
+        key = (state, tuple(read_values))
+        action = self.action_index.get(key)
+        if action == None and state in self.wildcard_actions:
+            if key not in self.wildcard_cache:
+                self.wildcard_cache[key] = self.resolve_wildcard(state, key[1])
+            action = self.wildcard_cache[key]
+        return action
+
+
+    """
+    Searches the wildcard rules of [state] for the first one matching [read_values].
+    """
+    def resolve_wildcard(self, state, read_values):
+        for action in self.wildcard_actions[state]:
+            if len(action['read_values']) != len(read_values):
+                continue
+            matches = True
+            for rule_value, value in zip(action['read_values'], read_values):
+                if rule_value != value and rule_value != self.symbol_any:
+                    matches = False
+                    break
+            if matches:
+                return self.resolve_writes(action, read_values)
         return None
 
 
+    """
+    Returns a copy of [action] (with the same id), for the given [read_values],
+    where the wildcards from [write_values] are replaced by the values that were read.
+    """
+    def resolve_writes(self, action, read_values):
+        resolved = dict(action)
+        resolved['read_values'] = list(read_values)
+        resolved['write_values'] = [value if write == self.symbol_any else write
+                                    for write, value in zip(action['write_values'], read_values)]
+        return resolved
+
+
+    """
+    Returns a hash of the program's behaviour (its symbols, states and actions, but not its
+    name or tapes), used to check that a snapshot is resumed with the program that created it.
+    It's only computed again when the actions or the other settings change, since it's needed
+    for every snapshot (like the checkpoints of a history.History).
+    """
+    def get_hash(self):
+        settings = [self.symbol_blank, self.symbol_any,
+                    [self.dir_left, self.dir_right, self.dir_none],
+                    [self.state_initial, self.state_final]]
+        if self.hash_cache == None or self.hash_cache[0] != settings:
+            description = settings + [[[action['state'], action['read_values'], action['write_values'],
+                                        action['directions'], action['next_state']] for action in self.actions]]
+            self.hash_cache = (settings, hashlib.sha1(json.dumps(description).encode('utf-8')).hexdigest())
+        return self.hash_cache[1]
+
+
+
+"""
+The old [should_continue] Event of the TuringMachine, kept so the code that still pauses the machine
+by clearing it (and resumes it by setting it) keeps working: it's set while the machine isn't paused.
+New code should use pause and resume instead.
+"""
+class PauseEvent:
+    def __init__(self, machine):
+        self.machine = machine
+
+
+    def is_set(self):
+        machine = self.machine
+        with machine.control:
+            return not (machine.paused or machine.pause_requested)
+
+
+    def set(self):
+        self.machine.resume()
+
+
+    def clear(self):
+        self.machine.pause()
+
+
+    """
+    Waits until the machine isn't paused (or is stopped), for at most [timeout] seconds.
+    Returns True if it isn't paused.
+    """
+    def wait(self, timeout=None):
+        machine = self.machine
+        with machine.control:
+            machine.control.wait_for(lambda: not (machine.paused or machine.pause_requested)
+                                     or machine.result != None, timeout)
+            return not (machine.paused or machine.pause_requested)
+
+
 
 """
 The Turing machine simulator class
@@ -153,80 +356,507 @@ class TuringMachine(threading.Thread):
                  [tm] = the turing machine that called the function
                  [step] = a number which specifies the last step type performed by the machine 
                  (STEP_READ, STEP_WRITE, STEP_MOVE, or STEP_STATE for state changes)
+    [listen_steps] = the step types the listener is notified about (all of them by default)
+    [listen_every] = only notify the listener every Nth cycle
+    [listen_rate] = the maximum number of notifications per second, the others are skipped
+    The listener is always notified after the last step, when the machine stops.
+    [batch_listener] = a function that receives the cycles in batches, as a list of records.
+                       It's called with the arguments [tm] and [records], where each record is
+                       a (step number, action id, new state, head positions) tuple.
+    [batch_size] = the number of records in each batch (the last one may be smaller)
+    [track_changes] = if True, the machine records every cell whose value changes,
+                      so a display can update only those cells (see take_changes)
+    [trace] = a trace.TraceWriter, which records the id of every executed action
+    [max_steps] = if specified, the machine stops after this many cycles
+    [max_seconds] = if specified, the machine stops after running for this many seconds
+    [detect_loops] = if True, the machine remembers the configurations it went through
+                     (state, head positions and tape values), and stops if one repeats,
+                     since that proves it would run forever. To keep this cheap, the configurations
+                     are only checked while each tape has at most [loop_window] values.
+    [resume] = a checkpoint.Snapshot, to continue a previous simulation of the same program
+               from the exact step where it was taken, instead of starting from the program's tapes
+    [checkpoint_every] = if specified, a snapshot is saved to [checkpoint_path] every this many cycles,
+                         so a long simulation can be resumed if the process is stopped
+    [history] = a history.History, which records the simulation so it can be stepped backwards
+                (see step_back and seek)
+    [profile] = a profiler.Profile, which collects statistics about the run (like how many times
+                each action was executed). Without one, the machine doesn't do any extra work.
+    [sparse_tapes] = if True, the tapes are stored as tapes.SparseTapes, which only keep their non-blank
+                     values, and if False they never are. By default (None), a tape becomes sparse
+                     when it grows long while staying mostly blank (see tapes.make_sparse).
+    [shared] = a sharedtape.SharedMachine, where the tapes are stored and the machine's configuration
+               is published after every step, so other processes can watch it.
+               The tapes aren't made sparse in this case.
+    The machine can be controlled from other threads while it runs, with pause, resume, step,
+    run_until, add_breakpoint and set_speed. While it's paused, [paused] is True, and [breakpoint]
+    is the condition that paused it, if it was a breakpoint.
+    When the machine stops, [status] tells why (one of the STATUS_ constants), and [result]
+    holds a RunResult with the final configuration.
     """
-    def __init__(self, program=None, speed=4, listener=None):
+    def __init__(self, program=None, speed=4, listener=None,
+                 listen_steps=ALL_STEPS, listen_every=1, listen_rate=None,
+                 batch_listener=None, batch_size=1000, track_changes=False, trace=None,
+                 max_steps=None, max_seconds=None, detect_loops=False, loop_window=256,
+                 resume=None, checkpoint_every=None, checkpoint_path=None, history=None,
+                 profile=None, sparse_tapes=None, shared=None):
         threading.Thread.__init__(self)
+        if checkpoint_every != None and checkpoint_path == None:
+            raise ValueError("checkpoint_every requires a checkpoint_path")
         
         self.program = program
         self.speed = speed
         self.listener = listener
+        self.listen_steps = frozenset(listen_steps)
+        self.listen_every = listen_every
+        self.listen_rate = listen_rate
+        self.batch_listener = batch_listener
+        self.batch_size = batch_size
+        self.track_changes = track_changes
+        self.changes = collections.deque()  #(tape number, position, new value) for each changed cell
+        self.trace = trace
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.detect_loops = detect_loops
+        self.loop_window = loop_window
+        self.resume_snapshot = resume
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_path = checkpoint_path
+        self.history = history
+        self.profile = profile
+        self.sparse_tapes = sparse_tapes
+        self.shared = shared
         
-        self.should_continue = threading.Event()  #allows us to pause the simulation.
-                                                  #clear() to pause and set() to resume
+        #the controls, shared with the threads that pause or step the machine (see check_control)
+        self.control = threading.Condition()
+        self.wakeup = threading.Event()  #interrupts the wait between steps, when the controls change
+        self.paused = False
+        self.pause_requested = False
+        self.step_target = None  #the machine pauses when it reaches this cycle
+        self.until = None        #a condition that pauses the machine once (see run_until)
+        self.breakpoints = list()
+        self.breakpoint = None
+        self.check_at = 0        #the cycle at which the controls are checked next
+        self.checked_step = 0    #the last cycle the breakpoints were checked at
+        self.should_continue = PauseEvent(self)  #the old way to pause the machine, see PauseEvent
+        self.status = None
+        self.result = None
 
 
     """
     The main method of the machine, that handles the whole simulation
     """
     def run(self):
+        steps = self.prepare()
+        while self.running:
+            if self.steps >= self.check_at:  #the only check on the hot path
+                if self.check_control():
+                    self.wait_resume()
+                    continue
+            step_type = self.phase
+            steps[step_type]()
+            self.phase = (step_type + 1) % len(steps)
+            self.post_step(step_type)
+
+        self.finish()
+
+
+    """
+    Sets up the simulation, before the main loop.
+    Returns the methods that run each step of the cycle, in order.
+    """
+    def prepare(self):
         if self.program == None: raise RuntimeError("No program specified")
 
         #prepare a list to store the current positions for each tape,
         #and then fill it with the starting position, 0
+        #(the positions are logical, so they stay the same when a tape grows on the left)
         self.tapes_pos = list()                   
         for i in range(len(self.program.tapes)):
             self.tapes_pos.append(0)
 
-        #make sure all tapes have at least one value, to prevent issues when reading/writing
-        for tape in self.program.tapes:
-            if len(tape) == 0:
-                tape.append(self.program.symbol_blank)
+        #convert the tapes, so they can grow on both sides cheaply
+        #(new Tapes always have at least one value, to prevent issues when reading/writing)
+        for tape_nr, tape in enumerate(self.program.tapes):
+            if not isinstance(tape, Tape):
+                self.program.tapes[tape_nr] = copy_tape(tape, self.program.symbol_blank, self.sparse_tapes == True)
+            else:
+                tape.reach(0)
 
         self.current_state = self.program.state_initial
         self.current_action = None
+        self.steps = 0
+        self.phase = STEP_READ  #the next step of the cycle
+        if self.resume_snapshot != None:
+            self.restore(self.resume_snapshot)
+        else:
+            self.prepare_tapes()
+        self.status = None
+        self.result = None
+        self.deadline = None
+        if self.max_seconds != None:
+            self.deadline = time.time() + self.max_seconds
+        self.next_notification = 0  #used by listen_rate, the time after which the listener can be called
+        self.batch = list()
+        self.configurations = set()
+        if self.detect_loops:
+            self.is_looping()  #remember the initial configuration
+        if self.history != None and self.phase == STEP_READ:
+            self.history.record(self)
         self.running = True
-        self.should_continue.set()  #start in running (non-paused) state
-
-
-        #The main loop. It runs a standard Turing cycle (read, write, move, change state),
-        #until it encounters the final/halt state of the program
-        while self.running:
-            self.should_continue.wait()  #if the machine is paused (by should_continue.clear()),
-                                         #this will block until it resumes (should_continue.set())
-            self.read_step()
-            self.post_step(STEP_READ)
-
-            self.should_continue.wait()
-            self.write_step()
-            self.post_step(STEP_WRITE)
+        self.paused = False
+        self.check_at = 0  #check the controls before the first step (the machine may start paused)
+        self.checked_step = self.steps
 
-            self.should_continue.wait()
-            self.move_step()
-            self.post_step(STEP_MOVE)
-
-            self.should_continue.wait()
-            self.state_change_step()
-            self.post_step(STEP_STATE)
+        #The main loop runs a standard Turing cycle (read, write, move, change state),
+        #until it encounters the final/halt state of the program.
+        #The current step is kept in [phase], so a paused machine can be snapshot between any two steps.
+        steps = (self.read_step, self.write_step, self.move_step, self.state_change_step)
+        if self.profile != None:
+            steps = self.profile.wrap_steps(self, steps)
+        if self.shared != None:
+            steps = self.shared.wrap_steps(self, steps)
+        return steps
 
 
     """
     Run after each simulation step.
-    It calls the listener to notify it of the changes,
+    It calls the listeners to notify them of the changes,
     raises an error, if one was encountered in the last step,
     and then sleeps a bit, so the user can follow the simulation
     """
     def post_step(self, step_type):
-        if self.listener != None:
+        self.record_step(step_type)
+
+        if self.listener != None and self.should_notify(step_type):
             self.listener(self, step_type)
+
+        if self.batch_listener != None and self.collect_batch(step_type):
+            self.flush_batch()
         
         #we set errors using self.error instead of raising them directly when we enconter them,
         #in order to allow the listener to handle the error itself
         #because otherwise it couldn't know about an error raised in another thread)
         if hasattr(self, 'error'):
+            self.finish()
             raise RuntimeError(self.error)
     
         if self.speed != -1:
-            time.sleep(1/float(self.speed))
+            self.wakeup.wait(1/float(self.speed))
+            self.wakeup.clear()
+
+
+    """
+    Decides, between two steps, if the machine should pause, and when the controls are checked next.
+    A pause request is handled right away, while the step target and the breakpoints are only checked
+    between cycles, once per cycle. Returns True if the machine should pause.
+    """
+    def check_control(self):
+        with self.control:
+            pause = self.pause_requested
+            if not pause and self.phase == STEP_READ and self.steps > self.checked_step:
+                self.checked_step = self.steps
+                if self.step_target != None and self.steps >= self.step_target:
+                    self.step_target = None
+                    pause = True
+                elif self.until != None and self.until(self):
+                    self.breakpoint = self.until
+                    self.until = None
+                    pause = True
+                else:
+                    for condition in self.breakpoints:
+                        if condition(self):
+                            self.breakpoint = condition
+                            pause = True
+                            break
+
+            if self.step_target != None or self.until != None or self.breakpoints:
+                self.check_at = self.steps + 1
+            else:
+                self.check_at = self.steps + CONTROL_INTERVAL
+            if pause:
+                if self.phase == STEP_READ:
+                    self.checked_step = self.steps  #so resuming doesn't stop at the same breakpoint
+                self.pause_requested = False
+                self.paused = True
+                self.control.notify_all()
+            return pause
+
+
+    """
+    Blocks the paused machine until it's resumed (or cancelled)
+    """
+    def wait_resume(self):
+        with self.control:
+            while self.paused and self.running:
+                self.control.wait()
+
+
+    """
+    Wakes up the machine after its controls changed (if it's paused or waiting between steps).
+    Called with the [control] lock held.
+    """
+    def notify_control(self):
+        self.check_at = 0
+        self.control.notify_all()
+        self.wakeup.set()
+
+
+    """
+    Pauses the machine before its next step (it can be in the middle of a cycle)
+    """
+    def pause(self):
+        with self.control:
+            self.pause_requested = True
+            self.notify_control()
+
+
+    """
+    Resumes a paused machine, which runs until it stops, or reaches a breakpoint
+    """
+    def resume(self):
+        with self.control:
+            self.pause_requested = False
+            self.step_target = None
+            self.paused = False
+            self.breakpoint = None
+            self.notify_control()
+
+
+    """
+    Runs [count] more cycles (a partially run cycle counts as one, like for step_back), then pauses.
+    A breakpoint can still pause the machine earlier.
+    """
+    def step(self, count=1):
+        with self.control:
+            self.step_target = self.steps + count
+            if self.phase != STEP_READ:
+                self.step_target -= 1
+            self.pause_requested = False
+            self.paused = False
+            self.breakpoint = None
+            self.notify_control()
+
+
+    """
+    Resumes the machine, and pauses it after the first cycle that ends in [state], or runs the action
+    with the id [action_id] (if both are given, both must match)
+    """
+    def run_until(self, state=None, action_id=None):
+        def condition(tm):
+            return (state == None or tm.current_state == state) and \
+                   (action_id == None or (tm.current_action != None and tm.current_action['id'] == action_id))
+        with self.control:
+            self.until = condition
+            self.pause_requested = False
+            self.step_target = None
+            self.paused = False
+            self.breakpoint = None
+            self.notify_control()
+
+
+    """
+    Adds a breakpoint: [condition] is a function, called with the machine after every cycle,
+    which returns True to pause it (see tape_condition). Returns the condition, so it can be removed.
+    """
+    def add_breakpoint(self, condition):
+        with self.control:
+            self.breakpoints.append(condition)
+            self.notify_control()
+        return condition
+
+
+    def remove_breakpoint(self, condition):
+        with self.control:
+            self.breakpoints.remove(condition)
+
+
+    """
+    Changes the machine's [speed] while it's running (the current wait between steps is cut short)
+    """
+    def set_speed(self, speed):
+        with self.control:
+            self.speed = speed
+            self.wakeup.set()
+
+
+    """
+    Stops the machine at the end of the current step, even if it's paused
+    """
+    def cancel(self):
+        with self.control:
+            self.running = False
+            self.notify_control()
+
+
+    """
+    Waits until the machine is paused or stopped, for at most [timeout] seconds.
+    Returns True if it is.
+    """
+    def wait_paused(self, timeout=None):
+        with self.control:
+            return self.control.wait_for(lambda: self.paused or self.result != None, timeout)
+
+
+    """
+    Saves the last step in the trace, history and checkpoint, if the machine has them
+    """
+    def record_step(self, step_type):
+        if self.trace != None and step_type == STEP_STATE:
+            self.trace.record(self.current_action['id'])
+
+        if self.checkpoint_every != None and step_type == STEP_STATE and self.running \
+           and self.steps % self.checkpoint_every == 0:
+            checkpoint.save_snapshot(self, self.checkpoint_path)
+
+        if self.history != None and step_type == STEP_STATE and self.running:
+            self.history.record(self)
+
+
+    """
+    Adds the last cycle to the batch, for the batch listener.
+    Returns True if the batch should be sent.
+    """
+    def collect_batch(self, step_type):
+        if step_type == STEP_STATE:
+            self.batch.append((self.steps, self.current_action['id'], self.current_state,
+                               tuple(self.tapes_pos)))
+            return len(self.batch) >= self.batch_size or not self.running
+        return len(self.batch) > 0 and not self.running  #the machine stopped because of an error
+
+
+    """
+    Decides if the listener should be notified about the last step, based on
+    the listen_steps, listen_every and listen_rate options.
+    Every step of the sampled cycles is notified: the state change step already counted
+    its cycle, so the cycle it belongs to is the previous one.
+    """
+    def should_notify(self, step_type):
+        if not self.running:
+            return True
+        if step_type not in self.listen_steps:
+            return False
+        if self.listen_every != 1:
+            cycle = self.steps - 1 if step_type == STEP_STATE else self.steps
+            if cycle % self.listen_every != 0:
+                return False
+        if self.listen_rate != None:
+            now = time.time()
+            if now < self.next_notification:
+                return False
+            self.next_notification = now + 1/float(self.listen_rate)
+        return True
+
+
+    """
+    Continues from the configuration saved in [snapshot], replacing the program's tapes.
+    """
+    def restore(self, snapshot):
+        if snapshot.program_hash != self.program.get_hash():
+            raise RuntimeError("The snapshot was taken with a different program")
+
+        self.program.tapes = [tape.copy() for tape in snapshot.tapes]
+        self.tapes_pos = list(snapshot.tapes_pos)
+        self.current_state = snapshot.state
+        self.steps = snapshot.steps
+        self.phase = snapshot.phase
+        if self.phase == STEP_WRITE:
+            #the values to write may come from a wildcard, so the action is looked up again,
+            #using the values that haven't been overwritten yet
+            self.read_step()
+        elif snapshot.action_id != None and self.phase != STEP_READ:
+            self.current_action = self.program.actions[snapshot.action_id]
+        else:
+            self.current_action = None
+        self.prepare_tapes()
+
+
+    """
+    Moves the tapes to the shared memory block, if the machine has one,
+    otherwise makes them sparse if needed
+    """
+    def prepare_tapes(self):
+        if self.shared != None:
+            self.sparse_checks = None
+            self.shared.attach(self)
+        else:
+            self.prepare_sparse()
+
+
+    """
+    Converts the tapes to SparseTapes if [sparse_tapes] is True, or the ones that are already
+    long and mostly blank if it's None. In that case, the other tapes are checked again whenever
+    their length doubles, starting from tapes.SPARSE_LENGTH cells (see check_sparse).
+    """
+    def prepare_sparse(self):
+        self.sparse_checks = None  #the length each tape must reach before it's checked again
+        if self.sparse_tapes == True:
+            for tape_nr, tape in enumerate(self.program.tapes):
+                if not tape.sparse:
+                    self.program.tapes[tape_nr] = SparseTape.from_tape(tape)
+        elif self.sparse_tapes == None:
+            self.sparse_checks = [SPARSE_LENGTH] * len(self.program.tapes)
+            for tape_nr in range(len(self.program.tapes)):
+                self.check_sparse(tape_nr)
+
+
+    """
+    Makes the tape [tape_nr] sparse, if it's long enough and mostly blank
+    """
+    def check_sparse(self, tape_nr):
+        tape = self.program.tapes[tape_nr]
+        if len(tape) < self.sparse_checks[tape_nr]:
+            return
+        self.program.tapes[tape_nr] = make_sparse(tape)
+        if self.program.tapes[tape_nr].sparse:
+            self.sparse_checks[tape_nr] = float('inf')
+        else:
+            self.sparse_checks[tape_nr] = 2 * len(tape)
+
+
+    """
+    Goes back [count] cycles (a partially run cycle counts as one), using the machine's history.
+    Like seek, it can only be called while the machine is paused or stopped.
+    """
+    def step_back(self, count=1):
+        target = self.steps - count
+        if self.phase != STEP_READ:
+            target += 1
+        self.seek(max(target, 0))
+
+
+    """
+    Brings the machine to the start of cycle number [step] (before or after the current one),
+    using the machine's history. The machine must be paused or stopped: the controls are locked
+    meanwhile, so it can't be resumed before the seek is over. The step target and the breakpoints
+    are checked again from the cycle it lands on, and the loop detection starts over from it.
+    """
+    def seek(self, step):
+        if self.history == None:
+            raise RuntimeError("The machine doesn't have a history")
+        with self.control:
+            if getattr(self, 'running', False) and not self.paused:
+                raise RuntimeError("The machine must be paused or stopped before seeking")
+            if self.shared != None:
+                self.shared.begin()
+            try:
+                self.history.seek(self, step)
+                self.checked_step = self.steps - 1
+                self.check_at = 0
+                if self.detect_loops:
+                    self.configurations = set()
+                    self.is_looping()  #remember the configuration it landed on
+            finally:
+                if self.shared != None:
+                    self.shared.end(self)
+
+
+    """
+    Sends the recorded cycles to the batch listener
+    """
+    def flush_batch(self):
+        batch = self.batch
+        self.batch = list()
+        return self.batch_listener(self, batch)
 
 
     """
@@ -237,13 +867,13 @@ class TuringMachine(threading.Thread):
     def read_step(self):
         read_values = []
         for tape_nr, tape in enumerate(self.program.tapes): 
-            read_values.append(tape[self.tapes_pos[tape_nr]]) 
+            read_values.append(tape.read(self.tapes_pos[tape_nr]))
             
         self.current_action = self.program.get_action(self.current_state, read_values)
         if self.current_action == None:
             self.error = "No action defined for state '%(state)s' and values (%(read)s)" \
                          % dict(state=self.current_state, read=','.join(read_values))
-            self.running = False
+            self.stop(STATUS_ERROR)
 
     
     """
@@ -251,7 +881,10 @@ class TuringMachine(threading.Thread):
     """
     def write_step(self):
         for tape_nr, tape in enumerate(self.program.tapes):
-              tape[self.tapes_pos[tape_nr]] = self.current_action['write_values'][tape_nr]
+              value = self.current_action['write_values'][tape_nr]
+              if self.track_changes and tape.read(self.tapes_pos[tape_nr]) != value:
+                  self.changes.append((tape_nr, self.tapes_pos[tape_nr], value))
+              tape.write(self.tapes_pos[tape_nr], value)
 
 
     """
@@ -261,18 +894,19 @@ class TuringMachine(threading.Thread):
         for tape_nr, tape in enumerate(self.program.tapes):
             direction = self.current_action['directions'][tape_nr]
             if direction == self.program.dir_left:
-                if self.tapes_pos[tape_nr] <= 0:
-                    #if we reached the left edge, insert a new blank value...
-                    tape.insert(0, self.program.symbol_blank)
-                    #...and make sure the position is at the new 0 edge
-                    self.tapes_pos[tape_nr] = 0                
-                else: 
-                    self.tapes_pos[tape_nr] -= 1
+                self.tapes_pos[tape_nr] -= 1
+                if self.tapes_pos[tape_nr] < tape.start:
+                    #if we passed the left edge, add a new blank value
+                    tape.extend_left()
+                    if self.sparse_checks != None:
+                        self.check_sparse(tape_nr)
             elif direction == self.program.dir_right: 
                 self.tapes_pos[tape_nr] += 1
-                if self.tapes_pos[tape_nr] >= len(tape):
-                    #if we reached the right edge, insert a new value
-                    tape.append(self.program.symbol_blank)
+                if self.tapes_pos[tape_nr] >= tape.end:
+                    #if we reached the right edge, add a new blank value
+                    tape.extend_right()
+                    if self.sparse_checks != None:
+                        self.check_sparse(tape_nr)
             #else: the direction is assumed to be [dir_none]
 
     
@@ -281,9 +915,209 @@ class TuringMachine(threading.Thread):
     """
     def state_change_step(self):
         self.current_state = self.current_action['next_state']
+        self.steps += 1
         if self.current_state == self.program.state_final:
-            self.running = False
+            self.stop(STATUS_HALTED)
+        else:
+            self.check_limits()
+
+
+    """
+    Stops the machine (at the end of the current step) with the given [status]
+    """
+    def stop(self, status):
+        self.status = status
+        self.running = False
+
+
+    """
+    Stops the machine if it ran out of steps or time, or if it's stuck in a loop.
+    Run after each cycle.
+    """
+    def check_limits(self):
+        if self.max_steps != None and self.steps >= self.max_steps:
+            self.stop(STATUS_STEP_LIMIT)
+        elif self.deadline != None and time.time() >= self.deadline:
+            self.stop(STATUS_TIME_LIMIT)
+        elif self.detect_loops and self.is_looping():
+            self.stop(STATUS_LOOP)
+
+
+    """
+    Remembers the current configuration, and returns True if it was already encountered.
+    Blank cells at the ends of the tapes are ignored, because they behave just like the cells
+    that weren't created yet, and the head positions are taken relative to the non-blank values,
+    since shifting the values and the head together doesn't change what the machine does.
+    If a tape is larger than [loop_window], the configuration isn't checked, and False is returned.
+    Only a 16 byte digest of each configuration is kept, so the memory used by the LOOP_MEMORY
+    configurations doesn't depend on the size of the tapes.
+    """
+    def is_looping(self):
+        configuration = [self.current_state]
+        for tape_nr, tape in enumerate(self.program.tapes):
+            if len(tape) > self.loop_window:
+                return False
+            bounds = tape.bounds()
+            if bounds == None:
+                configuration.append(0)
+                configuration.append(())
+            else:  #the head's position relative to the non-blank values
+                configuration.append(self.tapes_pos[tape_nr] - bounds[0])
+                configuration.append(tuple(tape[bounds[0] - tape.start:bounds[1] - tape.start + 1]))
+
+        digest = hashlib.blake2b(repr(configuration).encode('utf-8'), digest_size=16).digest()
+        if digest in self.configurations:
+            return True
+        if len(self.configurations) >= LOOP_MEMORY:
+            self.configurations = set()
+        self.configurations.add(digest)
+        return False
+
+
+    """
+    Returns the cells changed since the last call, as a list of (tape number, position, new value)
+    tuples, in the order they were written (only if the machine was created with track_changes).
+    It can be called from another thread, while the machine is running.
+    """
+    def take_changes(self):
+        changes = list()
+        while True:
+            try:
+                changes.append(self.changes.popleft())
+            except IndexError:
+                return changes
+
+
+    """
+    Saves the final configuration of the machine in [result], once it stops
+    """
+    def finish(self):
+        if self.trace != None:
+            self.trace.flush()
+        with self.control:
+            self.result = RunResult(self.program.tapes, list(self.tapes_pos), self.current_state, self.steps,
+                                    self.current_action, self.status == STATUS_HALTED,
+                                    getattr(self, 'error', None), self.status)
+            self.control.notify_all()  #for wait_paused
+
+
+
+"""
+Returns a breakpoint condition (see TuringMachine.add_breakpoint), which is True when the tape
+[tape_nr] holds [value] under its head, or at [position] (a logical position) if it's given
+"""
+def tape_condition(tape_nr, value, position=None):
+    def condition(tm):
+        tape = tm.program.tapes[tape_nr]
+        pos = tm.tapes_pos[tape_nr] if position == None else position
+        if pos < tape.start or pos >= tape.end:
+            return value == tm.program.symbol_blank  #the cells that weren't created yet are blank
+        return tape.read(pos) == value
+    return condition
+
+
+
+"""
+The outcome of a simulation (returned by run_to_halt and the other engines, and stored in TuringMachine.result).
+[tapes] = the final tapes, as Tape objects
+[tapes_pos] = the final position of each tape's head (logical positions, see the Tape class)
+[state] = the state the machine stopped in
+[steps] = the number of full cycles (read, write, move, change state) that were run
+[action] = the last action that was executed (None if no step was run)
+[halted] = True if the machine reached the program's final state
+[error] = the error message, if the machine stopped because of an error (None otherwise)
+[status] = why the machine stopped, as one of the STATUS_ constants. If not specified,
+           it's determined from [halted] and [error] (otherwise it must have reached the step limit)
+"""
+class RunResult:
+    def __init__(self, tapes, tapes_pos, state, steps, action=None, halted=False, error=None, status=None):
+        self.tapes = tapes
+        self.tapes_pos = tapes_pos
+        self.state = state
+        self.steps = steps
+        self.action = action
+        self.halted = halted
+        self.error = error
+
+        if status == None:
+            if error != None:
+                status = STATUS_ERROR
+            elif halted:
+                status = STATUS_HALTED
+            else:
+                status = STATUS_STEP_LIMIT
+        self.status = status
+
 
+"""
+Runs [program] synchronously, in the calling thread, until it halts, encounters an error,
+or runs [max_steps] cycles (if specified).
+It does the same work as a TuringMachine, but without the listener, pausing and speed control,
+so it's meant for running long simulations as fast as possible.
+The program's tapes aren't modified, the results are returned as a RunResult.
+[sparse_tapes] = chooses when the tapes are stored as SparseTapes, like for a TuringMachine
+"""
+def run_to_halt(program, max_steps=None, sparse_tapes=None):
+    blank = program.symbol_blank
+    dir_left = program.dir_left
+    dir_right = program.dir_right
+    state_final = program.state_final
+    action_index = program.action_index
+
+    tapes = [copy_tape(tape, blank, sparse_tapes == True) for tape in program.tapes]
+    tapes_pos = [0] * len(tapes)
+    tape_range = range(len(tapes))
+    sparse_checks = [SPARSE_LENGTH] * len(tapes)  #the lengths at which the tapes are checked (see make_sparse)
+    if sparse_tapes != None:
+        sparse_checks = [float('inf')] * len(tapes)
+
+    state = program.state_initial
+    action = None
+    error = None
+    steps = 0
+
+    while max_steps == None or steps < max_steps:
+        read_values = tuple([tapes[tape_nr].read(tapes_pos[tape_nr]) for tape_nr in tape_range])
+        action = action_index.get((state, read_values))
+        if action == None:
+            action = program.get_action(state, read_values)  #wildcard rules
+            if action == None:
+                error = "No action defined for state '%(state)s' and values (%(read)s)" \
+                        % dict(state=state, read=','.join(read_values))
+                break
+
+        write_values = action['write_values']
+        directions = action['directions']
+        for tape_nr in tape_range:
+            tape = tapes[tape_nr]
+            pos = tapes_pos[tape_nr]
+            if type(tape) is Tape:
+                tape.cells[tape.origin + pos] = write_values[tape_nr]
+            else:  #ByteTapes and SparseTapes convert the values
+                tape.write(pos, write_values[tape_nr])
+
+            direction = directions[tape_nr]
+            if direction == dir_left:
+                tapes_pos[tape_nr] = pos - 1
+                if pos <= tape.start:
+                    tape.extend_left()
+                    if len(tape) >= sparse_checks[tape_nr]:
+                        tapes[tape_nr] = make_sparse(tape)
+                        sparse_checks[tape_nr] = float('inf') if tapes[tape_nr].sparse else 2 * len(tape)
+            elif direction == dir_right:
+                tapes_pos[tape_nr] = pos + 1
+                if pos + 1 >= tape.end:
+                    tape.extend_right()
+                    if len(tape) >= sparse_checks[tape_nr]:
+                        tapes[tape_nr] = make_sparse(tape)
+                        sparse_checks[tape_nr] = float('inf') if tapes[tape_nr].sparse else 2 * len(tape)
+
+        state = action['next_state']
+        steps += 1
+        if state == state_final:
+            break
+
+    return RunResult(tapes, tapes_pos, state, steps, action, state == state_final, error)
 
 
 #Test Code
@@ -300,13 +1134,136 @@ if __name__ == "__main__":
     def print_tapes(tm, step_type):
         if step_type == STEP_READ:
             tcopy = list(tm.program.tapes[0])
-            pos = tm.tapes_pos[0]
+            pos = tm.tapes_pos[0] - tm.program.tapes[0].start
             tcopy.insert(pos, '[')
             tcopy.insert(pos+2, ']')
             print(''.join(tcopy))
         elif step_type == STEP_STATE and not tm.running:
-            print("Final value (trimmed): " + (''.join(tm.program.tapes[0])).strip('_'))
+            print("Final value (trimmed): " + tm.program.tapes[0].trimmed())
             
+    result = run_to_halt(inversion)
+    
     machine = TuringMachine(inversion, listener=print_tapes)
     machine.start()
     machine.join()
+
+    print("Final value (run_to_halt): " + result.tapes[0].trimmed() +
+          " in %d steps" % result.steps)
+
+    #a machine that keeps going back and forth over the same cells is stopped as soon as it repeats itself
+    bounce = TuringProgram("Bounce")
+    bounce.set_tapes(list("_1_"))
+    bounce.set_actions("""init _ _ > right
+                          right 1 1 > back
+                          back _ _ < left
+                          left 1 1 < init""")
+    machine = TuringMachine(bounce, speed=-1, detect_loops=True, max_steps=1000)
+    machine.run()
+    print("Loop detected after %d steps: %s" % (machine.steps, "OK" if machine.status == STATUS_LOOP else "MISSED"))
+
+    #control a running machine: start it paused, step it, run it until an action or a breakpoint
+    inversion.set_tapes(list(tape * 20))
+    expected = ''.join('1' if value == '0' else '0' for value in tape * 20)
+    machine = TuringMachine(inversion, speed=-1)
+    machine.pause()
+    machine.start()
+    machine.wait_paused()
+    print("Paused before the first step: %d steps" % machine.steps)
+    machine.step(3)
+    machine.wait_paused()
+    print("After step(3): %d steps" % machine.steps)
+    machine.run_until(action_id=1)
+    machine.wait_paused()
+    print("After run_until(action_id=1): %d steps, last action %d" % (machine.steps, machine.current_action['id']))
+    blank = machine.add_breakpoint(tape_condition(0, '_'))
+    machine.resume()
+    machine.wait_paused()
+    print("Breakpoint on a blank cell: %d steps, head at %d" % (machine.steps, machine.tapes_pos[0]))
+    machine.remove_breakpoint(blank)
+
+    #slow down the machine, then speed it up again while it's waiting between steps
+    machine.set_speed(0.1)
+    machine.resume()
+    time.sleep(0.1)
+    start = time.time()
+    machine.set_speed(-1)
+    machine.join()
+    print("Sped up while running: halted in %.2fs, result %s" % (time.time() - start,
+          "OK" if machine.result.tapes[0].trimmed() == expected else "MISMATCH"))
+
+    #after going back, stepping stops at the right cycle again
+    from history import History
+    inversion.set_tapes(list(tape * 20))
+    machine = TuringMachine(inversion, speed=-1, history=History())
+    machine.pause()
+    machine.start()
+    machine.wait_paused()
+    machine.step(10)
+    machine.wait_paused()
+    machine.step_back()
+    machine.step(1)
+    machine.wait_paused()
+    print("Stepped back from 10, then step(1): %d steps" % machine.steps)
+
+    #the cycle a seek lands on hasn't selected its action yet, when it's checked by run_until
+    machine.step(20)
+    machine.wait_paused()
+    machine.step_back(3)
+    machine.run_until(action_id=1)
+    print("Stepped back, then run_until(action_id=1): %s" %
+          ("OK" if machine.wait_paused(5) and machine.current_action['id'] == 1 else "FAILED"))
+    machine.cancel()
+    machine.join()
+
+    #the old should_continue Event still pauses and resumes the machine
+    inversion.set_tapes(list(tape * 20))
+    machine = TuringMachine(inversion, speed=1000)
+    machine.start()
+    machine.should_continue.clear()
+    paused = machine.wait_paused(5) and not machine.should_continue.is_set()
+    machine.should_continue.set()
+    machine.set_speed(-1)
+    machine.join()
+    print("Paused and resumed with should_continue: %s" %
+          ("OK" if paused and machine.should_continue.wait(1) and machine.status == STATUS_HALTED else "FAILED"))
+
+    #seeking doesn't make the loop detection see the configurations it goes back to as a loop
+    inversion.set_tapes(list(tape * 20))
+    machine = TuringMachine(inversion, speed=-1, detect_loops=True, history=History())
+    machine.pause()
+    machine.start()
+    machine.wait_paused()
+    machine.step(10)
+    machine.wait_paused()
+    machine.seek(5)
+    machine.resume()
+    machine.join()
+    print("Resumed after seeking back with loop detection: %s" %
+          ("OK" if machine.status == STATUS_HALTED else "FAILED"))
+
+    #the hash and the symbols are computed again when the program changes
+    changed = TuringProgram("Inversion")
+    changed.set_tapes(list(tape))
+    changed.set_actions("""init 0 1 > init
+                           init 1 0 > init
+                           init _ _ - halt""")
+    hashes = [changed.get_hash()]
+    changed.add_action('init', ['2'], ['3'], ['>'], 'init')
+    hashes.append(changed.get_hash())
+    changed.state_final = 'stop'
+    hashes.append(changed.get_hash())
+    print("Hash and symbols follow the changes: %s" %
+          ("OK" if hashes[0] == inversion.get_hash() and len(set(hashes)) == 3 and
+           changed.get_symbols() == ['_', '0', '1', '2', '3'] else "FAILED"))
+
+    #sampling notifies every step of the same cycles
+    sampled = list()
+    inversion.set_tapes(list(tape * 5))
+    machine = TuringMachine(inversion, speed=-1, listen_every=10,
+                            listener=lambda tm, step_type: sampled.append((tm.steps, step_type)))
+    machine.run()
+    cycles = collections.OrderedDict()
+    for steps, step_type in sampled[:-1]:  #the last step is always notified
+        cycles.setdefault(steps - 1 if step_type == STEP_STATE else steps, list()).append(step_type)
+    print("Sampled cycles %s: %s" % (list(cycles), "OK" if list(cycles) == [0, 10, 20, 30] and
+          all(step_types == list(ALL_STEPS) for step_types in cycles.values()) else "FAILED"))
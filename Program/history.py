@@ -0,0 +1,218 @@
+"""
+File: history.py
+Lets a TuringMachine go back to any earlier step of its simulation (and forward again),
+without restarting it, using an undo log and periodic snapshots.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import collections
+
+import checkpoint
+from tm import STEP_READ
+
+
+"""
+The history of a machine's simulation. To use it, pass it as the [history] argument
+of a TuringMachine, and then call the machine's step_back and seek methods while it's paused or stopped.
+
+Before each cycle, the machine adds an entry to the undo log, with its state, head positions
+and the values under the heads (the only cells a cycle can change), so the last cycles can be
+undone one by one. While the machine is between two cycles, or in the middle of one, the last
+entry is always the one for the start of its current cycle (undo and replay keep it that way),
+so the machine can be resumed after seeking. Since the log is bounded, a full snapshot is also kept every
+[checkpoint_interval] cycles: older steps are reached by restoring the closest snapshot and
+running the remaining cycles again. Either way, the cost depends on the distance to the closest
+entry or snapshot, not on the length of the whole run.
+
+The memory used is capped by:
+[max_entries] = the size of the undo log (about 100 bytes per entry for a single tape).
+                The oldest entries are discarded first.
+[max_checkpoints] = the number of snapshots kept (each one holds a copy of the tapes).
+                    When there are too many, the interval is doubled and every other
+                    snapshot is discarded, so they still cover the whole run.
+"""
+class History:
+    def __init__(self, max_entries=1000000, checkpoint_interval=10000, max_checkpoints=64):
+        self.max_entries = max_entries
+        self.checkpoint_interval = checkpoint_interval
+        self.max_checkpoints = max_checkpoints
+
+        self.entries = collections.deque()  #(state, head positions, values under the heads) tuples
+        self.first_step = 0                 #the step of the first entry
+        self.checkpoints = dict()           #maps step numbers to checkpoint.Snapshots
+
+
+    """
+    Run by the machine at the start of each cycle. A cycle that's already in the log isn't added again.
+    """
+    def record(self, machine):
+        if self.entries and self.first_step + len(self.entries) > machine.steps:
+            return
+        tapes_pos = machine.tapes_pos
+        values = tuple([tape.read(tapes_pos[tape_nr]) for tape_nr, tape in enumerate(machine.program.tapes)])
+        if not self.entries:
+            self.first_step = machine.steps
+        self.entries.append((machine.current_state, tuple(tapes_pos), values))
+        if len(self.entries) > self.max_entries:
+            self.entries.popleft()
+            self.first_step += 1
+
+        if machine.steps % self.checkpoint_interval == 0 and machine.steps not in self.checkpoints:
+            self.add_checkpoint(machine)
+
+
+    def add_checkpoint(self, machine):
+        self.checkpoints[machine.steps] = checkpoint.take_snapshot(machine)
+        while len(self.checkpoints) > self.max_checkpoints:
+            self.checkpoint_interval *= 2
+            for step in list(self.checkpoints):
+                if step % self.checkpoint_interval != 0:
+                    del self.checkpoints[step]
+
+
+    """
+    Brings [machine] back to the start of its current cycle, if it's in the middle of one,
+    or to the start of the previous cycle. The entry of the cycle it's brought to stays in the log.
+    """
+    def undo(self, machine):
+        if machine.phase == STEP_READ and self.first_step + len(self.entries) - 1 == machine.steps:
+            self.entries.pop()  #the machine is already at the start of this cycle
+        state, tapes_pos, values = self.entries[-1]
+        for tape_nr, tape in enumerate(machine.program.tapes):
+            pos = tapes_pos[tape_nr]
+            if machine.track_changes and tape.read(pos) != values[tape_nr]:
+                machine.changes.append((tape_nr, pos, values[tape_nr]))
+            tape.write(pos, values[tape_nr])
+
+        machine.tapes_pos = list(tapes_pos)
+        machine.current_state = state
+        machine.current_action = None
+        machine.steps = self.first_step + len(self.entries) - 1
+        machine.phase = STEP_READ
+
+
+    """
+    Runs up to [count] full cycles on [machine], synchronously (without notifying its listeners),
+    stopping early if it halts or encounters an error. Like the machine, it records every cycle it starts,
+    including the one it stops at.
+    """
+    def replay(self, machine, count):
+        for i in range(count):
+            if machine.current_state == machine.program.state_final or hasattr(machine, 'error'):
+                break
+            self.record(machine)
+            machine.read_step()
+            if machine.current_action == None:
+                break
+            machine.write_step()
+            machine.move_step()
+            machine.state_change_step()
+        self.record(machine)
+
+
+    """
+    Brings [machine] to the start of cycle number [step] (the configuration after [step] cycles),
+    choosing the cheapest way to get there: undoing cycles, running more cycles from the current
+    configuration, or restoring a snapshot and running from there.
+    """
+    def seek(self, machine, step):
+        if step < 0:
+            raise ValueError("Invalid step: %d" % step)
+        if hasattr(machine, 'error'):  #the error will happen again, if the failing cycle is reached
+            del machine.error
+        machine.status = None
+
+        current = machine.steps
+        if machine.phase != STEP_READ:  #a partially run cycle is undone first
+            current += 1
+
+        #the cost (in cycles) of each option
+        nearest = max([checkpoint_step for checkpoint_step in self.checkpoints if checkpoint_step <= step] + [-1])
+        restore_cost = step - nearest if nearest >= 0 else None
+        if step < current:
+            if step >= self.first_step and len(self.entries) > 0:
+                move_cost = current - step
+            else:
+                move_cost = None
+        else:
+            move_cost = step - current
+
+        if restore_cost != None and (move_cost == None or restore_cost < move_cost):
+            machine.restore(self.checkpoints[nearest])
+            self.entries = collections.deque()
+            self.replay(machine, step - nearest)
+        elif move_cost == None:
+            raise ValueError("Step %d is no longer in the history" % step)
+        elif step < current:
+            while machine.steps > step or machine.phase != STEP_READ:
+                self.undo(machine)
+        else:
+            if machine.phase != STEP_READ:
+                self.undo(machine)
+            self.replay(machine, step - machine.steps)
+
+
+
+#Test Code
+if __name__ == "__main__":
+    import copy
+    import random
+    import programs
+    from tm import TuringMachine, run_to_halt
+
+    program = programs.plist.get("Multiplication")
+    history = History(max_entries=10, checkpoint_interval=4, max_checkpoints=4)
+    machine = TuringMachine(copy.deepcopy(program), speed=-1, history=history)
+    machine.run()
+    total = machine.steps
+
+    #jump around the finished run, and compare each step with a run stopped at that step
+    generator = random.Random(0)
+    same = True
+    for i in range(200):
+        step = generator.randint(0, total)
+        machine.seek(step)
+        expected = run_to_halt(copy.deepcopy(program), step)
+        if [''.join(tape[:]).strip(program.symbol_blank) for tape in machine.program.tapes] != \
+           [''.join(tape[:]).strip(program.symbol_blank) for tape in expected.tapes] or \
+           (machine.tapes_pos, machine.current_state) != (expected.tapes_pos, expected.state):
+            same = False
+    print("200 seeks with %d snapshots (every %d steps): %s" % (len(history.checkpoints),
+          history.checkpoint_interval, "OK" if same else "MISMATCH"))
+
+    #step a paused machine, go back, resume it, and check that the later seeks still find the right steps
+    def configuration(machine):
+        return ([''.join(tape[:]).strip(program.symbol_blank) for tape in machine.program.tapes],
+                list(machine.tapes_pos), machine.current_state)
+
+    def expected_configuration(step):
+        expected = run_to_halt(copy.deepcopy(program), step)
+        return ([''.join(tape[:]).strip(program.symbol_blank) for tape in expected.tapes],
+                expected.tapes_pos, expected.state)
+
+    machine = TuringMachine(copy.deepcopy(program), speed=-1, history=History(max_entries=10, checkpoint_interval=8))
+    machine.pause()
+    machine.start()
+    machine.wait_paused()
+    same = True
+    for i in range(100):
+        action = generator.choice(['step', 'back', 'seek'])
+        if action == 'step':
+            machine.step(generator.randint(1, 4))
+            machine.wait_paused()
+        elif action == 'back':
+            machine.step_back(generator.randint(1, 3))
+        else:
+            machine.seek(generator.randint(0, machine.steps))
+        if machine.result != None:
+            break
+        if configuration(machine) != expected_configuration(machine.steps):
+            same = False
+    machine.cancel()
+    machine.join()
+    print("100 steps, step backs and seeks on a paused machine: %s" % ("OK" if same else "MISMATCH"))
@@ -0,0 +1,307 @@
+#!/usr/bin/env python2
+
+"""
+File: jit.py
+Generates a Python function specialized for a single program, where every state is a block
+of code and the symbols and directions are constants, and runs it instead of the generic engines.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import time
+
+from tm import STATUS_TIME_LIMIT
+from tapes import copy_tape
+from compiler import SparseTable, compile_program, make_result, TAPE_CHUNK, TIME_CHECK_INTERVAL
+
+
+#the maximum number of generated functions kept in FUNCTION_CACHE (it's emptied when it's full)
+FUNCTION_CACHE_SIZE = 64
+
+#maps (program hash, symbols, tape count) to the (compiled program, source, function, rule index)
+#of the generated code, so the same program is only compiled once, even if it's loaded again
+FUNCTION_CACHE = dict()
+
+#the maximum number of states (or rules of a state) compared one after the other,
+#when looking for their code
+DISPATCH_BLOCK = 8
+
+#the ways a generated function can stop, besides halting and reaching the step limit
+OUTCOME_ERROR = 'error'
+OUTCOME_TIME_LIMIT = 'time'
+
+
+"""
+A program, together with the function generated for it.
+[program] = the TuringProgram (its tapes are used when run_jit isn't given any)
+[compiled] = the CompiledProgram the code was generated from (its codes are used for the tapes).
+             It may come from an earlier program with the same hash, see jit_program.
+[source] = the source code of the function
+[function] = the generated function, called by run_jit
+"""
+class JitProgram:
+    def __init__(self, program, compiled, source, function):
+        self.program = program
+        self.compiled = compiled
+        self.source = source
+        self.function = function
+
+
+
+"""
+Groups the rules of [compiled] (a CompiledProgram) by state.
+Returns a dict that maps each state to the (symbols part of the key, slot) pairs of its rules,
+and the rule index: a list (or a dict, for a SparseTable) that maps every transition key
+to the position of its rule in the state's list, or -1 if there's no rule for it.
+"""
+def get_state_rules(compiled):
+    if isinstance(compiled.table, SparseTable):
+        entries = sorted(compiled.table.items())
+        index = dict()
+    else:
+        entries = [(key, slot) for key, slot in enumerate(compiled.table) if slot >= 0]
+        index = [-1] * len(compiled.table)
+    state_rules = dict()
+    for table_key, slot in entries:
+        state, symbols = divmod(table_key, compiled.stride)
+        rules = state_rules.setdefault(state, list())
+        index[table_key] = len(rules)
+        rules.append((symbols, slot))
+    return state_rules, index
+
+
+"""
+Returns the source of a function that runs [compiled] (a CompiledProgram).
+The function has local variables for every tape (t0, t1, ...): its cells, the index of its head (h),
+of position 0 (o) and of the leftmost and rightmost cells reached (l and r), like run_compiled.
+The main loop has a block for each state, which runs its steps in an inner loop until the state
+changes, so the state is only dispatched again on transitions. The rule for the codes under the
+heads is looked up in the rule index (RULES, see get_state_rules) and its code is found with a
+binary search, like the states. It's made of the rule's writes (only the cells that change)
+and moves, with every tape unrolled.
+The names of the states are only added to the source as comments, with repr, so they can't
+change the code.
+"""
+def generate_source(compiled):
+    tape_range = range(compiled.tape_count)
+    lines = list()
+
+    def emit(indent, line):
+        lines.append('    ' * indent + line)
+
+    result = "return state, steps, slot, %%s, [%s], [%s], [%s], [%s], [%s]" % (
+             ', '.join("t%d" % tape_nr for tape_nr in tape_range),
+             ', '.join("o%d" % tape_nr for tape_nr in tape_range),
+             ', '.join("l%d - o%d" % (tape_nr, tape_nr) for tape_nr in tape_range),
+             ', '.join("r%d - o%d" % (tape_nr, tape_nr) for tape_nr in tape_range),
+             ', '.join("h%d" % tape_nr for tape_nr in tape_range))
+    key = ' + '.join("t%d[h%d]%s" % (tape_nr, tape_nr,
+                                      " * %d" % compiled.weights[tape_nr] if tape_nr else "")
+                     for tape_nr in tape_range)
+
+    emit(0, "def run(cells, origins, lows, highs, heads, state, limit, deadline):")
+    for tape_nr in tape_range:
+        emit(1, "t%(n)d = cells[%(n)d]; o%(n)d = origins[%(n)d]; h%(n)d = heads[%(n)d]" % dict(n=tape_nr))
+        emit(1, "l%(n)d = lows[%(n)d] + o%(n)d; r%(n)d = highs[%(n)d] + o%(n)d" % dict(n=tape_nr))
+    emit(1, "steps = 0")
+    emit(1, "slot = -1")
+    emit(1, "stop = 0")
+    emit(1, "while True:")
+    emit(2, "if steps >= stop:")
+    emit(3, "if steps >= limit:")
+    emit(4, result % "None")
+    emit(3, "if deadline != None and time() >= deadline:")
+    emit(4, result % repr(OUTCOME_TIME_LIMIT))
+    emit(3, "stop = min(limit, steps + %d)" % TIME_CHECK_INTERVAL)
+
+    state_rules = get_state_rules(compiled)[0]
+    if isinstance(compiled.table, SparseTable):
+        lookup = "RULES.get(%d + %s, -1)"
+    else:
+        lookup = "RULES[%d + %s]"
+
+    def emit_rule(indent, state, rule):
+        symbols, slot = state_rules[state][rule]
+        base = slot * compiled.tape_count
+        for tape_nr in tape_range:
+            code = compiled.write[base + tape_nr]
+            if code != symbols // compiled.weights[tape_nr] % compiled.symbol_count:
+                emit(indent, "t%d[h%d] = %d" % (tape_nr, tape_nr, code))
+        for tape_nr in tape_range:
+            direction = compiled.move[base + tape_nr]
+            names = dict(n=tape_nr, chunk=TAPE_CHUNK)
+            if direction > 0:
+                emit(indent, "h%(n)d += 1" % names)
+                emit(indent, "if h%(n)d > r%(n)d:" % names)
+                emit(indent + 1, "r%(n)d = h%(n)d" % names)
+                emit(indent + 1, "if h%(n)d >= len(t%(n)d):" % names)
+                emit(indent + 2, "t%(n)d.extend(CHUNK)" % names)
+            elif direction < 0:
+                emit(indent, "h%(n)d -= 1" % names)
+                emit(indent, "if h%(n)d < l%(n)d:" % names)
+                emit(indent + 1, "l%(n)d = h%(n)d" % names)
+                emit(indent + 1, "if h%(n)d < 0:" % names)
+                emit(indent + 2, "t%(n)d[0:0] = CHUNK" % names)
+                emit(indent + 2, "o%(n)d += %(chunk)d; h%(n)d += %(chunk)d; l%(n)d += %(chunk)d; "
+                                 "r%(n)d += %(chunk)d" % names)
+        emit(indent, "slot = %d" % slot)
+        emit(indent, "steps += 1")
+        next_state = compiled.next_state[slot]
+        if next_state == compiled.state_final:
+            emit(indent, "state = %d" % next_state)
+            emit(indent, result % "None")
+        elif next_state == state:
+            emit(indent, "continue")
+        else:
+            emit(indent, "state = %d" % next_state)
+            emit(indent, "break")
+
+    #the rules of a state are found with a binary search on their position in RULES
+    def emit_rules(indent, state, rules):
+        if len(rules) <= DISPATCH_BLOCK:
+            for rule in rules:
+                emit(indent, "if rule == %d:" % rule)
+                emit_rule(indent + 1, state, rule)
+        else:
+            middle = len(rules) // 2
+            emit(indent, "if rule < %d:" % rules[middle])
+            emit_rules(indent + 1, state, rules[:middle])
+            emit(indent, "else:")
+            emit_rules(indent + 1, state, rules[middle:])
+
+    def emit_state(indent, state):
+        emit(indent, "if state == %d:  #%r" % (state, compiled.states[state]))
+        emit(indent + 1, "while steps < stop:")
+        emit(indent + 2, "rule = %s" % lookup % (state * compiled.stride, "(%s)" % key))
+        emit(indent + 2, "if rule < 0:")
+        emit(indent + 3, "slot = -1")
+        emit(indent + 3, result % repr(OUTCOME_ERROR))
+        emit_rules(indent + 2, state, list(range(len(state_rules[state]))))
+        emit(indent + 1, "continue")
+
+    #the state blocks are found with a binary search, so the dispatch is cheap for large programs
+    def emit_states(indent, states):
+        if len(states) <= DISPATCH_BLOCK:
+            for state in states:
+                emit_state(indent, state)
+        else:
+            middle = len(states) // 2
+            emit(indent, "if state < %d:" % states[middle])
+            emit_states(indent + 1, states[:middle])
+            emit(indent, "else:")
+            emit_states(indent + 1, states[middle:])
+
+    emit_states(2, sorted(state_rules))
+    emit(2, "slot = -1")  #a state without any rules
+    emit(2, result % repr(OUTCOME_ERROR))
+    return '\n'.join(lines) + '\n'
+
+
+"""
+Compiles [program] and returns it as a JitProgram.
+The generated function only depends on the program's behaviour, its symbols and number of tapes,
+so it's taken from FUNCTION_CACHE, together with the CompiledProgram, when the same program
+was already compiled. The actions of programs with the same hash are equal, so the compiled
+program can be shared.
+"""
+def jit_program(program):
+    key = (program.get_hash(), tuple(program.get_symbols()), len(program.tapes))
+    cached = FUNCTION_CACHE.get(key)
+    if cached == None:
+        compiled = compile_program(program)
+        source = generate_source(compiled)
+        namespace = dict(time=time.time, CHUNK=bytearray(TAPE_CHUNK),
+                         RULES=get_state_rules(compiled)[1])
+        exec(compile(source, "<jit %s>" % program.name, 'exec'), namespace)
+        cached = (compiled, source, namespace['run'])
+        if len(FUNCTION_CACHE) >= FUNCTION_CACHE_SIZE:
+            FUNCTION_CACHE.clear()
+        FUNCTION_CACHE[key] = cached
+    return JitProgram(program, cached[0], cached[1], cached[2])
+
+
+"""
+Runs a program compiled by jit_program until it halts, encounters an error or runs [max_steps] cycles.
+[tapes], [max_steps] and [max_seconds] are the same as for compiler.run_compiled.
+Returns a RunResult, just like run_to_halt.
+"""
+def run_jit(jitted, tapes=None, max_steps=None, max_seconds=None):
+    compiled = jitted.compiled
+    if tapes == None:
+        tapes = jitted.program.tapes
+
+    cells = list()
+    origins = list()
+    lows = list()
+    highs = list()
+    for tape in tapes:
+        tape = copy_tape(tape, compiled.symbols[0])
+        cells.append(compiled.encode_tape(tape))
+        origins.append(-tape.start)
+        lows.append(tape.start)
+        highs.append(tape.end - 1)
+    heads = list(origins)
+
+    limit = max_steps if max_steps != None else float('inf')
+    deadline = time.time() + max_seconds if max_seconds != None else None
+    state, steps, slot, outcome, cells, origins, lows, highs, heads = \
+        jitted.function(cells, origins, lows, highs, heads, compiled.state_initial, limit, deadline)
+
+    error = None
+    status = None
+    if outcome == OUTCOME_ERROR:
+        codes = [cells[tape_nr][heads[tape_nr]] for tape_nr in range(compiled.tape_count)]
+        error = compiled.error_message(state, codes)
+    elif outcome == OUTCOME_TIME_LIMIT:
+        status = STATUS_TIME_LIMIT
+    return make_result(compiled, cells, origins, lows, highs, heads, state, steps, slot, error, status)
+
+
+
+#Test Code
+if __name__ == "__main__":
+    import programs
+    import benchmark
+    from compiler import run_compiled
+    from tm import TuringProgram
+
+    def summary(result):
+        return ([list(tape) for tape in result.tapes], result.tapes_pos, result.state, result.steps,
+                result.action['id'] if result.action else None, result.error)
+
+    for program in programs.plist:
+        jitted = jit_program(program)
+        tapes = benchmark.generate_input(program, 2000)
+        for max_steps in (None, 1000):
+            expected = summary(run_compiled(jitted.compiled, tapes, max_steps))
+            result = summary(run_jit(jitted, tapes, max_steps))
+            print("%s (max steps: %s): %d steps, %s" % (program.name, max_steps, result[3],
+                                                         "OK" if result == expected else "MISMATCH"))
+
+        for engine in (run_compiled, run_jit):
+            start = time.time()
+            steps = engine(jitted.compiled if engine == run_compiled else jitted, tapes, 200000).steps
+            print("  %-12s %10.0f steps/s" % (engine.__name__, steps / (time.time() - start)))
+
+    #state names are only comments in the generated code, whatever they contain
+    program = programs.plist[0]
+    hostile = TuringProgram("Hostile")
+    hostile.set_tapes(list("101"))
+    hostile.state_initial = "invert\nraise SystemExit"
+    for action in program.actions:
+        state = hostile.state_initial if action['state'] == program.state_initial else action['state']
+        next_state = hostile.state_initial if action['next_state'] == program.state_initial else action['next_state']
+        hostile.add_action(state, action['read_values'], action['write_values'], action['directions'], next_state)
+    result = run_jit(jit_program(hostile))
+    print("State name with a newline: %s" % ("OK" if list(result.tapes[0]) == list("010_") else "MISMATCH"))
+
+    #a cache hit reuses the compiled program, but runs the new program's tapes
+    reloaded = programs.inversion()
+    reloaded.set_tapes(list("0011"))
+    jitted = jit_program(reloaded)
+    print("Cache hit: %s" % ("OK" if jitted.compiled is jit_program(programs.plist[0]).compiled and
+                                       list(run_jit(jitted).tapes[0]) == list("1100_") else "MISMATCH"))
@@ -0,0 +1,280 @@
+"""
+File: loader.py
+Loads programs from text files, caching the parsed (and compiled) programs on disk,
+and keeps lists of programs that are only built when they're used.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import hashlib
+import os
+import pickle
+
+import tm
+import tapes
+import compiler
+from tm import TuringProgram
+from compiler import compile_program
+
+
+#where the parsed programs are cached, by default
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.turing_cache')
+
+#changed whenever the format of the cache files changes, so older cache files are ignored
+CACHE_VERSION = b'2'
+
+#the modules that define the classes stored in the cache (and this one, which builds them):
+#the cache files are keyed on their source, so they're built again when the code changes
+CACHED_MODULES = (tm, tapes, compiler)
+
+#the hash of the source of CACHED_MODULES, computed when it's first needed (see get_code_hash)
+code_hash = None
+
+
+"""
+Program files contain a header, with a "key: value" pair on each line, then an empty line,
+and then the actions table (in the format used by TuringProgram.set_actions). Lines starting
+with # are comments. For example:
+    name: Inversion
+    initial: invert
+    tape: 101001
+
+    invert 0 1 > invert
+    invert 1 0 > invert
+    invert _ _ - halt
+The header keys are: name, initial, final, blank, input (the input values), wildcard,
+directions (the left, right and none symbols, separated by spaces) and tape,
+which is repeated for each tape (an empty value adds an empty tape).
+"""
+def parse_program(text):
+    header, separator, table = text.replace('\r\n', '\n').partition('\n\n')
+    values = dict()
+    tapes = list()
+    for line in header.split('\n'):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        key, separator, value = line.partition(':')
+        key = key.strip()
+        value = value.strip()
+        if key == 'tape':
+            tapes.append(list(value))
+        elif key in ('name', 'initial', 'final', 'blank', 'input', 'wildcard', 'directions'):
+            values[key] = value
+        else:
+            raise ValueError("Unknown program property '%s'" % key)
+
+    if 'name' not in values:
+        raise ValueError("The program doesn't have a name")
+    program = TuringProgram(values['name'])
+    program.set_alphabet(values.get('input', program.input_values), values.get('blank', program.symbol_blank))
+    if 'directions' in values:
+        program.set_directions(*values['directions'].split())
+    program.set_limit_states(values.get('initial', program.state_initial), values.get('final', program.state_final))
+    if 'wildcard' in values:
+        program.set_wildcard(values['wildcard'])
+    program.set_tapes(*tapes)
+
+    lines = [line for line in table.split('\n') if line.strip() and not line.lstrip().startswith('#')]
+    if lines:
+        program.set_actions('\n'.join(lines))
+    return program
+
+
+"""
+Returns the hash of the source files of CACHED_MODULES and of this module
+"""
+def get_code_hash():
+    global code_hash
+    if code_hash == None:
+        digest = hashlib.sha1()
+        for path in [module.__file__ for module in CACHED_MODULES] + [__file__]:
+            if path.endswith(('.pyc', '.pyo')):
+                path = path[:-1]
+            with open(path, 'rb') as file:
+                digest.update(file.read())
+        code_hash = digest.hexdigest().encode('ascii')
+    return code_hash
+
+
+"""
+Writes [program] to a file, in the format read by parse_program
+"""
+def save_program(program, path):
+    lines = ["name: %s" % program.name,
+             "initial: %s" % program.state_initial,
+             "final: %s" % program.state_final,
+             "blank: %s" % program.symbol_blank,
+             "input: %s" % program.input_values,
+             "directions: %s %s %s" % (program.dir_left, program.dir_right, program.dir_none)]
+    if program.symbol_any != None:
+        lines.append("wildcard: %s" % program.symbol_any)
+    for tape in program.tapes:
+        lines.append("tape: %s" % ''.join(tape))
+    lines.append("")
+    for action in program.actions:
+        lines.append("%s %s %s %s %s" % (action['state'], ','.join(action['read_values']),
+                                         ','.join(action['write_values']), ','.join(action['directions']),
+                                         action['next_state']))
+    with open(path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+"""
+Returns the program defined in the file at [path].
+The parsed program is saved in [cache_dir] (None disables the cache), in a file named after
+the hash of the file's contents and of the simulator's code (see get_code_hash), so the next loads
+of the same contents skip the parsing, even from another process, until the code changes. If [compiled] is True, the program is also compiled
+(see compiler.py), and a CompiledProgram is returned instead, which is cached separately.
+"""
+def load_program(path, cache_dir=CACHE_DIR, compiled=False):
+    with open(path, 'rb') as file:
+        data = file.read()
+    kind = 'compiled' if compiled else 'program'
+    cache_path = None
+    if cache_dir != None:
+        digest = hashlib.sha1(CACHE_VERSION + b'\0' + get_code_hash() + b'\0' + data).hexdigest()
+        cache_path = os.path.join(cache_dir, "%s.%s" % (digest, kind))
+        try:
+            with open(cache_path, 'rb') as file:
+                return pickle.load(file)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            pass  #not cached yet (or the cache file is damaged), so it's parsed again
+
+    result = parse_program(data.decode('utf-8'))
+    if compiled:
+        result = compile_program(result)
+
+    if cache_path != None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        temp_path = "%s.%d.tmp" % (cache_path, os.getpid())  #so concurrent loads don't clash
+        with open(temp_path, 'wb') as file:
+            pickle.dump(result, file, pickle.HIGHEST_PROTOCOL)
+        getattr(os, 'replace', os.rename)(temp_path, cache_path)
+    return result
+
+
+"""
+Reads only the name from the header of a program file, without parsing the rest
+"""
+def read_name(path):
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                break
+            key, separator, value = line.partition(':')
+            if key.strip() == 'name':
+                return value.strip()
+    raise ValueError("'%s' doesn't have a name" % path)
+
+
+
+"""
+A list of programs, where each program is only built the first time it's used.
+The names are known in advance, so they can be shown (for example in the GUI's program chooser)
+without building anything. Indexing and iterating return TuringPrograms, like a normal list,
+and slicing returns another ProgramList, which shares the programs already built.
+"""
+class ProgramList:
+    def __init__(self):
+        self.entries = list()  #[name, function that builds the program, program (or None)] lists
+
+
+    """
+    Adds a program with the given [name], which will be built by calling [factory]
+    """
+    def register(self, name, factory):
+        self.entries.append([name, factory, None])
+
+
+    """
+    Adds a program file (see parse_program), which is loaded (using the cache) when used
+    """
+    def add_file(self, path, cache_dir=CACHE_DIR):
+        self.register(read_name(path), lambda: load_program(path, cache_dir))
+
+
+    """
+    Adds a program that's already built
+    """
+    def append(self, program):
+        self.entries.append([program.name, None, program])
+
+
+    def names(self):
+        return [entry[0] for entry in self.entries]
+
+
+    """
+    Returns the program with the given [name]
+    """
+    def get(self, name):
+        for index, entry in enumerate(self.entries):
+            if entry[0] == name:
+                return self[index]
+        raise KeyError(name)
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            result = ProgramList()
+            result.entries = self.entries[index]  #the same entries, so the programs are built only once
+            return result
+        entry = self.entries[index]
+        if entry[2] == None:
+            entry[2] = entry[1]()
+        return entry[2]
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def __iter__(self):
+        for index in range(len(self.entries)):
+            yield self[index]
+
+
+
+#Test Code
+if __name__ == "__main__":
+    import tempfile
+    import time
+    import programs
+
+    folder = tempfile.mkdtemp()
+    for program in programs.plist:
+        path = os.path.join(folder, program.name + ".tm")
+        save_program(program, path)
+
+        start = time.time()
+        loaded = load_program(path, folder)
+        parse_time = time.time() - start
+        start = time.time()
+        cached = load_program(path, folder)
+        cache_time = time.time() - start
+
+        same = [(action['state'], action['read_values'], action['write_values'], action['directions'],
+                 action['next_state']) for action in program.actions] == \
+               [(action['state'], action['read_values'], action['write_values'], action['directions'],
+                 action['next_state']) for action in cached.actions] and \
+               [list(tape) for tape in program.tapes] == [list(tape) for tape in cached.tapes] and \
+               program.get_hash() == loaded.get_hash() == cached.get_hash()
+        print("%s: %s, parsed in %.2f ms, loaded from the cache in %.2f ms"
+              % (program.name, "OK" if same else "MISMATCH", parse_time * 1000, cache_time * 1000))
+
+    #a change to the simulator's code gives the same file a different cache entry
+    before = set(os.listdir(folder))
+    code_hash = b'changed'
+    load_program(path, folder)
+    print("Cache entry replaced after a code change: %s" % ("OK" if len(set(os.listdir(folder)) - before) == 1
+                                                             else "MISSING"))
+
+    first_two = programs.plist[:2]
+    print("Slice: %s, %s" % (first_two.names(), "OK" if first_two[1] is programs.plist[1] else "MISMATCH"))
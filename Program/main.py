@@ -15,12 +15,25 @@ import wx
 import random
 import tm
 import programs
+import checkpoint
+from history import History
+from profiler import Profile
 
 
 BORDER = 2 #used around some elements, to provide a nice padding
 
+#the maximum number of times per second the window is updated while a simulation runs
+REFRESH_RATE = 30
+
+#the number of cells shown around each head while a simulation runs
+VIEWPORT_SIZE = 40
+
+#the number of cycles that can be undone with the Back button, when the history is recorded
+HISTORY_ENTRIES = 100000
+
 #used to highlight the head's position on each tape
 CURRENT_POS_STYLE = wx.TextAttr(wx.Colour(0, 0, 0), colBack=wx.Colour(0, 200, 255))
+NORMAL_STYLE = wx.TextAttr(wx.Colour(0, 0, 0), colBack=wx.Colour(255, 255, 255))
 
 
 """
@@ -59,8 +72,8 @@ class MainWindow(wx.Frame):
         controls_panel.Sizer.Add(program_label, 0, wx.ALIGN_CENTER_VERTICAL|wx.ALL, BORDER)
 
         program_chooser = wx.Choice(controls_panel)
-        for program in programs.plist:
-            program_chooser.Append(program.name)
+        for name in programs.plist.names():  #the programs themselves are loaded when selected
+            program_chooser.Append(name)
         controls_panel.Sizer.Add(program_chooser, 0, wx.EXPAND|wx.ALL, BORDER)
         
         
@@ -78,6 +91,23 @@ class MainWindow(wx.Frame):
         reset_button = wx.Button(controls_panel, label="Reset")
         reset_button.Enable(False)
         controls_panel.Sizer.Add(reset_button, 0, wx.EXPAND|wx.ALL, BORDER)
+
+        step_button = wx.Button(controls_panel, label="Step")
+        step_button.Enable(False)  #runs a single cycle while the simulation is paused
+        controls_panel.Sizer.Add(step_button, 0, wx.EXPAND|wx.ALL, BORDER)
+
+        back_button = wx.Button(controls_panel, label="Back")
+        back_button.Enable(False)  #steps back while the simulation is paused
+        controls_panel.Sizer.Add(back_button, 0, wx.EXPAND|wx.ALL, BORDER)
+
+        #recording the history (for the Back button) and the profile (for the Heat column)
+        #slows the simulation down and uses memory, so it's optional
+        record_box = wx.CheckBox(controls_panel, label="Record")
+        controls_panel.Sizer.Add(record_box, 0, wx.ALIGN_CENTER_VERTICAL|wx.ALL, BORDER)
+
+        snapshot_button = wx.Button(controls_panel, label="Snapshot")
+        snapshot_button.Enable(False)  #saves the snapshot taken when the simulation was paused
+        controls_panel.Sizer.Add(snapshot_button, 0, wx.EXPAND|wx.ALL, BORDER)
         #===End of top section===
 
 
@@ -95,6 +125,7 @@ class MainWindow(wx.Frame):
         program_table.InsertColumn(2, "To Write")
         program_table.InsertColumn(3, "Move")
         program_table.InsertColumn(4, "Next State")
+        program_table.InsertColumn(5, "Heat")  #the share of the executed steps, filled in when paused
         main_panel.Sizer.Add(program_table, 1, wx.EXPAND)
         #===End of main section===
 
@@ -102,6 +133,10 @@ class MainWindow(wx.Frame):
         self.Bind(wx.EVT_CHOICE, self.change_program, program_chooser)
         self.Bind(wx.EVT_BUTTON, self.run_pause, run_pause_button)
         self.Bind(wx.EVT_BUTTON, self.reset, reset_button)
+        self.Bind(wx.EVT_BUTTON, self.step, step_button)
+        self.Bind(wx.EVT_BUTTON, self.step_back, back_button)
+        self.Bind(wx.EVT_SPINCTRL, self.change_speed, speed_input)
+        self.Bind(wx.EVT_BUTTON, self.save_snapshot, snapshot_button)
 
         #for simplicity, we defined all elements locally, without using self,
         #and then we export only those that are needed
@@ -109,10 +144,15 @@ class MainWindow(wx.Frame):
         self.speed_input = speed_input
         self.run_pause_button = run_pause_button
         self.reset_button = reset_button
+        self.step_button = step_button
+        self.back_button = back_button
+        self.record_box = record_box
+        self.snapshot_button = snapshot_button
         self.tapes_panel = tapes_panel
         self.program_table = program_table
         
         self.tape_panels = list()
+        self.tape_views = list()
 
 
     def add_tape(self, value):
@@ -154,14 +194,53 @@ class MainWindow(wx.Frame):
             tape_entry.SetStyle(current_pos+1, current_pos+2, CURRENT_POS_STYLE)
 
 
+    """
+    Used while a simulation runs. Instead of the whole tape, it only shows a window of
+    VIEWPORT_SIZE cells around the head, and between updates it only replaces the cells that
+    changed and the highlighted head position. The window is redrawn only when the head leaves it.
+    [changes] = the (position, value) pairs of the tape's cells that changed since the last update
+    """
+    def update_tape_view(self, tape_nr, tape, head, changes):
+        tape_entry = self.tape_panels[tape_nr]
+        view = self.tape_views[tape_nr]  #(first position, last position + 1, head position)
+
+        if view == None or not view[0] <= head < view[1]:
+            start = max(tape.start, head - VIEWPORT_SIZE // 2)
+            end = min(tape.end, start + VIEWPORT_SIZE)
+            tape_entry.SetValue(''.join(tape.read(pos) for pos in range(start, end)))
+        else:
+            start, end, old_head = view
+            for pos, value in changes:
+                if start <= pos < end:
+                    tape_entry.Replace(pos - start, pos - start + 1, value)
+            tape_entry.SetStyle(old_head - start, old_head - start + 1, NORMAL_STYLE)
+
+        tape_entry.SetStyle(head - start, head - start + 1, CURRENT_POS_STYLE)
+        self.tape_views[tape_nr] = (start, end, head)
+
+
     def add_action(self, action):
         row = self.program_table.InsertStringItem(action['id'], action['state'])
         self.program_table.SetStringItem(row, 1, ','.join(action['read_values']))
         self.program_table.SetStringItem(row, 2, ','.join(action['write_values']))
         self.program_table.SetStringItem(row, 3, ','.join(action['directions']))
         self.program_table.SetStringItem(row, 4, action['next_state'])
+        self.program_table.SetStringItem(row, 5, "")
 
     
+    """
+    Fills the heat column with the number of times each action was executed
+    and its share of the steps, as collected by the machine's profile
+    """
+    def show_heat(self, profile):
+        if profile == None:  #the simulation wasn't recorded
+            return
+        heat = profile.action_heat(self.program_table.GetItemCount())
+        for action_id, share in enumerate(heat):
+            self.program_table.SetStringItem(action_id, 5, "%d (%.0f%%)" % (profile.action_counts[action_id],
+                                                                           share * 100))
+
+
     def select_action(self, action_id):
         for id in range(0, self.program_table.GetItemCount()):
             self.program_table.Select(id, False)
@@ -178,6 +257,7 @@ class MainWindow(wx.Frame):
         #replace the existing tapes with the ones usd by this program...
         self.tapes_panel.Sizer.Clear(True)
         self.tape_panels = list()
+        self.tape_views = list()
         for tape in self.program.tapes:
             self.add_tape(''.join(tape))
         self.tapes_panel.Layout()
@@ -193,16 +273,22 @@ class MainWindow(wx.Frame):
     def run_pause(self, event):
         #if we already have a machine running, just pause or resume it
         if hasattr(self, 'tm') and self.tm.running:
-            if self.tm.should_continue.is_set():  #if the TuringMachine isn't paused
-                self.tm.should_continue.clear()  #pause its thread
+            if not self.tm.paused:
+                self.tm.pause()  #the machine pauses before its next step
+                self.tm.wait_paused()
+                self.snapshot = checkpoint.take_snapshot(self.tm)  #saved by the Snapshot button
                 
-                self.speed_input.Enable(True)
+                self.step_button.Enable(True)
+                self.back_button.Enable(self.tm.history != None)
+                self.snapshot_button.Enable(True)
+                self.show_heat(self.tm.profile)
                 self.run_pause_button.SetLabel("Resume")
             else:
-                self.tm.speed = self.speed_input.GetValue()
-                self.tm.should_continue.set()  #resume the machine's thread
+                self.tm.resume()
                 
-                self.speed_input.Enable(False)
+                self.step_button.Enable(False)
+                self.back_button.Enable(False)
+                self.snapshot_button.Enable(False)
                 self.run_pause_button.SetLabel("Pause")
 
                 #focus on the table in order to better highlight the current action
@@ -211,7 +297,7 @@ class MainWindow(wx.Frame):
         #otherwise start a new simulation
         else:
             self.program_chooser.Enable(False)
-            self.speed_input.Enable(False)
+            self.record_box.Enable(False)
             self.reset_button.Enable(True)
             self.tapes_panel.Enable(False)
             self.run_pause_button.SetLabel("Pause")
@@ -220,8 +306,18 @@ class MainWindow(wx.Frame):
             #load the current UI values into the program's tapes
             for tape_nr, tape in enumerate(self.program.tapes):
                 self.program.tapes[tape_nr] = list(self.tape_panels[tape_nr].GetValue())
+            self.tape_views = [None] * len(self.program.tapes)
                 
-            self.tm = tm.TuringMachine(self.program, self.speed_input.GetValue(), self.tm_listener)
+            #at high speeds, the listener skips the steps that couldn't be displayed anyway,
+            #and the tapes are updated based on the cells that changed
+            history = None
+            profile = None
+            if self.record_box.GetValue():
+                history = History(max_entries=HISTORY_ENTRIES)
+                profile = Profile()
+            self.tm = tm.TuringMachine(self.program, self.speed_input.GetValue(), self.tm_listener,
+                                       listen_rate=REFRESH_RATE, track_changes=True, history=history,
+                                       profile=profile)
             self.tm.start()
 
 
@@ -231,17 +327,66 @@ class MainWindow(wx.Frame):
     """
     def reset(self, event=None):
         if hasattr(self, 'tm'):
-            self.tm.running = False
+            self.tm.cancel()
 
         self.program_chooser.Enable(True)
-        self.speed_input.Enable(True)
+        self.record_box.Enable(True)
         self.reset_button.Enable(False)
+        self.step_button.Enable(False)
+        self.back_button.Enable(False)
+        self.snapshot_button.Enable(False)
         self.tapes_panel.Enable(True)
         self.run_pause_button.SetLabel("Run")
         self.select_action(-1)
         
+        #(the tapes may still be lists, if the machine was stopped before converting them)
         for tape_nr, tape in enumerate(self.tm.program.tapes):
             self.update_tape(tape_nr, ''.join(tape), -1)
+        self.tape_views = [None] * len(self.tm.program.tapes)
+
+
+    """
+    Changes the speed of the running simulation right away
+    """
+    def change_speed(self, event):
+        if hasattr(self, 'tm') and self.tm.running:
+            self.tm.set_speed(self.speed_input.GetValue())
+
+
+    """
+    Runs one cycle of the paused simulation (the listener shows its steps)
+    """
+    def step(self, event):
+        self.tm.step()
+
+
+    """
+    Goes back one cycle in the paused simulation, and redraws the tapes
+    (they may have been replaced, if an older snapshot was restored)
+    """
+    def step_back(self, event):
+        if not self.tm.wait_paused(0):  #a step may still be running (see the Step button)
+            return
+        self.tm.step_back()
+        self.tape_views = [None] * len(self.tm.program.tapes)
+        self.window_updater(self.tm, tm.STEP_STATE)
+
+
+    """
+    Saves the snapshot taken when the simulation was paused to a file, chosen by the user,
+    so it can be resumed later (see checkpoint.py). If the machine was stepped since then,
+    a new snapshot is taken first.
+    """
+    def save_snapshot(self, event):
+        if not self.tm.wait_paused(0):  #a step is still running
+            return
+        if (self.snapshot.steps, self.snapshot.phase) != (self.tm.steps, self.tm.phase):
+            self.snapshot = checkpoint.take_snapshot(self.tm)
+        dialog = wx.FileDialog(self, "Save snapshot", wildcard="Snapshots (*.snapshot)|*.snapshot",
+                               style=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT)
+        if dialog.ShowModal() == wx.ID_OK:
+            self.snapshot.save(dialog.GetPath())
+        dialog.Destroy()
 
 
     """
@@ -262,12 +407,17 @@ class MainWindow(wx.Frame):
             self.reset()
         else:
             if tm.running:
+                changes = [list() for tape in tm.program.tapes]
+                for tape_nr, pos, value in tm.take_changes():
+                    changes[tape_nr].append((pos, value))
+
                 for tape_nr, tape in enumerate(tm.program.tapes):
-                    self.update_tape(tape_nr, ''.join(tape), tm.tapes_pos[tape_nr])
+                    self.update_tape_view(tape_nr, tape, tm.tapes_pos[tape_nr], changes[tape_nr])
                 
                 if tm.current_action != None:
                     self.select_action(tm.current_action['id'])
             else:
+                self.show_heat(tm.profile)
                 self.reset()
 
 
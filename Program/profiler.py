@@ -0,0 +1,179 @@
+"""
+File: profiler.py
+Finds out where a program spends its steps: which actions and states run the most,
+how far the heads travel, how often the tapes grow and how long each step type takes.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import collections
+import time
+
+from tm import STEP_READ, STEP_WRITE, STEP_MOVE, STEP_STATE
+
+#the most precise clock available (perf_counter is missing in Python 2)
+timer = getattr(time, 'perf_counter', time.time)
+
+STEP_NAMES = {STEP_READ: "read", STEP_WRITE: "write", STEP_MOVE: "move", STEP_STATE: "state"}
+
+
+"""
+The statistics collected while profiling a TuringMachine.
+To use it, pass it as the [profile] argument of a TuringMachine. The machine then runs
+wrapped versions of its step methods, so a machine without a profile doesn't pay anything.
+A Profile can be reused for more runs of the same program, in which case the statistics add up.
+
+[action_counts] = maps action ids to the number of times they were executed
+[state_counts] = maps states to the number of cycles run in them
+[head_travel] = the number of cells moved by each tape's head
+[left_growth] and [right_growth] = the number of times each tape grew at its left or right edge
+[phase_times] = maps the step types (STEP_READ, ...) to the time spent running them, in seconds
+"""
+class Profile:
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        self.action_counts = collections.Counter()
+        self.state_counts = collections.Counter()
+        self.head_travel = list()
+        self.left_growth = list()
+        self.right_growth = list()
+        self.phase_times = dict.fromkeys(STEP_NAMES, 0.0)
+
+
+    """
+    Returns the step methods of [machine], in the order of [steps], wrapped so they update
+    the statistics. Used by the TuringMachine when it starts.
+    """
+    def wrap_steps(self, machine, steps):
+        tape_count = len(machine.program.tapes)
+        for counts in (self.head_travel, self.left_growth, self.right_growth):
+            counts.extend([0] * (tape_count - len(counts)))
+        read_step, write_step, move_step, state_change_step = steps
+        phase_times = self.phase_times
+
+        def profiled_read():
+            start = timer()
+            read_step()
+            phase_times[STEP_READ] += timer() - start
+
+        def profiled_write():
+            start = timer()
+            write_step()
+            phase_times[STEP_WRITE] += timer() - start
+
+        def profiled_move():
+            tapes = machine.program.tapes
+            edges = [(tape.start, tape.end) for tape in tapes]
+            positions = list(machine.tapes_pos)
+            start = timer()
+            move_step()
+            phase_times[STEP_MOVE] += timer() - start
+            for tape_nr, tape in enumerate(tapes):
+                self.head_travel[tape_nr] += abs(machine.tapes_pos[tape_nr] - positions[tape_nr])
+                if tape.start < edges[tape_nr][0]:
+                    self.left_growth[tape_nr] += 1
+                if tape.end > edges[tape_nr][1]:
+                    self.right_growth[tape_nr] += 1
+
+        def profiled_state_change():
+            self.action_counts[machine.current_action['id']] += 1
+            self.state_counts[machine.current_state] += 1
+            start = timer()
+            state_change_step()
+            phase_times[STEP_STATE] += timer() - start
+
+        return (profiled_read, profiled_write, profiled_move, profiled_state_change)
+
+
+    """
+    Returns the [count] most executed actions, as (action id, executions) pairs
+    """
+    def hot_actions(self, count=None):
+        return self.action_counts.most_common(count)
+
+
+    """
+    Returns the [count] states where the most cycles were run, as (state, cycles) pairs
+    """
+    def hot_states(self, count=None):
+        return self.state_counts.most_common(count)
+
+
+    """
+    Returns a list with the share of the executed steps (between 0 and 1) for each of the
+    [action_count] actions of the program, in the order of their ids.
+    Used for showing a heat column next to the program's rules.
+    """
+    def action_heat(self, action_count):
+        total = sum(self.action_counts.values())
+        if total == 0:
+            return [0.0] * action_count
+        return [self.action_counts[action_id] / float(total) for action_id in range(action_count)]
+
+
+    """
+    Returns all the statistics as a dict, which can be saved as JSON
+    """
+    def to_dict(self):
+        return dict(action_counts=dict((str(action_id), count) for action_id, count in self.action_counts.items()),
+                    state_counts=dict(self.state_counts),
+                    head_travel=list(self.head_travel),
+                    left_growth=list(self.left_growth),
+                    right_growth=list(self.right_growth),
+                    phase_times=dict((STEP_NAMES[step], seconds) for step, seconds in self.phase_times.items()))
+
+
+    """
+    Returns a readable summary of the statistics. If the [program] is specified,
+    the actions are shown as rules instead of ids. Only the [top] actions and states are listed.
+    """
+    def report(self, program=None, top=10):
+        total = sum(self.action_counts.values())
+        lines = ["%d cycles" % total]
+
+        lines.append("Hottest actions:")
+        for action_id, count in self.hot_actions(top):
+            if program != None:
+                action = program.actions[action_id]
+                name = "%s %s -> %s %s %s" % (action['state'], ','.join(action['read_values']),
+                                              ','.join(action['write_values']), ','.join(action['directions']),
+                                              action['next_state'])
+            else:
+                name = "action %d" % action_id
+            lines.append("  %10d (%5.1f%%)  %s" % (count, 100.0 * count / total, name))
+
+        lines.append("Hottest states:")
+        for state, count in self.hot_states(top):
+            lines.append("  %10d (%5.1f%%)  %s" % (count, 100.0 * count / total, state))
+
+        lines.append("Tapes:")
+        for tape_nr in range(len(self.head_travel)):
+            lines.append("  tape %d: head moved %d cells, grew on the left %d times and on the right %d times"
+                         % (tape_nr, self.head_travel[tape_nr], self.left_growth[tape_nr],
+                            self.right_growth[tape_nr]))
+
+        lines.append("Time per step type:")
+        for step in sorted(self.phase_times):
+            lines.append("  %-6s %.3fs" % (STEP_NAMES[step], self.phase_times[step]))
+        return '\n'.join(lines)
+
+
+
+#Test Code
+if __name__ == "__main__":
+    import programs
+    from tm import TuringMachine
+
+    program = programs.plist.get("Multiplication")
+    program.tapes = [list("1110110111"), list("1101110101"), []]
+    profile = Profile()
+    machine = TuringMachine(program, speed=-1, profile=profile)
+    machine.run()
+    print(profile.report(program, top=5))
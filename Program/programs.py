@@ -10,23 +10,33 @@ License, v. 2.0. If a copy of the MPL was not distributed with this
 file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
+import glob
+import os
+
 from tm import TuringProgram
+from loader import ProgramList
+
+#the programs are only built when they're selected (see ProgramList)
+plist = ProgramList()
 
-plist = list()
+#every program file (see loader.parse_program) in this folder is added after the examples below
+PROGRAM_FILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'program_files')
 
 
 """
 Inversion
 This program simply inverts all digits in the inserted binary number.
 """
-program = TuringProgram("Inversion")
-program.set_tapes(list("101001"))
-program.state_initial = 'invert'
-program.set_actions("""\
+def inversion():
+    program = TuringProgram("Inversion")
+    program.set_tapes(list("101001"))
+    program.state_initial = 'invert'
+    program.set_actions("""\
 invert 0 1 > invert
 invert 1 0 > invert
 invert _ _ - halt""")
-plist.append(program)
+    return program
+plist.register("Inversion", inversion)
 
 
 
@@ -39,10 +49,11 @@ Then, both tapes are checked for equality, but from opposite ends.
 If the value is a palindrome, the program will simply end.
 If it's not a plaindrome, the program will throw an error.
 """
-program = TuringProgram("Palindrome Checker")
-program.set_tapes(list("101101"), [])
-program.state_initial = 'copy'
-program.set_actions("""\
+def palindrome_checker():
+    program = TuringProgram("Palindrome Checker")
+    program.set_tapes(list("101101"), [])
+    program.state_initial = 'copy'
+    program.set_actions("""\
 copy   0,_  0,0  >,> copy
 copy   1,_  1,1  >,> copy
 copy   _,_  _,_  <,- return
@@ -52,7 +63,8 @@ return _,_  _,_  >,< test
 test   0,0  0,0  >,< test
 test   1,1  1,1  >,< test
 test   _,_  _,_  -,- halt""")
-plist.append(program)
+    return program
+plist.register("Palindrome Checker", palindrome_checker)
 
 
 
@@ -63,10 +75,11 @@ and the last one for the result (this one should be empty when running the progr
 The program moves to the right start of each value, and then adds each digit.
 The carry is stored using a separate state.
 """
-program = TuringProgram("Addition")
-program.set_tapes(list("101001"), list("101101"), [])
-program.state_initial = 'move'
-program.set_actions("""\
+def addition():
+    program = TuringProgram("Addition")
+    program.set_tapes(list("101001"), list("101101"), [])
+    program.state_initial = 'move'
+    program.set_actions("""\
 move   0,0,_  0,0,_  >,>,> move
 move   0,1,_  0,1,_  >,>,> move
 move   0,_,_  0,_,_  >,-,> move
@@ -94,14 +107,16 @@ carry  1,_,_  1,_,0  <,-,< carry
 carry  _,0,_  _,0,1  -,<,< add
 carry  _,1,_  _,1,0  -,<,< carry
 carry  _,_,_  _,_,1  -,-,- halt""")
-plist.append(program)
+    return program
+plist.register("Addition", addition)
 
 
 
-program = TuringProgram("Multiplication")
-program.set_tapes(list("1011"), list("1110"), [])
-program.state_initial = 'move'
-program.set_actions("""\
+def multiplication():
+    program = TuringProgram("Multiplication")
+    program.set_tapes(list("1011"), list("1110"), [])
+    program.state_initial = 'move'
+    program.set_actions("""\
 move         0,0,_  0,0,_  >,>,> move
 move         0,1,_  0,1,_  >,>,> move
 move         0,_,_  0,_,_  >,-,> move
@@ -175,4 +190,10 @@ multi-shift  0,_,0  0,_,0  -,-,- halt
 multi-shift  0,_,1  0,_,1  -,-,- halt
 multi-shift  1,_,0  1,_,0  -,-,- halt
 multi-shift  1,_,1  1,_,1  -,-,- halt""")
-plist.append(program)
+    return program
+plist.register("Multiplication", multiplication)
+
+
+
+for path in sorted(glob.glob(os.path.join(PROGRAM_FILES_DIR, '*.tm'))):
+    plist.add_file(path)
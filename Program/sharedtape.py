@@ -0,0 +1,622 @@
+"""
+File: sharedtape.py
+Publishes a running machine's tapes, head positions and state in shared memory,
+so other processes can watch it without asking the machine for copies.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import json
+import os
+import time
+
+import multiprocessing
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:  #Python < 3.8
+    shared_memory = None
+
+import checkpoint
+from tapes import ByteTape
+
+
+MAGIC = b'TMSHM002'
+
+#the default number of cells reserved for each tape (the block grows when a tape needs more)
+CAPACITY = 1 << 20
+
+#the fields of the header, which is an array of 64 bit integers right after MAGIC
+HEADER_SEQUENCE = 0    #the seqlock: odd while the machine is changing its configuration
+HEADER_STATE = 1       #the index of the current state in the directory's states (-1 if unknown)
+HEADER_STEPS = 2
+HEADER_PHASE = 3
+HEADER_ACTION = 4      #the id of the current action (-1 for none)
+HEADER_TAPE_COUNT = 5
+HEADER_CAPACITY = 6
+HEADER_DIRECTORY = 7   #the length of the directory, the JSON data that follows the header
+HEADER_MOVED = 8       #0, or the generation of the block that replaced this one (see SharedMachine.grow)
+HEADER_FIELDS = 9
+
+#the fields stored for each tape after the header fields
+TAPE_ORIGIN = 0  #the index of position 0 in the tape's cells
+TAPE_START = 1
+TAPE_END = 2
+TAPE_HEAD = 3
+TAPE_FIELDS = 4
+
+#the names of the blocks created by this process
+created_blocks = set()
+
+
+"""
+Returns the name of the block of generation [generation] of the SharedMachine called [name]
+(the blocks that replace the first one when it grows get a number after the name)
+"""
+def get_block_name(name, generation):
+    return name if generation == 0 else "%s-%d" % (name, generation)
+
+
+"""
+Opens the shared memory block called [name], without letting this process' resource tracker
+destroy it when the process exits (since it belongs to the machine's process)
+"""
+def open_block(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  #Python < 3.13 always tracks it
+        block = shared_memory.SharedMemory(name=name)
+        #before Python 3.13, opening a block registers it with this process' resource tracker,
+        #which unlinks every registered block when the process exits, even the ones created by
+        #other processes (https://bugs.python.org/issue38119). An observer that exits first
+        #would remove the machine's block, so it's unregistered by hand. The processes started by
+        #multiprocessing share the tracker of their parent, where the block is already registered,
+        #so only the other ones unregister it. The tracker only handles POSIX shared memory,
+        #where it knows the blocks by their name with a leading slash.
+        if os.name == 'posix' and multiprocessing.parent_process() == None and name not in created_blocks:
+            resource_tracker.unregister('/' + block.name, 'shared_memory')
+        return block
+
+
+
+"""
+A ByteTape whose cells are stored in a shared memory block (see SharedMachine), so
+the values written by the machine can be seen directly by other processes.
+The cells are kept in the middle of [buffer], and moved back to the middle when the tape
+reaches one of its ends. When [buffer] is full, [on_full] is called with the tape and the number
+of cells it needs, and it must give it a larger buffer with move_to.
+Only the values of [symbols] can be written (the observers know their codes from the directory).
+"""
+class SharedTape(ByteTape):
+
+    """
+    The constructor method
+    [buffer] = the memoryview of the tape's space in the block
+    [symbols] = the values of each code, starting with the blank value
+    [tape] = the Tape (or sequence of values) to copy
+    [on_move] = called with the tape when its cells are moved, so the origin can be published
+    [on_full] = called with the tape and the number of cells it needs, when [buffer] is full
+    """
+    def __init__(self, buffer, symbols, tape, on_move=None, on_full=None):
+        self.blank = symbols[0]
+        self.symbols = list(symbols)
+        self.codes = dict((symbol, code) for code, symbol in enumerate(symbols))
+        self.on_move = on_move
+        self.on_full = on_full
+
+        codes = bytearray(self.get_code(value) for value in tape) or bytearray(1)
+        if len(codes) + 2 > len(buffer):
+            raise ValueError("The tape doesn't fit in %d shared cells" % len(buffer))
+        self.start = getattr(tape, 'start', 0)
+        self.end = self.start + len(codes)
+        self.cells = buffer
+        self.place(codes)
+
+
+    """
+    Writes [codes] (the tape's values, from start to end) in the middle of the cells
+    """
+    def place(self, codes):
+        first = (len(self.cells) - len(codes)) // 2
+        self.cells[:] = bytes(len(self.cells))
+        self.cells[first:first + len(codes)] = codes
+        self.origin = first - self.start
+
+
+    def add_symbol(self, symbol):
+        raise ValueError("Value '%s' is not part of the shared tape's alphabet" % symbol)
+
+
+    """
+    Moves the cells back to the middle of the space, when there's no spare cell left on one side
+    """
+    def recenter(self):
+        length = self.end - self.start
+        if length + 2 > len(self.cells):
+            if self.on_full == None:
+                raise ValueError("The shared tape is full (%d cells)" % len(self.cells))
+            self.on_full(self, length + 2)
+            return
+        self.place(self.view().tobytes())
+        if self.on_move != None:
+            self.on_move(self)
+
+
+    """
+    Moves the cells to the middle of [buffer] (the new space of the tape), and returns the old one
+    """
+    def move_to(self, buffer):
+        codes = self.view().tobytes()
+        if len(codes) + 2 > len(buffer):
+            raise ValueError("The tape doesn't fit in %d shared cells" % len(buffer))
+        old = self.cells
+        self.cells = buffer
+        self.place(codes)
+        if self.on_move != None:
+            self.on_move(self)
+        return old
+
+
+    def extend_left(self):
+        if self.origin + self.start <= 0:
+            self.recenter()
+        self.start -= 1
+
+
+    def extend_right(self):
+        if self.origin + self.end >= len(self.cells):
+            self.recenter()
+        self.end += 1
+
+
+    """
+    Moves the cells out of the shared memory block, into a private bytearray,
+    so the tape can still be used (and grow) after the block is closed
+    """
+    def detach(self):
+        cells = self.cells
+        self.cells = bytearray(cells)
+        cells.release()
+        self.on_move = None
+        self.on_full = None
+
+
+    def __repr__(self):
+        return "SharedTape(%r, start=%d)" % (self.to_string(), self.start)
+
+
+
+"""
+A shared memory block that shows the configuration of a TuringMachine to other processes.
+To use it, pass it as the [shared] argument of a TuringMachine. When the machine starts,
+its tapes are replaced by SharedTapes stored in the block, and after every step it publishes
+its state, step count, phase, current action and head positions in the block's header.
+Other processes open the block by its [name], with a SharedObserver.
+
+The block contains MAGIC, the header (an array of 64 bit integers, see the HEADER_ and TAPE_
+constants), the directory (JSON data with the program's hash, name, symbols and states), and
+the cells of each tape, a byte per cell (like a ByteTape).
+
+The header is protected by a seqlock: the machine makes the sequence number odd before
+changing anything and even again once it's done, so a reader knows its copy is consistent
+if the sequence number was the same even number before and after reading.
+
+A block can't be resized, so when a tape needs more than [capacity] cells, the machine moves
+to a new block with twice the capacity (see grow), called [name] followed by its generation
+(see get_block_name), and sets HEADER_MOVED in the old one, so the observers follow it.
+The old blocks are kept until unlink(), so observers can still be opened with [name].
+
+[program] = the TuringProgram that will be run. It's only used for its alphabet, states and tapes.
+[capacity] = the number of cells reserved at first for each tape
+[name] = the block's name (by default, a random one is chosen)
+The blocks are removed by unlink(), which should be called when they aren't needed anymore.
+"""
+class SharedMachine:
+    def __init__(self, program, capacity=CAPACITY, name=None):
+        if shared_memory == None:
+            raise RuntimeError("Shared memory requires Python 3.8 or newer")
+
+        self.symbols = program.get_symbols()
+        self.states = [program.state_initial, program.state_final]
+        for action in program.actions:
+            for state in (action['state'], action['next_state']):
+                if state not in self.states:
+                    self.states.append(state)
+        self.state_ids = dict((state, state_id) for state_id, state in enumerate(self.states))
+        self.tape_count = len(program.tapes)
+
+        self.directory = json.dumps(dict(program_hash=program.get_hash(), program_name=program.name,
+                                         symbols=self.symbols, states=self.states)).encode('utf-8')
+        self.header_size = 8 * (HEADER_FIELDS + TAPE_FIELDS * self.tape_count)
+        self.cells_offset = len(MAGIC) + self.header_size + len(self.directory)
+        self.cells_offset += -self.cells_offset % 8
+        self.generation = 0
+        self.retired = list()  #the blocks replaced by grow(), kept until unlink()
+        self.create_block(name, capacity)
+        self.name = self.block.name
+        self.tapes = list()
+        self.attached = False  #the sequence number stays odd until the first attach()
+
+
+    """
+    Creates a block (the machine's new [block] and [header]) with [capacity] cells per tape,
+    and fills its header. Its sequence number is odd until the machine publishes its configuration.
+    """
+    def create_block(self, name, capacity):
+        self.block = shared_memory.SharedMemory(name=name, create=True,
+                                                size=self.cells_offset + capacity * self.tape_count)
+        created_blocks.add(self.block.name)
+        self.capacity = capacity
+
+        buffer = self.block.buf
+        buffer[:len(MAGIC)] = MAGIC
+        self.header = buffer[len(MAGIC):len(MAGIC) + self.header_size].cast('q')
+        self.header[HEADER_SEQUENCE] = 1  #odd until a machine is attached, so readers wait for it
+        self.header[HEADER_STATE] = 0
+        self.header[HEADER_STEPS] = 0
+        self.header[HEADER_PHASE] = 0
+        self.header[HEADER_ACTION] = -1
+        self.header[HEADER_TAPE_COUNT] = self.tape_count
+        self.header[HEADER_CAPACITY] = capacity
+        self.header[HEADER_DIRECTORY] = len(self.directory)
+        self.header[HEADER_MOVED] = 0
+        first = len(MAGIC) + self.header_size
+        buffer[first:first + len(self.directory)] = self.directory
+
+
+    """
+    Returns the space of the tape [tape_nr] in the current block
+    """
+    def get_buffer(self, tape_nr):
+        first = self.cells_offset + tape_nr * self.capacity
+        return self.block.buf[first:first + self.capacity]
+
+
+    """
+    Moves the machine to a new block, with at least [cells] cells per tape (and at least twice
+    the current capacity), and tells the observers of the old block to follow it.
+    Only called in the middle of a change, so the new block is published by the following end().
+    """
+    def grow(self, cells):
+        capacity = self.capacity * 2
+        while capacity < cells:
+            capacity *= 2
+        old_block = self.block
+        old_header = self.header
+        self.generation += 1
+        self.create_block(get_block_name(self.name, self.generation), capacity)
+        for field in range(HEADER_FIELDS, len(old_header)):
+            self.header[field] = old_header[field]
+        for tape_nr, tape in enumerate(self.tapes):
+            tape.move_to(self.get_buffer(tape_nr)).release()
+
+        old_header[HEADER_MOVED] = self.generation
+        old_header.release()
+        old_block.close()
+        self.retired.append(old_block)
+
+
+    """
+    Called by a SharedTape when it needs [cells] cells, which is more than the current capacity
+    """
+    def grow_tape(self, tape, cells):
+        self.grow(cells)
+
+
+    """
+    Replaces the tapes of [machine] with SharedTapes (with the same values), and publishes its configuration.
+    Run by the machine when it starts, and when it restores a snapshot. If it's called in the middle
+    of a change (like TuringMachine.seek), the change is left open, to be ended by the caller.
+    """
+    def attach(self, machine):
+        if len(machine.program.tapes) != self.tape_count:
+            raise ValueError("The machine has %d tapes, but the shared block was made for %d"
+                             % (len(machine.program.tapes), self.tape_count))
+        began = self.header[HEADER_SEQUENCE] % 2 == 0
+        if began:
+            self.begin()
+        for tape in self.tapes:
+            tape.detach()
+        self.tapes = list()
+        cells = max([len(tape) for tape in machine.program.tapes] + [1]) + 2
+        if cells > self.capacity:
+            self.grow(cells)
+        for tape_nr, tape in enumerate(machine.program.tapes):
+            self.tapes.append(SharedTape(self.get_buffer(tape_nr), self.symbols, tape,
+                                         self.publish_origin, self.grow_tape))
+            self.publish_origin(self.tapes[-1])
+        machine.program.tapes = list(self.tapes)
+        if began or not self.attached:
+            self.end(machine)
+        self.attached = True
+
+
+    """
+    Marks the start of a change: readers will retry until end() is called
+    """
+    def begin(self):
+        self.header[HEADER_SEQUENCE] += 1
+
+
+    """
+    Publishes the configuration of [machine] and marks the end of the change.
+    [phase] = the machine's next step, if it's about to change its phase
+    """
+    def end(self, machine, phase=None):
+        header = self.header
+        header[HEADER_STATE] = self.state_ids.get(machine.current_state, -1)
+        header[HEADER_STEPS] = machine.steps
+        header[HEADER_PHASE] = machine.phase if phase == None else phase
+        action = machine.current_action
+        header[HEADER_ACTION] = action['id'] if action != None else -1
+        field = HEADER_FIELDS
+        for tape_nr, tape in enumerate(self.tapes):
+            header[field + TAPE_START] = tape.start
+            header[field + TAPE_END] = tape.end
+            header[field + TAPE_HEAD] = machine.tapes_pos[tape_nr]
+            field += TAPE_FIELDS
+        header[HEADER_SEQUENCE] += 1
+
+
+    """
+    Called by a SharedTape when its cells are moved (always in the middle of a change)
+    """
+    def publish_origin(self, tape):
+        self.header[HEADER_FIELDS + TAPE_FIELDS * self.tapes.index(tape) + TAPE_ORIGIN] = tape.origin
+
+
+    """
+    Returns the step methods of [machine], wrapped so each step is a change of the
+    shared configuration. Used by the TuringMachine when it starts, like Profile.wrap_steps.
+    """
+    def wrap_steps(self, machine, steps):
+        begin = self.begin
+        end = self.end
+
+        def wrap(step, next_phase):
+            def shared_step():
+                begin()
+                try:
+                    step()
+                finally:
+                    end(machine, next_phase)
+            return shared_step
+
+        return tuple(wrap(step, (phase + 1) % len(steps)) for phase, step in enumerate(steps))
+
+
+    """
+    Closes the block in this process. The machine's tapes are moved to private memory first,
+    so they can still be used.
+    """
+    def close(self):
+        for tape in self.tapes:
+            tape.detach()
+        self.tapes = list()
+        self.header.release()
+        self.block.close()
+
+
+    """
+    Closes and removes the blocks (observers that are still open keep their own mapping)
+    """
+    def unlink(self):
+        self.close()
+        for block in self.retired + [self.block]:
+            block.unlink()
+        self.retired = list()
+
+
+
+"""
+Reads the configuration of a machine published by a SharedMachine in another process,
+without interrupting it. When the machine moves to a larger block, the observer follows it.
+[name] = the name of the SharedMachine's block
+[timeout] = how long (in seconds) a read keeps retrying while the machine is changing
+            its configuration, before giving up
+"""
+class SharedObserver:
+    def __init__(self, name, timeout=1.0):
+        if shared_memory == None:
+            raise RuntimeError("Shared memory requires Python 3.8 or newer")
+        self.name = name
+        self.timeout = timeout
+        self.retired = list()  #the blocks the machine moved away from, closed by close()
+        self.open(name)
+
+
+    """
+    Opens the block called [name] and reads its header and directory
+    """
+    def open(self, name):
+        self.block = open_block(name)
+        buffer = self.block.buf
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            self.block.close()
+            raise ValueError("'%s' is not a shared machine" % name)
+        header = buffer[len(MAGIC):len(MAGIC) + 8 * HEADER_FIELDS].cast('q')
+        self.tape_count = header[HEADER_TAPE_COUNT]
+        self.capacity = header[HEADER_CAPACITY]
+        directory_length = header[HEADER_DIRECTORY]
+        header.release()
+
+        header_size = 8 * (HEADER_FIELDS + TAPE_FIELDS * self.tape_count)
+        self.header = buffer[len(MAGIC):len(MAGIC) + header_size].cast('q')
+        first = len(MAGIC) + header_size
+        directory = json.loads(bytes(buffer[first:first + directory_length]).decode('utf-8'))
+        self.program_hash = directory['program_hash']
+        self.program_name = directory['program_name']
+        self.symbols = directory['symbols']
+        self.states = directory['states']
+        cells_offset = first + directory_length
+        cells_offset += -cells_offset % 8
+        self.cells = [buffer[cells_offset + tape_nr * self.capacity:cells_offset + (tape_nr + 1) * self.capacity]
+                      for tape_nr in range(self.tape_count)]
+
+
+    """
+    Opens the block that replaced the current one, when the machine moved to a larger block.
+    The current block is only closed by close(), since views of its cells may still be in use.
+    """
+    def follow(self):
+        generation = self.header[HEADER_MOVED]
+        for view in self.cells:
+            view.release()
+        self.header.release()
+        self.retired.append(self.block)
+        self.open(get_block_name(self.name, generation))
+
+
+    """
+    Runs [function] until the machine doesn't change its configuration while it runs,
+    and returns its result
+    """
+    def read_consistent(self, function):
+        deadline = time.time() + self.timeout
+        while True:
+            while self.header[HEADER_MOVED] != 0:
+                self.follow()
+            header = self.header
+            sequence = header[HEADER_SEQUENCE]
+            if sequence % 2 == 0:
+                result = function()
+                if header[HEADER_SEQUENCE] == sequence:
+                    return result
+            if time.time() > deadline:
+                raise RuntimeError("The machine didn't publish a consistent configuration for %.1f seconds"
+                                   % self.timeout)
+            time.sleep(0)
+
+
+    """
+    Returns the current sequence number, the header fields (a list of integers, see the HEADER_
+    and TAPE_ constants) and a memoryview of each tape's cells (from start to end), without
+    copying them. The views change as the machine runs: the values seen through them are only
+    consistent with the header while is_current(sequence) is True.
+    The views must be released before the observer is closed.
+    """
+    def views(self):
+        def read():
+            fields = self.header.tolist()
+            tapes = list()
+            for tape_nr in range(self.tape_count):
+                field = HEADER_FIELDS + tape_nr * TAPE_FIELDS
+                origin = fields[field + TAPE_ORIGIN]
+                tapes.append(self.cells[tape_nr][origin + fields[field + TAPE_START]:
+                                                 origin + fields[field + TAPE_END]])
+            return fields[HEADER_SEQUENCE], fields, tapes
+        return self.read_consistent(read)
+
+
+    """
+    Returns True if the machine hasn't changed anything since [sequence] was read
+    """
+    def is_current(self, sequence):
+        return self.header[HEADER_SEQUENCE] == sequence and self.header[HEADER_MOVED] == 0
+
+
+    """
+    Returns a consistent copy of the machine's configuration, as a checkpoint.Snapshot
+    (so it can also be saved, or resumed by another machine). Only the used cells are copied.
+    """
+    def snapshot(self):
+        def read():
+            fields = self.header.tolist()
+            tapes = list()
+            tapes_pos = list()
+            for tape_nr in range(self.tape_count):
+                field = HEADER_FIELDS + tape_nr * TAPE_FIELDS
+                origin = fields[field + TAPE_ORIGIN]
+                start = fields[field + TAPE_START]
+                codes = self.cells[tape_nr][origin + start:origin + fields[field + TAPE_END]]
+                tapes.append(ByteTape.from_codes(codes, self.symbols, start))
+                tapes_pos.append(fields[field + TAPE_HEAD])
+            return fields, tapes, tapes_pos
+        fields, tapes, tapes_pos = self.read_consistent(read)
+
+        state = self.states[fields[HEADER_STATE]] if fields[HEADER_STATE] >= 0 else None
+        action_id = fields[HEADER_ACTION] if fields[HEADER_ACTION] >= 0 else None
+        return checkpoint.Snapshot(self.program_hash, self.program_name, state, fields[HEADER_PHASE],
+                                   action_id, tapes_pos, fields[HEADER_STEPS], tapes)
+
+
+    def close(self):
+        for view in self.cells:
+            view.release()
+        self.cells = list()
+        self.header.release()
+        for block in self.retired + [self.block]:
+            block.close()
+        self.retired = list()
+
+
+
+#Test Code
+if __name__ == "__main__":
+    import copy
+    import programs
+    from tm import TuringMachine, run_to_halt
+    from history import History
+
+    #an observer process, which takes snapshots while the machine runs (until it halts),
+    #and checks each one by resuming it
+    def observe(name, expected, results):
+        observer = SharedObserver(name)
+        program = programs.plist.get("Multiplication")
+        checked = 0
+        same = True
+        while True:
+            snapshot = observer.snapshot()
+            if snapshot.state == program.state_final:
+                break
+            machine = TuringMachine(copy.deepcopy(program), speed=-1, resume=snapshot)
+            machine.run()
+            result = machine.result
+            if [''.join(tape).strip('_') for tape in result.tapes] != expected or not result.halted:
+                same = False
+            checked += 1
+        observer.close()
+        results.put((checked, same))
+
+    program = programs.plist.get("Multiplication")
+    program.tapes = [list("11" + "1" * 60), list("11" + "01" * 30), []]
+    expected = [''.join(tape).strip('_') for tape in run_to_halt(copy.deepcopy(program)).tapes]
+
+    #the tapes start with more cells than the block has, and grow well beyond it
+    shared = SharedMachine(program, capacity=32)
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=observe, args=(shared.name, expected, results))
+    process.start()
+    machine = TuringMachine(copy.deepcopy(program), speed=-1, shared=shared)
+    machine.run()
+    checked, same = results.get()
+    process.join()
+    print("%d snapshots taken by another process while the machine ran %d steps: %s"
+          % (checked, machine.steps, "OK" if same else "MISMATCH"))
+    print("The block grew %d times, to %d cells per tape" % (shared.generation, shared.capacity))
+    shared.unlink()
+
+    #a seek that restores one of the history's checkpoints publishes the configuration it reaches
+    program.tapes = [list("111"), list("11"), []]
+    shared = SharedMachine(program, capacity=256)
+    machine = TuringMachine(copy.deepcopy(program), speed=-1, shared=shared,
+                            history=History(checkpoint_interval=4))
+    machine.pause()
+    machine.start()
+    machine.wait_paused()
+    machine.step(20)
+    machine.wait_paused()
+    machine.seek(10)
+    observer = SharedObserver(shared.name)
+    snapshot = observer.snapshot()
+    same = (snapshot.steps == machine.steps and snapshot.state == machine.current_state and
+            [list(tape) for tape in snapshot.tapes] == [list(tape) for tape in machine.program.tapes])
+    print("Observed after seeking to step 10: %s" % ("OK" if same else "MISMATCH"))
+    observer.close()
+    machine.cancel()
+    machine.join()
+    shared.unlink()
@@ -0,0 +1,297 @@
+"""
+File: sweep.py
+Runs a program on every possible input up to a given length, remembering the results
+in an on-disk cache, so later sweeps (or longer ones) only run the inputs they haven't seen.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import collections
+import itertools
+import json
+import os
+import sqlite3
+import time
+
+from tm import RunResult, STATUS_TIME_LIMIT
+from tapes import Tape
+from loader import CACHE_DIR
+from batch import run_batch
+
+
+#where the results are cached, by default
+CACHE_PATH = os.path.join(CACHE_DIR, 'sweep.sqlite')
+
+#the default maximum number of results kept in the cache (the least recently used ones are removed)
+CACHE_ENTRIES = 1000000
+
+#the default maximum number of steps for each input, since some inputs may never halt
+MAX_STEPS = 100000
+
+#the maximum number of inputs looked up in a single query (SQLite limits the number of parameters)
+LOOKUP_CHUNK = 500
+
+
+"""
+Returns every input of the given [length] for [program], as tuples with a string for each tape:
+each tape that isn't empty in the program gets a string of the program's input values, and the
+longest of them has [length] values. With more than one input tape, the others can be shorter,
+so every combination of lengths is swept once (at the length of its longest tape).
+The empty tapes stay empty.
+The inputs are generated in order, so they can be used one at a time.
+"""
+def enumerate_inputs(program, length):
+    input_tapes = [tape_nr for tape_nr, tape in enumerate(program.tapes) if len(tape) > 0]
+    values = [[''.join(value) for value in itertools.product(program.input_values, repeat=value_length)]
+              for value_length in range(length + 1)]
+    for lengths in itertools.product(range(length + 1), repeat=len(input_tapes)):
+        if max(lengths + (0,)) != length:
+            continue
+        for combination in itertools.product(*[values[value_length] for value_length in lengths]):
+            tapes = [''] * len(program.tapes)
+            for tape_nr, value in zip(input_tapes, combination):
+                tapes[tape_nr] = value
+            yield tuple(tapes)
+
+
+
+"""
+The results of previous runs, stored in an SQLite database at [path], keyed by the program's hash
+(see TuringProgram.get_hash), the step limit and the input, so the same program (even if it's
+built again, or loaded in another process) doesn't need to be run on the same input twice.
+When there are more than [max_entries] results, the least recently used ones are removed.
+"""
+class ResultCache:
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_ENTRIES):
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.path = path
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS results (
+                                       program_hash TEXT, max_steps INTEGER, input TEXT,
+                                       result TEXT, last_used REAL,
+                                       PRIMARY KEY (program_hash, max_steps, input))""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.connection.commit()
+
+
+    """
+    Returns the cached results of [program] for the given [inputs] (tuples of tape values),
+    as a dict that maps the inputs to RunResults. Inputs without a cached result are left out.
+    The inputs are looked up LOOKUP_CHUNK at a time.
+    """
+    def get(self, program, max_steps, inputs):
+        program_hash = program.get_hash()
+        #the step limit is saved as -1 when there's none, since NULL values are never equal in SQL
+        max_steps = -1 if max_steps == None else max_steps
+        keys = dict((json.dumps(input), input) for input in inputs)
+        found = dict()
+        encoded = list(keys)
+        for first in range(0, len(encoded), LOOKUP_CHUNK):
+            chunk = encoded[first:first + LOOKUP_CHUNK]
+            rows = self.connection.execute("SELECT input, result FROM results WHERE program_hash = ? AND max_steps = ? "
+                                           "AND input IN (%s)" % ', '.join('?' * len(chunk)),
+                                           [program_hash, max_steps] + chunk)
+            for key, result in rows:
+                found[keys[key]] = decode_result(program, json.loads(result))
+        if found:
+            now = time.time()
+            self.connection.executemany("UPDATE results SET last_used = ? WHERE program_hash = ? AND max_steps = ? "
+                                        "AND input = ?",
+                                        [(now, program_hash, max_steps, json.dumps(input)) for input in found])
+            self.connection.commit()
+        return found
+
+
+    """
+    Saves the [results] of [program], a dict that maps inputs to RunResults.
+    Results that were cut short by a time limit aren't saved, since they depend on the machine's speed.
+    """
+    def put(self, program, max_steps, results):
+        program_hash = program.get_hash()
+        max_steps = -1 if max_steps == None else max_steps
+        now = time.time()
+        rows = [(program_hash, max_steps, json.dumps(input), json.dumps(encode_result(result)), now)
+                for input, result in results.items() if result.status != STATUS_TIME_LIMIT]
+        self.connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", rows)
+        self.evict()
+        self.connection.commit()
+
+
+    """
+    Removes the least recently used results, if there are more than [max_entries]
+    """
+    def evict(self):
+        count = self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute("DELETE FROM results WHERE rowid IN "
+                                    "(SELECT rowid FROM results ORDER BY last_used LIMIT ?)",
+                                    (count - self.max_entries,))
+
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+    def close(self):
+        self.connection.close()
+
+
+
+"""
+Converts [result] (a RunResult) to a dict that can be saved as JSON
+"""
+def encode_result(result):
+    return dict(tapes=[[tape.start, list(tape)] for tape in result.tapes],
+                tapes_pos=list(result.tapes_pos), state=result.state, steps=result.steps,
+                action_id=result.action['id'] if result.action != None else None,
+                halted=result.halted, error=result.error, status=result.status)
+
+
+"""
+Converts a dict made by encode_result back to a RunResult of [program]
+"""
+def decode_result(program, data):
+    tapes = [Tape(values, program.symbol_blank, start) for start, values in data['tapes']]
+    action = program.actions[data['action_id']] if data['action_id'] != None else None
+    return RunResult(tapes, data['tapes_pos'], data['state'], data['steps'], action,
+                     data['halted'], data['error'], data['status'])
+
+
+
+"""
+A sweep of [program] over all its inputs (see enumerate_inputs), from the empty input
+to inputs of a growing length. Call run(length) to extend it: only the lengths that weren't
+swept yet are run, and the inputs found in the cache aren't run again.
+The other inputs are run in parallel, with batch.run_batch.
+
+[max_steps] and [max_seconds] limit each run (see run_batch)
+[cache_path] = where the results are cached (see ResultCache). None disables the cache.
+[cache_entries] = the maximum number of results kept in the cache
+[workers] = the number of worker processes (by default, one for each CPU)
+[results] = maps each input (a tuple with the values of each tape) to its RunResult
+[length] = the length of the longest inputs swept so far (-1 before the first run)
+[computed] = the number of inputs that were actually run (the others came from the cache)
+"""
+class Sweep:
+    def __init__(self, program, max_steps=MAX_STEPS, max_seconds=None, cache_path=CACHE_PATH,
+                 cache_entries=CACHE_ENTRIES, workers=None):
+        self.program = program
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.cache = None
+        if cache_path != None:
+            self.cache = ResultCache(cache_path, cache_entries)
+        self.workers = workers
+        self.results = collections.OrderedDict()
+        self.length = -1
+        self.computed = 0
+
+
+    """
+    Extends the sweep to the inputs of every length up to [length].
+    Returns the results of the new inputs, as a dict like [results].
+    """
+    def run(self, length):
+        found = collections.OrderedDict()
+        for input_length in range(self.length + 1, length + 1):
+            inputs = list(enumerate_inputs(self.program, input_length))
+            cached = dict()
+            if self.cache != None:
+                cached = self.cache.get(self.program, self.max_steps, inputs)
+            missing = [input for input in inputs if input not in cached]
+
+            computed = dict()
+            if missing:
+                jobs = ([list(value) for value in input] for input in missing)
+                for job_id, result in run_batch(self.program, jobs, self.max_steps, self.max_seconds,
+                                                workers=self.workers):
+                    computed[missing[job_id]] = result
+                self.computed += len(computed)
+                if self.cache != None:
+                    self.cache.put(self.program, self.max_steps, computed)
+
+            for input in inputs:
+                found[input] = cached[input] if input in cached else computed[input]
+            self.length = input_length
+        self.results.update(found)
+        return found
+
+
+    """
+    Returns a readable summary of the sweep: for each length, the number of inputs
+    that halted, stopped with an error, or reached a limit
+    """
+    def report(self):
+        counts = collections.OrderedDict()
+        for input, result in self.results.items():
+            length = max([len(value) for value in input] + [0])
+            count = counts.setdefault(length, [0, 0, 0])  #halted, errors, limits
+            if result.halted:
+                count[0] += 1
+            elif result.error != None:
+                count[1] += 1
+            else:
+                count[2] += 1
+        lines = ["%s (at most %s steps per input)" % (self.program.name, self.max_steps)]
+        for length, (halted, errors, limited) in counts.items():
+            lines.append("  length %2d: %6d halted, %6d errors, %6d reached a limit" % (length, halted, errors, limited))
+        return '\n'.join(lines)
+
+
+
+#Test Code
+if __name__ == "__main__":
+    import copy
+    import tempfile
+    import programs
+    from tm import run_to_halt
+
+    program = programs.plist.get("Palindrome Checker")
+    path = os.path.join(tempfile.mkdtemp(), 'sweep.sqlite')
+
+    #sweep up to length 6, then extend it to 8: only the new lengths are run
+    sweep = Sweep(program, cache_path=path)
+    sweep.run(6)
+    first = sweep.computed
+    sweep.run(8)
+    print(sweep.report())
+    print("Run %d inputs, then %d more for the longer lengths" % (first, sweep.computed - first))
+
+    #a new sweep of the same program (built again) takes every result from the cache,
+    #looked up a few inputs at a time
+    LOOKUP_CHUNK = 7
+    again = Sweep(programs.palindrome_checker(), cache_path=path)
+    again.run(8)
+    same = True
+    for input, result in again.results.items():
+        expected = copy.deepcopy(program)
+        expected.set_tapes(*[list(value) for value in input])
+        expected = run_to_halt(expected, MAX_STEPS)
+        if ([tape.to_string().strip('_') for tape in result.tapes], result.tapes_pos, result.steps,
+            result.halted, result.error) != \
+           ([tape.to_string().strip('_') for tape in expected.tapes], expected.tapes_pos, expected.steps,
+            expected.halted, expected.error):
+            same = False
+    print("Second sweep: %d of %d inputs run, results %s" % (again.computed, len(again.results),
+                                                            "OK" if same else "MISMATCH"))
+
+    #a small cache keeps only the most recently used results
+    small = Sweep(program, max_steps=None, cache_path=os.path.join(os.path.dirname(path), 'small.sqlite'),
+                  cache_entries=100)
+    small.run(8)
+    print("Cache limited to 100 entries: %d kept" % len(small.cache))
+
+    #with two input tapes, the inputs of each length have every combination of shorter values
+    addition = programs.plist.get("Addition")
+    inputs = [input for length in range(4) for input in enumerate_inputs(addition, length)]
+    values = [''.join(value) for length in range(4) for value in itertools.product('01', repeat=length)]
+    expected = set((first, second, '') for first in values for second in values)
+    print("Addition inputs up to length 3: %d, %s" % (len(inputs), "OK" if len(set(inputs)) == len(inputs)
+                                                      and set(inputs) == expected else "MISMATCH"))
@@ -0,0 +1,553 @@
+"""
+File: tapes.py
+The tape types used by the turing machine.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+
+"""
+A tape that can grow in both directions in amortized constant time.
+The cells are addressed by logical positions, which never change when the tape grows:
+the first value given to the constructor is at position [start] (0 by default),
+the ones on its left have negative positions.
+
+The values are kept in a list with some spare blank cells on the left side,
+so adding a cell there doesn't have to move the whole tape (like list.insert(0, ...) does).
+Only the cells between [start] and [end] (excluding end) are part of the tape, the others are
+just preallocated space.
+
+For compatibility with the old list tapes, the tape can also be used as a sequence
+of its values (len(), iteration, indexing and slicing, where index 0 is the leftmost cell),
+so ''.join(tape) still works.
+"""
+class Tape:
+    sparse = False  #see SparseTape
+
+    """
+    The constructor method
+    [values] = the initial values of the tape. If empty, the tape starts with a single blank cell.
+    [blank] = the value used for new cells
+    [start] = the position of the first value
+    """
+    def __init__(self, values=(), blank='_', start=0):
+        self.blank = blank
+        self.cells = list(values) or [blank]
+        self.origin = -start               #the index in [cells] of position 0
+        self.start = start                 #the leftmost position of the tape
+        self.end = start + len(self.cells) #the position right after the rightmost one
+
+
+    """
+    Returns the value at [pos]
+    """
+    def read(self, pos):
+        return self.cells[self.origin + pos]
+
+
+    """
+    Replaces the value at [pos] with [value]
+    """
+    def write(self, pos, value):
+        self.cells[self.origin + pos] = value
+
+
+    """
+    Adds a blank cell to the left side of the tape.
+    When there's no spare space left, the reserved space is doubled, so this is amortized O(1).
+    """
+    def extend_left(self):
+        self.start -= 1
+        if self.origin + self.start < 0:
+            count = max(len(self.cells), 16)
+            self.cells[0:0] = [self.blank] * count
+            self.origin += count
+
+
+    """
+    Adds a blank cell to the right side of the tape.
+    """
+    def extend_right(self):
+        self.end += 1
+        if self.origin + self.end > len(self.cells):
+            self.cells.append(self.blank)
+
+
+    """
+    Makes sure [pos] is part of the tape, extending it with blank cells if needed.
+    """
+    def reach(self, pos):
+        while pos < self.start:
+            self.extend_left()
+        while pos >= self.end:
+            self.extend_right()
+
+
+    """
+    List compatibility: adds a value on the right side of the tape
+    """
+    def append(self, value):
+        self.extend_right()
+        self.write(self.end - 1, value)
+
+
+    """
+    Returns the positions of the tape, from left to right
+    """
+    def positions(self):
+        return range(self.start, self.end)
+
+
+    """
+    Returns the tape's values as a string
+    """
+    def to_string(self):
+        return ''.join(self.cells[self.origin + self.start:self.origin + self.end])
+
+
+    def __len__(self):
+        return self.end - self.start
+
+
+    def __iter__(self):
+        cells = self.cells
+        for index in range(self.origin + self.start, self.origin + self.end):
+            yield cells[index]
+
+
+    """
+    Sequence indexing, where [index] 0 is the leftmost cell (at position [start])
+    """
+    def __getitem__(self, index):
+        base = self.origin + self.start
+        if isinstance(index, slice):
+            first, last, step = index.indices(len(self))
+            if step > 0:
+                return self.cells[base + first:base + last:step] if first < last else []
+            return [self.cells[base + i] for i in range(first, last, step)]
+        return self.cells[base + self.check_index(index)]
+
+
+    def __setitem__(self, index, value):
+        self.cells[self.origin + self.start + self.check_index(index)] = value
+
+
+    def check_index(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("tape index out of range")
+        return index
+
+
+    """
+    Returns the positions of the leftmost and rightmost non-blank values, as a (first, last) pair,
+    or None if the tape is blank
+    """
+    def bounds(self):
+        first = self.start
+        while first < self.end and self.read(first) == self.blank:
+            first += 1
+        if first == self.end:
+            return None
+        last = self.end - 1
+        while self.read(last) == self.blank:
+            last -= 1
+        return (first, last)
+
+
+    """
+    Returns the values between the leftmost and rightmost non-blank ones as a string,
+    like to_string().strip(blank), but without building the whole string first
+    """
+    def trimmed(self):
+        bounds = self.bounds()
+        if bounds == None:
+            return ''
+        return ''.join([self.read(pos) for pos in range(bounds[0], bounds[1] + 1)])
+
+
+    """
+    Returns the number of pages a SparseTape would need for the tape's non-blank values
+    """
+    def used_pages(self):
+        count = 0
+        for first, last in page_ranges(self.start, self.end):
+            chunk = self.cells[self.origin + first:self.origin + last]
+            if chunk.count(self.blank) < len(chunk):
+                count += 1
+        return count
+
+
+    """
+    Returns an independent copy of the tape, with the same positions
+    """
+    def copy(self):
+        return Tape(self, self.blank, self.start)
+
+
+    def __repr__(self):
+        return "Tape(%r, start=%d)" % (self.to_string(), self.start)
+
+
+
+"""
+A compact Tape, which stores a single byte per cell.
+Each value is interned to a code (its index in [symbols]), and the cells are kept in a bytearray.
+The blank value always has the code 0, so new cells can be created without filling them.
+It supports up to 256 different values, new ones are added to [symbols] when they're written.
+
+Besides the Tape methods, it can export its cells without copying them, using view(),
+and it can be converted to a string cheaply, if all the symbols are single characters.
+"""
+class ByteTape(Tape):
+
+    """
+    The constructor method
+    [values] = the initial values of the tape. If empty, the tape starts with a single blank cell.
+    [blank] = the value used for new cells
+    [start] = the position of the first value
+    [symbols] = the known values (the alphabet), like the ones returned by TuringProgram.get_symbols.
+                Their order determines the codes, but the blank value is always moved first.
+    """
+    def __init__(self, values=(), blank='_', start=0, symbols=()):
+        self.blank = blank
+        self.symbols = [blank]
+        self.codes = {blank: 0}
+        for symbol in symbols:
+            self.add_symbol(symbol)
+
+        self.cells = bytearray(self.get_code(value) for value in values) or bytearray(1)
+        self.origin = -start
+        self.start = start
+        self.end = start + len(self.cells)
+
+
+    """
+    Creates a tape directly from a sequence of codes (like a bytearray), without converting them.
+    [symbols] is the list of values for each code, its first value must be the blank one.
+    """
+    @classmethod
+    def from_codes(cls, codes, symbols, start=0):
+        tape = cls(blank=symbols[0], symbols=symbols)
+        tape.cells = bytearray(codes) or bytearray(1)
+        tape.origin = -start
+        tape.start = start
+        tape.end = start + len(tape.cells)
+        return tape
+
+
+    def add_symbol(self, symbol):
+        if symbol not in self.codes:
+            if len(self.symbols) >= 256:
+                raise ValueError("A ByteTape can't hold more than 256 different values")
+            self.codes[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return self.codes[symbol]
+
+
+    def get_code(self, value):
+        code = self.codes.get(value)
+        if code == None:
+            code = self.add_symbol(value)
+        return code
+
+
+    def read(self, pos):
+        return self.symbols[self.cells[self.origin + pos]]
+
+
+    def write(self, pos, value):
+        self.cells[self.origin + pos] = self.get_code(value)
+
+
+    def extend_left(self):
+        self.start -= 1
+        if self.origin + self.start < 0:
+            count = max(len(self.cells), 16)
+            self.cells[0:0] = bytearray(count)
+            self.origin += count
+
+
+    def extend_right(self):
+        self.end += 1
+        if self.origin + self.end > len(self.cells):
+            self.cells.append(0)
+
+
+    """
+    Returns the codes of the tape's cells (from start to end) as a memoryview, without copying them.
+    The view shouldn't be kept while the tape is still growing.
+    """
+    def view(self):
+        return memoryview(self.cells)[self.origin + self.start:self.origin + self.end]
+
+
+    def to_string(self):
+        if all(len(symbol) == 1 and ord(symbol) < 256 for symbol in self.symbols):
+            table = bytearray(256)
+            for code, symbol in enumerate(self.symbols):
+                table[code] = ord(symbol)
+            return self.view().tobytes().translate(bytes(table)).decode('latin-1')
+        return Tape.to_string(self)
+
+
+    def __iter__(self):
+        symbols = self.symbols
+        for code in self.view():
+            yield symbols[code]
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.symbols[code] for code in self.view()[index]]
+        return self.symbols[Tape.__getitem__(self, index)]
+
+
+    def __setitem__(self, index, value):
+        Tape.__setitem__(self, index, self.get_code(value))
+
+
+    def trimmed(self):
+        codes = self.view().tobytes().strip(b'\0')  #the blank value's code is 0
+        return ''.join([self.symbols[code] for code in bytearray(codes)])
+
+
+    def used_pages(self):
+        view = self.view()
+        count = 0
+        for first, last in page_ranges(self.start, self.end):
+            if view[first - self.start:last - self.start].tobytes().strip(b'\0'):
+                count += 1
+        return count
+
+
+    def copy(self):
+        return ByteTape.from_codes(self.view(), self.symbols, self.start)
+
+
+    def __repr__(self):
+        return "ByteTape(%r, start=%d)" % (self.to_string(), self.start)
+
+
+#the number of cells in each page of a SparseTape
+PAGE_SIZE = 256
+
+
+"""
+Returns the (first, last) position ranges (excluding last) of the SparseTape pages
+that cover the positions from [start] to [end] (excluding end)
+"""
+def page_ranges(start, end):
+    first = start
+    while first < end:
+        last = min((first // PAGE_SIZE + 1) * PAGE_SIZE, end)
+        yield (first, last)
+        first = last
+
+
+"""
+A Tape that only stores the parts that contain values, for machines that move far from
+their input and leave wide blank regions behind.
+The cells are split in pages of PAGE_SIZE cells, kept in a dict by their number,
+and a page is only created when a non-blank value is written in it. Growing the tape only
+moves its edges, so the memory used depends on the cells that were written, not on the tape's length.
+
+The tape still has the same cells as the other types (blank ones included), so iterating,
+indexing and to_string() see the whole tape. To get only the part with values,
+use trimmed(), which skips the blank regions without reading them.
+"""
+class SparseTape(Tape):
+    sparse = True
+
+    """
+    The constructor method
+    [values] = the initial values of the tape. If empty, the tape starts with a single blank cell.
+    [blank] = the value used for new cells
+    [start] = the position of the first value
+    """
+    def __init__(self, values=(), blank='_', start=0):
+        self.blank = blank
+        self.pages = dict()  #maps page numbers (position // PAGE_SIZE) to lists of PAGE_SIZE values
+        self.start = start
+        self.end = start
+        for value in values:
+            self.write(self.end, value)
+            self.end += 1
+        if self.end == start:
+            self.end += 1
+
+
+    """
+    Creates a SparseTape with the same values and positions as [tape], another Tape
+    """
+    @classmethod
+    def from_tape(cls, tape):
+        result = cls(blank=tape.blank, start=tape.start)
+        result.end = tape.end
+        for first, last in page_ranges(tape.start, tape.end):
+            values = tape[first - tape.start:last - tape.start]
+            if values.count(tape.blank) < len(values):
+                page = result.pages[first // PAGE_SIZE] = [tape.blank] * PAGE_SIZE
+                offset = first % PAGE_SIZE
+                page[offset:offset + len(values)] = values
+        return result
+
+
+    def read(self, pos):
+        page = self.pages.get(pos // PAGE_SIZE)
+        if page == None:
+            return self.blank
+        return page[pos % PAGE_SIZE]
+
+
+    def write(self, pos, value):
+        page = self.pages.get(pos // PAGE_SIZE)
+        if page == None:
+            if value == self.blank:
+                return
+            page = self.pages[pos // PAGE_SIZE] = [self.blank] * PAGE_SIZE
+        page[pos % PAGE_SIZE] = value
+
+
+    def extend_left(self):
+        self.start -= 1
+
+
+    def extend_right(self):
+        self.end += 1
+
+
+    def reach(self, pos):
+        self.start = min(self.start, pos)
+        self.end = max(self.end, pos + 1)
+
+
+    def to_string(self):
+        return ''.join(self)
+
+
+    """
+    Like Tape.bounds, but it only looks at the pages
+    """
+    def bounds(self):
+        first = None
+        for page_nr in sorted(self.pages):
+            page = self.pages[page_nr]
+            if page.count(self.blank) < PAGE_SIZE:
+                first = page_nr * PAGE_SIZE + next(i for i, value in enumerate(page) if value != self.blank)
+                break
+        if first == None:
+            return None
+        for page_nr in sorted(self.pages, reverse=True):
+            page = self.pages[page_nr]
+            if page.count(self.blank) < PAGE_SIZE:
+                last = page_nr * PAGE_SIZE + max(i for i, value in enumerate(page) if value != self.blank)
+                return (first, last)
+
+
+    """
+    Returns the values from position [first] to [last] (excluding last) as a list,
+    copying whole pages at a time
+    """
+    def read_range(self, first, last):
+        values = list()
+        for page_first, page_last in page_ranges(first, last):
+            page = self.pages.get(page_first // PAGE_SIZE)
+            if page == None:
+                values.extend([self.blank] * (page_last - page_first))
+            else:
+                values.extend(page[page_first % PAGE_SIZE:(page_last - 1) % PAGE_SIZE + 1])
+        return values
+
+
+    def trimmed(self):
+        bounds = self.bounds()
+        if bounds == None:
+            return ''
+        return ''.join(self.read_range(bounds[0], bounds[1] + 1))
+
+
+    def used_pages(self):
+        return len(self.pages)
+
+
+    def __iter__(self):
+        for first, last in page_ranges(self.start, self.end):
+            page = self.pages.get(first // PAGE_SIZE)
+            if page == None:
+                for pos in range(first, last):
+                    yield self.blank
+            else:
+                for value in page[first % PAGE_SIZE:(last - 1) % PAGE_SIZE + 1]:
+                    yield value
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            first, last, step = index.indices(len(self))
+            if step == 1:
+                return self.read_range(self.start + first, self.start + max(first, last))
+            return [self.read(self.start + i) for i in range(first, last, step)]
+        return self.read(self.start + self.check_index(index))
+
+
+    def __setitem__(self, index, value):
+        self.write(self.start + self.check_index(index), value)
+
+
+    def copy(self):
+        result = SparseTape(blank=self.blank, start=self.start)
+        result.pages = dict((page_nr, list(page)) for page_nr, page in self.pages.items())
+        result.end = self.end
+        return result
+
+
+    def __repr__(self):
+        bounds = self.bounds() or (0, -1)
+        return "SparseTape(%r at %d, start=%d, end=%d)" % (self.trimmed(), bounds[0], self.start, self.end)
+
+
+
+#tapes with at least this many cells are made sparse automatically (see make_sparse),
+#if at most SPARSE_DENSITY of the pages covering them hold non-blank values
+SPARSE_LENGTH = 1 << 16
+SPARSE_DENSITY = 1 / 16.0
+
+
+"""
+Returns a new Tape with the values of [tape], which can be a Tape (its type and positions are kept)
+or any sequence of values (the first one will be at position 0).
+The result always includes position 0, where the machines place their heads initially.
+[sparse] = if True, the result is a SparseTape
+"""
+def copy_tape(tape, blank, sparse=False):
+    if isinstance(tape, Tape):
+        result = tape.copy()
+        if sparse and not result.sparse:
+            result = SparseTape.from_tape(result)
+    elif sparse:
+        result = SparseTape(tape, blank)
+    else:
+        result = Tape(tape, blank)
+    result.reach(0)
+    return result
+
+
+"""
+Returns [tape] as a SparseTape if it's long enough and mostly blank (see SPARSE_LENGTH
+and SPARSE_DENSITY), otherwise returns [tape] itself.
+A page of a SparseTape takes about as much memory as the same cells of a Tape, and 8 times
+as much as those of a ByteTape, so with the default density the memory is at least halved.
+"""
+def make_sparse(tape, min_length=SPARSE_LENGTH, max_density=SPARSE_DENSITY):
+    if tape.sparse or len(tape) < min_length:
+        return tape
+    page_count = (tape.end - 1) // PAGE_SIZE - tape.start // PAGE_SIZE + 1
+    if tape.used_pages() > page_count * max_density:
+        return tape
+    return SparseTape.from_tape(tape)
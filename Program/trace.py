@@ -0,0 +1,233 @@
+"""
+File: trace.py
+Records the actions executed by a machine in a compact binary file,
+and reads them back as a stream, for analysing or replaying a run after it ended.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import gzip
+import json
+import struct
+
+from tm import TuringProgram
+from tapes import Tape
+
+
+MAGIC = b'TMTRACE1'
+GZIP_MAGIC = b'\x1f\x8b'
+
+#the size of the chunks used for reading and writing the trace
+BUFFER_SIZE = 1 << 16
+
+
+"""
+Writes a trace file. The file starts with a header, that describes the program and its
+initial tapes, so the trace can be replayed without anything else:
+    MAGIC, the header's length (4 bytes, little endian), the header (as JSON)
+It's followed by the id of each executed action, as a varint (7 bits per byte, with the highest bit
+set on all the bytes except the last one), so most programs use a single byte per step.
+The written values and head moves are determined by the action, so they aren't stored again.
+
+To record a TuringMachine, pass the writer as its [trace] argument (before the machine starts).
+[path] = the name of the trace file
+[program] = the program that will be recorded. Its current tapes are saved as the initial ones.
+[compress] = if True, the file is compressed with gzip
+"""
+class TraceWriter:
+    def __init__(self, path, program, compress=False):
+        if compress:
+            self.file = gzip.open(path, 'wb')
+        else:
+            self.file = open(path, 'wb')
+        self.buffer = bytearray()
+        self.steps = 0
+
+        header = dict(name=program.name,
+                      input_values=program.input_values,
+                      symbol_blank=program.symbol_blank,
+                      symbol_any=program.symbol_any,
+                      directions=[program.dir_left, program.dir_right, program.dir_none],
+                      state_initial=program.state_initial,
+                      state_final=program.state_final,
+                      actions=[[action['state'], action['read_values'], action['write_values'],
+                                action['directions'], action['next_state']] for action in program.actions],
+                      tapes=[dict(start=getattr(tape, 'start', 0), values=list(tape)) for tape in program.tapes])
+        header = json.dumps(header).encode('utf-8')
+        self.file.write(MAGIC + struct.pack('<I', len(header)) + header)
+
+
+    """
+    Adds an executed action to the trace
+    """
+    def record(self, action_id):
+        if action_id < 0x80:
+            self.buffer.append(action_id)
+        else:
+            while action_id >= 0x80:
+                self.buffer.append(0x80 | (action_id & 0x7f))
+                action_id >>= 7
+            self.buffer.append(action_id)
+
+        self.steps += 1
+        if len(self.buffer) >= BUFFER_SIZE:
+            self.flush()
+
+
+    def flush(self):
+        self.file.write(bytes(self.buffer))
+        self.buffer = bytearray()
+        self.file.flush()
+
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+"""
+Reads a trace file (compressed or not) written by a TraceWriter.
+The header is read when the reader is created, while the steps are only read when iterating,
+a chunk at a time, so traces larger than the available memory can be processed.
+"""
+class TraceReader:
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            compressed = file.read(2) == GZIP_MAGIC
+        if compressed:
+            self.file = gzip.open(path, 'rb')
+        else:
+            self.file = open(path, 'rb')
+
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("'%s' is not a trace file" % path)
+        length = struct.unpack('<I', self.file.read(4))[0]
+        self.header = json.loads(self.file.read(length).decode('utf-8'))
+
+
+    """
+    Rebuilds the traced program, with its initial tapes
+    """
+    def get_program(self):
+        header = self.header
+        program = TuringProgram(header['name'])
+        program.set_alphabet(header['input_values'], header['symbol_blank'])
+        program.set_directions(*header['directions'])
+        program.set_limit_states(header['state_initial'], header['state_final'])
+        program.symbol_any = header['symbol_any']
+        for action in header['actions']:
+            program.add_action(*action)
+        program.set_tapes(*[Tape(tape['values'], header['symbol_blank'], tape['start'])
+                            for tape in header['tapes']])
+        return program
+
+
+    """
+    Generates the id of each executed action, in order
+    """
+    def action_ids(self):
+        value = 0
+        shift = 0
+        while True:
+            chunk = self.file.read(BUFFER_SIZE)
+            if not chunk:
+                break
+            for byte in bytearray(chunk):
+                if byte & 0x80:
+                    value |= (byte & 0x7f) << shift
+                    shift += 7
+                else:
+                    yield value | (byte << shift)
+                    value = 0
+                    shift = 0
+
+
+    """
+    Generates the executed actions (as dicts, see TuringProgram.add_action), in order
+    """
+    def __iter__(self):
+        actions = self.get_program().actions
+        for action_id in self.action_ids():
+            yield actions[action_id]
+
+
+    """
+    Replays the traced run, generating a (step number, action, program) tuple after each step.
+    The program's tapes, along with the [tapes_pos] and [state] attributes added to it,
+    hold the configuration at that step. They are updated in place, so they should be copied
+    if they need to be kept.
+    """
+    def replay(self):
+        program = self.get_program()
+        program.tapes_pos = [0] * len(program.tapes)
+        program.state = program.state_initial
+        for tape in program.tapes:
+            tape.reach(0)
+
+        for step, action_id in enumerate(self.action_ids()):
+            action = program.actions[action_id]
+            for tape_nr, tape in enumerate(program.tapes):
+                pos = program.tapes_pos[tape_nr]
+                value = action['write_values'][tape_nr]
+                if value == program.symbol_any:  #wildcards write back the value that was read
+                    value = tape.read(pos)
+                tape.write(pos, value)
+
+                direction = action['directions'][tape_nr]
+                if direction == program.dir_left:
+                    pos -= 1
+                elif direction == program.dir_right:
+                    pos += 1
+                tape.reach(pos)
+                program.tapes_pos[tape_nr] = pos
+
+            program.state = action['next_state']
+            yield step + 1, action, program
+
+
+    def close(self):
+        self.file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+#Test Code
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import programs
+    from tm import TuringMachine
+
+    program = programs.plist.get("Multiplication")
+    path = os.path.join(tempfile.mkdtemp(), "multiplication.trace")
+
+    with TraceWriter(path, program, compress=True) as trace:
+        machine = TuringMachine(program, speed=-1, trace=trace)
+        machine.start()
+        machine.join()
+
+    with TraceReader(path) as reader:
+        for step, action, replayed in reader.replay():
+            pass
+    same = [list(tape) for tape in replayed.tapes] == [list(tape) for tape in program.tapes]
+    print("%d steps recorded in %d bytes, replay %s" % (step, os.path.getsize(path), "OK" if same else "MISMATCH"))
@@ -0,0 +1,255 @@
+"""
+File: vectorized.py
+Runs the same program on many inputs at once, in lockstep, using NumPy arrays.
+NumPy is optional, it's only needed when this module is actually used.
+"""
+
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from tm import RunResult
+from tapes import ByteTape, copy_tape
+from compiler import CompiledProgram, SparseTable, compile_program
+
+
+"""
+Returns the position of the first value of [tape] (a Tape, or a list or string of values, which start at 0)
+"""
+def get_start(tape):
+    return 0 if isinstance(tape, (list, str)) else tape.start
+
+
+"""
+Returns a function that converts a tape to an array of the codes of [compiled].
+When every symbol is a single character, the values are converted all at once, through a lookup table.
+"""
+def make_encoder(compiled):
+    def encode(tape):
+        return numpy.frombuffer(bytes(compiled.encode_tape(tape)), numpy.uint8)
+
+    if not all(len(symbol) == 1 and ord(symbol) < 256 for symbol in compiled.symbols):
+        return encode
+
+    unknown = len(compiled.symbols)  #marks the characters that aren't symbols
+    lookup = numpy.full(256, unknown, dtype=numpy.uint8)
+    for code, symbol in enumerate(compiled.symbols):
+        lookup[ord(symbol)] = code
+
+    def encode_text(tape):
+        if not isinstance(tape, (list, str)):
+            return encode(tape)
+        try:
+            text = ''.join(tape).encode('latin-1')
+        except (TypeError, UnicodeEncodeError):
+            return encode(tape)  #values that aren't characters, reported by encode_tape
+        codes = lookup[numpy.frombuffer(text, numpy.uint8)]
+        if len(codes) != len(tape) or (codes == unknown).any():
+            return encode(tape)
+        return codes
+    return encode_text
+
+
+"""
+Runs [program] (a TuringProgram or a CompiledProgram) on every item of [inputs],
+which is a list of tape lists (each tape being a Tape or a sequence of values).
+All the machines advance one step at a time, with a single set of array operations per step:
+    cells[tape_nr, machine, column] = the symbol codes of each tape of each machine
+    heads[tape_nr, index] = the column of each head of the running machines
+    states[index] = the current state id of the running machines
+The cells are read and written through a flat view, with an index computed for every head.
+The machines that halt or encounter an error are removed from the running ones (their final
+configuration is saved), so the following steps only work on the others.
+It works best with many inputs (thousands) that have similar lengths and running times, and that
+run for many steps: converting the tapes of each input and each result still takes a fixed time,
+so short runs are only a few times faster than running the inputs one by one.
+
+[max_steps] = the maximum number of steps run by each machine
+Returns a list of RunResults, in the same order as [inputs], with the same values as run_compiled.
+"""
+def run_lockstep(program, inputs, max_steps=None):
+    if numpy == None:
+        raise ImportError("run_lockstep requires NumPy")
+
+    if isinstance(program, CompiledProgram):
+        compiled = program
+    else:
+        compiled = compile_program(program)
+    if isinstance(compiled.table, SparseTable):
+        raise ValueError("The program's transition table is too big to be vectorized")
+
+    tape_count = compiled.tape_count
+    machine_count = len(inputs)
+    blank = compiled.symbols[0]
+
+    #all the machines share the same column for position 0 of each tape, so the tapes
+    #are aligned by their leftmost start
+    inputs = [[tape if isinstance(tape, (list, str)) else copy_tape(tape, blank) for tape in tapes]
+              for tapes in inputs]
+    origins = numpy.zeros(tape_count, dtype=numpy.int64)
+    width = 1
+    for tapes in inputs:
+        for tape_nr, tape in enumerate(tapes):
+            origins[tape_nr] = max(origins[tape_nr], -get_start(tape))
+    for tapes in inputs:
+        for tape_nr, tape in enumerate(tapes):
+            width = max(width, origins[tape_nr] + get_start(tape) + len(tape))
+
+    cells = numpy.zeros((tape_count, machine_count, width), dtype=numpy.uint8)
+    lows = numpy.zeros((tape_count, machine_count), dtype=numpy.int64)   #the leftmost and rightmost
+    highs = numpy.zeros((tape_count, machine_count), dtype=numpy.int64)  #columns of each tape
+    encode = make_encoder(compiled)
+    for machine, tapes in enumerate(inputs):
+        for tape_nr, tape in enumerate(tapes):
+            first = origins[tape_nr] + get_start(tape)
+            cells[tape_nr, machine, first:first + len(tape)] = encode(tape)
+            lows[tape_nr, machine] = first
+            highs[tape_nr, machine] = first + len(tape) - 1
+
+    table = numpy.array(compiled.table, dtype=numpy.int64)
+    write = numpy.array(compiled.write, dtype=numpy.uint8).reshape(-1, tape_count)  #a row for each slot
+    move = numpy.array(compiled.move, dtype=numpy.int64).reshape(-1, tape_count)
+    next_state = numpy.array(compiled.next_state, dtype=numpy.int64)
+    weights = compiled.weights
+
+    #the final configuration of each machine, filled in when it stops
+    #(the positions are relative to the origins, which change when the tapes grow)
+    final_heads = numpy.zeros((tape_count, machine_count), dtype=numpy.int64)
+    final_lows = numpy.zeros((tape_count, machine_count), dtype=numpy.int64)
+    final_highs = numpy.zeros((tape_count, machine_count), dtype=numpy.int64)
+    final_states = numpy.zeros(machine_count, dtype=numpy.int64)
+    final_slots = numpy.full(machine_count, -1, dtype=numpy.int64)
+    final_steps = numpy.zeros(machine_count, dtype=numpy.int64)
+    errors = dict()  #maps machines to their error messages
+
+    #the running machines, all at the same step (the arrays only have columns for them)
+    machines = numpy.arange(machine_count)
+    heads = numpy.repeat(origins[:, None], machine_count, axis=1)
+    states = numpy.full(machine_count, compiled.state_initial, dtype=numpy.int64)
+    slots = numpy.full(machine_count, -1, dtype=numpy.int64)
+    tape_rows = numpy.arange(tape_count, dtype=numpy.int64)[:, None] * machine_count
+
+    def stop(stopped, step):
+        done = machines[stopped]
+        final_heads[:, done] = heads[:, stopped] - origins[:, None]
+        final_lows[:, done] = lows[:, stopped] - origins[:, None]
+        final_highs[:, done] = highs[:, stopped] - origins[:, None]
+        final_states[done] = states[stopped]
+        final_slots[done] = slots[stopped]
+        final_steps[done] = step
+
+    flat = cells.reshape(-1)
+    rows = (tape_rows + machines) * width  #the index of column 0 of each tape, in [flat]
+    step = 0
+    while len(machines) and (max_steps == None or step < max_steps):
+        indexes = rows + heads
+        read = flat[indexes]
+        keys = states * compiled.stride
+        for tape_nr in range(tape_count):
+            keys += read[tape_nr] * weights[tape_nr]
+        current = table[keys]
+
+        missing = current < 0
+        if missing.any():
+            for index in numpy.nonzero(missing)[0]:
+                errors[machines[index]] = compiled.error_message(states[index], read[:, index].tolist())
+            slots[missing] = -1  #like run_compiled, a machine that stops with an error has no last action
+            stop(missing, step)
+            running = ~missing
+            machines, states, current = machines[running], states[running], current[running]
+            heads, lows, highs = heads[:, running], lows[:, running], highs[:, running]
+            indexes, rows = indexes[:, running], rows[:, running]
+            if not len(machines):
+                break
+
+        flat[indexes] = write.take(current, axis=0).T
+        heads += move.take(current, axis=0).T
+        numpy.minimum(lows, heads, out=lows)
+        numpy.maximum(highs, heads, out=highs)
+        states = next_state[current]
+        slots = current
+        step += 1
+
+        halted = states == compiled.state_final
+        if halted.any():
+            stop(halted, step)
+            running = ~halted
+            machines, states, slots = machines[running], states[running], slots[running]
+            heads, lows, highs = heads[:, running], lows[:, running], highs[:, running]
+            rows = rows[:, running]
+
+        #grow all the tapes when a head reaches one of the edges (tripling the width, so it's amortized)
+        if len(machines) and (heads.min() < 0 or heads.max() >= width):
+            extra = width
+            cells = numpy.concatenate((numpy.zeros_like(cells), cells, numpy.zeros_like(cells)), axis=2)
+            width = cells.shape[2]
+            flat = cells.reshape(-1)
+            rows = (tape_rows + machines) * width
+            heads += extra
+            lows += extra
+            highs += extra
+            origins += extra
+    stop(numpy.ones(len(machines), dtype=bool), step)  #the machines that reached the step limit
+
+    results = list()
+    for machine in range(machine_count):
+        tapes = list()
+        tapes_pos = list()
+        for tape_nr in range(tape_count):
+            low = int(final_lows[tape_nr, machine])
+            high = int(final_highs[tape_nr, machine])
+            codes = cells[tape_nr, machine, origins[tape_nr] + low:origins[tape_nr] + high + 1]
+            tapes.append(ByteTape.from_codes(codes.tobytes(), compiled.symbols, low))
+            tapes_pos.append(int(final_heads[tape_nr, machine]))
+
+        state = int(final_states[machine])
+        slot = int(final_slots[machine])
+        results.append(RunResult(tapes, tapes_pos, compiled.states[state], int(final_steps[machine]),
+                                 compiled.actions[slot] if slot >= 0 else None,
+                                 bool(state == compiled.state_final), errors.get(machine)))
+    return results
+
+
+
+#Test Code
+if __name__ == "__main__":
+    import time
+    import programs
+    import benchmark
+    from batch import random_inputs
+    from compiler import run_compiled
+
+    def summary(result):
+        return ([list(tape) for tape in result.tapes], result.tapes_pos, result.state, result.steps,
+                result.action['id'] if result.action else None, result.halted, result.error, result.status)
+
+    #short random inputs (some of them stop with an error), then a larger batch of long inputs,
+    #where most of the time is spent running the steps
+    for program in programs.plist:
+        compiled = compile_program(program)
+        for count, length in ((1000, 20), (2000, 100)):
+            if length == 20:
+                inputs = list(random_inputs(program, count, 1, length, seed=0))
+            else:
+                inputs = [benchmark.generate_input(program, length, seed) for seed in range(count)]
+
+            start = time.time()
+            results = run_lockstep(compiled, inputs, 5000)
+            vectorized_time = time.time() - start
+
+            start = time.time()
+            expected = [run_compiled(compiled, tapes, 5000) for tapes in inputs]
+            single_time = time.time() - start
+
+            same = all(summary(result) == summary(other) and type(result.halted) == bool
+                       for result, other in zip(results, expected))
+            print("%s, %d inputs of length %d: %s, lockstep %.3fs, one by one %.3fs (%.1fx)"
+                  % (program.name, count, length, "OK" if same else "MISMATCH", vectorized_time,
+                     single_time, single_time / vectorized_time))